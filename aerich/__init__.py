@@ -1,96 +1,505 @@
+import asyncio
 import os
+import re
+from collections import defaultdict
 from pathlib import Path
-from typing import TYPE_CHECKING, List, Optional, Type
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    TypeVar,
+    cast,
+)
 
 from tortoise import Tortoise, generate_schema_for_client
 from tortoise.exceptions import OperationalError
 from tortoise.transactions import in_transaction
 from tortoise.utils import get_schema_sql
 
+from aerich.backfill import Backfill, Step
+from aerich.cache import MigrationCache
+from aerich.estimate import Estimate, estimate_steps, get_table
 from aerich.exceptions import DowngradeError
+from aerich.inspectdb import Inspect
 from aerich.inspectdb.mysql import InspectMySQL
 from aerich.inspectdb.postgres import InspectPostgres
 from aerich.inspectdb.sqlite import InspectSQLite
 from aerich.migrate import MIGRATE_TEMPLATE, Migrate
 from aerich.models import Aerich
+from aerich.operations import Operation, is_transactional
+from aerich.progress import Checkpoint, clear_progress, get_progress_db
 from aerich.utils import (
     get_app_connection,
     get_app_connection_name,
     get_models_describe,
-    import_py_file,
+    split_sql,
 )
 
-if TYPE_CHECKING:
-    from aerich.inspectdb import Inspect  # noqa:F401
+T = TypeVar("T")
 
 
 class Command:
+    # seconds to wait before the first retry of a statement failed to acquire locks, doubled
+    # for each next retry up to the max
+    LOCK_RETRY_BACKOFF = 1.0
+    LOCK_RETRY_BACKOFF_MAX = 30.0
+    # number of applied statements out of transaction saved to the checkpoint at once
+    CHECKPOINT_BATCH = 20
+
     def __init__(
         self,
         tortoise_config: dict,
         app: str = "models",
         location: str = "./migrations",
+        snapshot_interval: int = 0,
+        online_ddl: bool = False,
     ) -> None:
         self.tortoise_config = tortoise_config
         self.app = app
         self.location = location
-        Migrate.app = app
+        self.snapshot_interval = snapshot_interval
+        self.online_ddl = online_ddl
+        # own planner state, so commands of different apps can run in one process
+        self._migrate = Migrate(app, snapshot_interval, online_ddl)
+        # guardrails of upgrade
+        self._timeouts: Tuple[Optional[int], Optional[int]] = (None, None)
+        self._lock_retries = 0
+        # version files with progress in aerich table, cleared once they are applied
+        self._progressed: Set[str] = set()
+
+    async def init(self, init_tortoise: bool = True) -> None:
+        await self._migrate.init(self.tortoise_config, self.app, self.location, init_tortoise)
+
+    @property
+    def cache(self) -> MigrationCache:
+        """
+        rendered migration files cache of the planner, created once migrate location is known
+        """
+        return self._migrate.get_cache()
+
+    async def _render(self, conn, version_file: str, name: str) -> Tuple[str, List[Step]]:
+        """
+        render sql of version file to run in transaction
+        :param conn:
+        :param version_file:
+        :param name: upgrade or downgrade
+        :return: sql to run in transaction and steps to run after it
+        """
+        rendered = await self.cache.render(conn, version_file, name)
+        count = self.cache.get_non_transactional(version_file, name)
+        if not isinstance(rendered, str):
+            rendered = self._mark_non_transactional(rendered, count)
+            # backfills commit their own chunks, run them and the following steps after
+            index = next(
+                (
+                    i
+                    for i, step in enumerate(rendered)
+                    if isinstance(step, Backfill) or not is_transactional(step)
+                ),
+                len(rendered),
+            )
+            return ";\n".join(cast(List[str], rendered[:index])), rendered[index:]
+        if not count:
+            return rendered, []
+        statements = split_sql(rendered)
+        if count > len(statements):
+            # statements were edited without updating the count
+            return rendered, []
+        return ";\n".join(statements[:-count]), [
+            Operation(x, transactional=False) for x in statements[-count:]
+        ]
 
-    async def init(self) -> None:
-        await Migrate.init(self.tortoise_config, self.app, self.location)
+    @staticmethod
+    def _mark_non_transactional(steps: List[Step], count: int) -> List[Step]:
+        """
+        mark the trailing statements of steps which can't run in transaction
+        :param steps:
+        :param count: number of the trailing statements
+        :return:
+        """
+        if 0 < count <= len(steps) and all(isinstance(x, str) for x in steps[-count:]):
+            return steps[:-count] + [
+                Operation(cast(str, x), transactional=False) for x in steps[-count:]
+            ]
+        return steps
 
-    async def _upgrade(self, conn, version_file) -> None:
-        file_path = Path(Migrate.migrate_location, version_file)
-        m = import_py_file(file_path)
-        upgrade = getattr(m, "upgrade")
-        await conn.execute_script(await upgrade(conn))
+    async def _load_checkpoint(
+        self, version_file: str, name: str = "upgrade", using_db=None
+    ) -> Checkpoint:
+        """
+        load statements of version file applied by previous runs
+        :param version_file:
+        :param name: upgrade or downgrade
+        :param using_db:
+        :return:
+        """
+        self._progressed.add(version_file)
+        return await Checkpoint.load(self.app, version_file, name, using_db)
+
+    async def _run_steps(
+        self, conn, version_file: str, steps: List[Step], name: str = "upgrade"
+    ) -> None:
+        """
+        run statements and backfills of version file one by one out of transaction, skip the
+        statements applied by previous runs
+        :param conn:
+        :param version_file:
+        :param steps:
+        :param name: upgrade or downgrade
+        :return:
+        """
+        checkpoint = await self._load_checkpoint(version_file, name)
+        for step in steps:
+            if isinstance(step, Backfill):
+                await step.run(conn, self.app, version_file)
+            elif not checkpoint.is_applied(step):
+                await self._execute(conn, step, is_transactional(step))
+                await checkpoint.apply(step)
+
+    async def _create_version(self, version_file: str) -> None:
         await Aerich.create(
             version=version_file,
             app=self.app,
-            content=get_models_describe(self.app),
+            content=await self._migrate.build_snapshot(get_models_describe(self.app)),
         )
+        if version_file in self._progressed:
+            await clear_progress(self.app, version_file)
 
-    async def _get_migration_files_to_upgrade(self) -> List[str]:
-        migration_files = []
-        for version_file in Migrate.get_all_version_files():
+    async def _upgrade(
+        self, conn, version_file: str, concurrency: int = 1, in_transaction: bool = False
+    ) -> List[Step]:
+        """
+        run upgrade of version file and create the version
+        :param conn:
+        :param version_file:
+        :param concurrency: run statements of waves concurrently, only out of transaction
+        :param in_transaction: conn is in transaction
+        :return: steps which can't run in transaction, the caller runs them after the
+            transaction and creates the version
+        """
+        if in_transaction:
+            upgrade_sql, non_transactional = await self._render(conn, version_file, "upgrade")
+            checkpoint = None
+            if non_transactional:
+                # the caller runs them after commit, if they fail the rerun skips the committed
+                checkpoint = await self._load_checkpoint(
+                    version_file, using_db=get_progress_db(conn)
+                )
+            if not checkpoint or not checkpoint.transaction_done:
+                if self._lock_retries and not self._migrate.ddl.TRANSACTIONAL_DDL:
+                    # executed statements are committed, retry the failed one alone
+                    await self._execute_waves(conn, upgrade_sql)
+                else:
+                    # the caller retries the whole transaction
+                    await self._execute(conn, upgrade_sql, retry=False)
+                if checkpoint:
+                    await checkpoint.apply_transaction(get_progress_db(conn))
+            if non_transactional:
+                return non_transactional
+        else:
+            rendered = await self.cache.render(conn, version_file, "upgrade")
+            count = self.cache.get_non_transactional(version_file, "upgrade")
+            waves = self.cache.get_waves(version_file) if concurrency > 1 else None
+            if not isinstance(rendered, str):
+                await self._run_steps(
+                    conn, version_file, self._mark_non_transactional(rendered, count)
+                )
+            else:
+                # statement by statement, so the rerun after failure skips the applied
+                await self._execute_waves(
+                    conn,
+                    rendered,
+                    waves,
+                    concurrency,
+                    count,
+                    await self._load_checkpoint(version_file),
+                )
+        await self._create_version(version_file)
+        return []
+
+    async def _retry(self, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        call func, retry it with exponential backoff when it failed to acquire locks in time
+        :param func:
+        :return:
+        """
+        attempt = 0
+        while True:
             try:
-                exists = await Aerich.exists(version=version_file, app=self.app)
-            except OperationalError:
-                exists = False
+                return await func()
+            except Exception as e:
+                if attempt >= self._lock_retries or not self._migrate.ddl.is_lock_timeout(e):
+                    raise
+            await asyncio.sleep(
+                min(self.LOCK_RETRY_BACKOFF * 2**attempt, self.LOCK_RETRY_BACKOFF_MAX)
+            )
+            attempt += 1
+
+    async def _execute(
+        self, conn, sql: str, transactional: bool = True, retry: bool = True
+    ) -> None:
+        """
+        execute sql after setting the timeouts in the same script, so they apply to the same
+        connection of the pool, dialects which can only set them for the session and statements
+        out of transaction run with the timeouts set on the session and restored after them
+        :param conn:
+        :param sql:
+        :param transactional: False for statements which can't run in a multi-statement script,
+            e.g. CREATE INDEX CONCURRENTLY
+        :param retry: retry when failed to acquire locks in time
+        :return:
+        """
+        ddl = self._migrate.ddl
+        timeouts = ddl.set_timeouts(*self._timeouts) if transactional else []
+        if timeouts:
+            sql = ";\n".join([*timeouts, sql])
+
+        def execute() -> Awaitable[None]:
+            if timeouts:
+                return conn.execute_script(sql)
+            return ddl.execute_with_timeouts(conn, sql, *self._timeouts)
+
+        if retry:
+            await self._retry(execute)
+        else:
+            await execute()
+
+    async def _execute_waves(
+        self,
+        conn,
+        sql: str,
+        waves: Optional[List[int]] = None,
+        concurrency: int = 1,
+        non_transactional: int = 0,
+        checkpoint: Optional[Checkpoint] = None,
+    ) -> None:
+        """
+        execute statements of each wave concurrently, every statement acquires its own
+        connection from the pool of the client, waves with several statements of a table or
+        statements of unknown table run one by one
+        :param conn:
+        :param sql:
+        :param waves: number of statements of each wave, default to one statement per wave
+        :param concurrency: max statements running at the same time
+        :param non_transactional: number of trailing statements which can't run in transaction
+        :param checkpoint: skip statements applied by previous runs and record applied ones
+        :return:
+        """
+        statements = split_sql(sql)
+        if waves is None or sum(waves) != len(statements):
+            # statements may be edited without updating waves
+            waves = [1] * len(statements)
+        transactional = len(statements) - non_transactional
+        applied = [bool(checkpoint and checkpoint.is_applied(x)) for x in statements]
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def execute(index: int) -> None:
+            if applied[index]:
+                return
+            async with semaphore:
+                await self._execute(conn, statements[index], index < transactional)
+            if checkpoint:
+                checkpoint.record(statements[index])
 
-            if not exists:
-                migration_files.append(version_file)
+        start = 0
+        try:
+            for size in waves:
+                wave = range(start, start + size)
+                tables = [get_table(statements[i]) for i in wave]
+                if None in tables or len(set(tables)) < len(tables):
+                    # waves of files generated or edited before may hold dependent statements of
+                    # a table, e.g. CREATE INDEX on the table just created
+                    for i in wave:
+                        await execute(i)
+                else:
+                    # wait for all of the wave, so the applied are saved before raising
+                    results = await asyncio.gather(
+                        *(execute(i) for i in wave), return_exceptions=True
+                    )
+                    for result in results:
+                        if isinstance(result, BaseException):
+                            raise result
+                # saved in batches after waves, to bound round trips
+                if checkpoint and checkpoint.unsaved >= self.CHECKPOINT_BATCH:
+                    await checkpoint.save()
+                start += size
+        finally:
+            # the applied are saved when a statement failed too
+            if checkpoint and checkpoint.unsaved:
+                await checkpoint.save()
 
-        return migration_files
+    async def _get_applied_versions(self) -> Set[str]:
+        try:
+            versions = await Aerich.filter(app=self.app).values_list("version", flat=True)
+        except OperationalError:
+            return set()
+        return set(cast(List[str], versions))
+
+    async def _get_migration_files_to_upgrade(self) -> List[str]:
+        applied_versions = await self._get_applied_versions()
+        return [
+            version_file
+            for version_file in self._migrate.get_all_version_files()
+            if version_file not in applied_versions
+        ]
 
     async def _run_in_transaction(self, files: List[str]) -> None:
         app_conn_name = get_app_connection_name(self.tortoise_config, self.app)
-        migrated = []
-        async with in_transaction(app_conn_name) as conn:
-            for version_file in files:
-                await self._upgrade(conn, version_file)
-                migrated.append(f"Success upgrade {version_file}")
+        migrated: List[str] = []
+        pending = files
+
+        async def upgrade_pending() -> Tuple[List[str], List[Step]]:
+            """
+            upgrade pending files in one transaction, until a file has statements which can't
+            run in it
+            """
+            upgraded: List[str] = []
+            async with in_transaction(app_conn_name) as conn:
+                for version_file in pending:
+                    upgraded.append(version_file)
+                    non_transactional = await self._upgrade(conn, version_file, in_transaction=True)
+                    if non_transactional:
+                        return upgraded, non_transactional
+            return upgraded, []
+
+        while pending:
+            if self._migrate.ddl.TRANSACTIONAL_DDL:
+                # failed statement aborts the transaction, retry it as a whole
+                upgraded, non_transactional = await self._retry(upgrade_pending)
+            else:
+                upgraded, non_transactional = await upgrade_pending()
+            pending = pending[len(upgraded) :]
+            if non_transactional:
+                # e.g. CREATE INDEX CONCURRENTLY, run after the transaction is committed
+                app_conn = get_app_connection(self.tortoise_config, self.app)
+                await self._run_steps(app_conn, upgraded[-1], non_transactional)
+                await self._create_version(upgraded[-1])
+            migrated.extend(f"Success upgrade {version_file}" for version_file in upgraded)
 
         print("\n".join(migrated))
 
-    async def _run_without_transaction(self, files: List[str]) -> None:
+    def _get_expanded_files(self, files: List[str]) -> List[str]:
+        """
+        get files to upgrade before the first contract migration, which is applied after the
+        app is deployed with its expand migration
+        :param files:
+        :return:
+        """
+        for index, version_file in enumerate(files):
+            expand_version = self.cache.get_expand_version(version_file)
+            if expand_version is not None:
+                print(
+                    f"Pending contract migration {version_file}, upgrade with --contract once"
+                    f" the app is deployed with {expand_version}"
+                )
+                return files[:index]
+        return files
+
+    async def _run_without_transaction(self, files: List[str], concurrency: int = 1) -> None:
         app_conn = get_app_connection(self.tortoise_config, self.app)
         for version_file in files:
-            await self._upgrade(app_conn, version_file)
+            await self._upgrade(app_conn, version_file, concurrency)
             print(f"Success upgrade {version_file}")
 
-    async def upgrade(self, run_in_transaction: bool = True) -> None:
+    async def upgrade(
+        self,
+        run_in_transaction: bool = True,
+        concurrency: int = 1,
+        lock_timeout: Optional[int] = None,
+        statement_timeout: Optional[int] = None,
+        lock_retries: int = 0,
+        contract: bool = False,
+    ) -> None:
+        """
+        upgrade to latest version
+        :param run_in_transaction:
+        :param concurrency: run independent statements of UPGRADE_WAVES concurrently,
+            only when not in transaction
+        :param lock_timeout: milliseconds a statement waits for locks, so a statement queued
+            behind a long transaction doesn't block the queries queued behind it
+        :param statement_timeout: milliseconds a statement can run
+        :param lock_retries: times to retry a statement failed to acquire locks in time
+        :param contract: apply contract migrations too, otherwise stop before the first one
+        :return:
+        """
+        self._timeouts = (lock_timeout, statement_timeout)
+        self._lock_retries = lock_retries
         migration_files = await self._get_migration_files_to_upgrade()
+        if not contract:
+            migration_files = self._get_expanded_files(migration_files)
 
-        if run_in_transaction:
-            await self._run_in_transaction(migration_files)
-        else:
-            await self._run_without_transaction(migration_files)
+        try:
+            if run_in_transaction:
+                await self._run_in_transaction(migration_files)
+            else:
+                await self._run_without_transaction(migration_files, concurrency)
+        finally:
+            self.cache.save()
+
+    @classmethod
+    async def upgrade_all(
+        cls,
+        tortoise_config: dict,
+        location: str = "./migrations",
+        snapshot_interval: int = 0,
+        run_in_transaction: bool = True,
+        init_tortoise: bool = True,
+        concurrency: int = 1,
+        lock_timeout: Optional[int] = None,
+        statement_timeout: Optional[int] = None,
+        lock_retries: int = 0,
+        contract: bool = False,
+        online_ddl: bool = False,
+    ) -> None:
+        """
+        upgrade all apps which have migrate location, apps of the same connection are upgraded
+        one by one in config order, different connections are upgraded concurrently
+        :param tortoise_config:
+        :param location:
+        :param snapshot_interval:
+        :param run_in_transaction:
+        :param init_tortoise: False if Tortoise is already initialized
+        :param concurrency:
+        :param lock_timeout:
+        :param statement_timeout:
+        :param lock_retries:
+        :param contract:
+        :param online_ddl:
+        :return:
+        """
+        if init_tortoise:
+            await Tortoise.init(config=tortoise_config)
+        connections: Dict[str, List[Command]] = defaultdict(list)
+        for app in tortoise_config["apps"]:
+            if not Path(location, app).exists():
+                continue
+            command = cls(tortoise_config, app, location, snapshot_interval, online_ddl)
+            await command.init(init_tortoise=False)
+            connections[get_app_connection_name(tortoise_config, app)].append(command)
+
+        async def upgrade_connection(commands: List[Command]) -> None:
+            for command in commands:
+                await command.upgrade(
+                    run_in_transaction,
+                    concurrency,
+                    lock_timeout,
+                    statement_timeout,
+                    lock_retries,
+                    contract,
+                )
+
+        await asyncio.gather(*(upgrade_connection(commands) for commands in connections.values()))
 
     async def downgrade(self, version: int, delete: bool) -> List[str]:
         ret: List[str] = []
         if version == -1:
-            specified_version = await Migrate.get_last_version()
+            specified_version = await self._migrate.get_last_version()
         else:
             specified_version = await Aerich.filter(
                 app=self.app, version__startswith=f"{version}_"
@@ -101,52 +510,142 @@ class Command:
             versions = [specified_version]
         else:
             versions = await Aerich.filter(app=self.app, pk__gte=specified_version.pk)
-        for version_obj in versions:
-            file = version_obj.version
-            async with in_transaction(
-                get_app_connection_name(self.tortoise_config, self.app)
-            ) as conn:
-                file_path = Path(Migrate.migrate_location, file)
-                m = import_py_file(file_path)
-                downgrade = getattr(m, "downgrade")
-                downgrade_sql = await downgrade(conn)
-                if not downgrade_sql.strip():
-                    raise DowngradeError("No downgrade items found")
-                await conn.execute_script(downgrade_sql)
-                await version_obj.delete()
+        try:
+            for version_obj in versions:
+                file = version_obj.version
+                async with in_transaction(
+                    get_app_connection_name(self.tortoise_config, self.app)
+                ) as conn:
+                    downgrade_sql, non_transactional = await self._render(conn, file, "downgrade")
+                    # steps may be empty, e.g. of expand migrations with nothing to expand
+                    if (
+                        not downgrade_sql.strip()
+                        and not non_transactional
+                        and isinstance(await self.cache.render(conn, file, "downgrade"), str)
+                    ):
+                        raise DowngradeError("No downgrade items found")
+                    checkpoint = None
+                    if non_transactional:
+                        # keep the version until the steps run, a rerun skips the committed part
+                        checkpoint = await self._load_checkpoint(
+                            file, "downgrade", using_db=get_progress_db(conn)
+                        )
+                    if not checkpoint or not checkpoint.transaction_done:
+                        await conn.execute_script(downgrade_sql)
+                        if checkpoint:
+                            await checkpoint.apply_transaction(get_progress_db(conn))
+                    if not non_transactional:
+                        await version_obj.delete()
+                if non_transactional:
+                    app_conn = get_app_connection(self.tortoise_config, self.app)
+                    await self._run_steps(app_conn, file, non_transactional, "downgrade")
+                    await version_obj.delete()
+                    await clear_progress(self.app, file)
                 if delete:
-                    os.unlink(file_path)
+                    os.unlink(Path(self._migrate.migrate_location, file))
                 ret.append(file)
+        finally:
+            self.cache.save()
         return ret
 
+    async def estimate(self) -> List[Estimate]:
+        """
+        estimate cost of statements of pending migrations from the size of their tables, so
+        migrations which rewrite or lock big tables can be planned in a maintenance window
+        :return:
+        """
+        conn = get_app_connection(self.tortoise_config, self.app)
+        files: Dict[str, List[Step]] = {}
+        try:
+            for version_file in await self._get_migration_files_to_upgrade():
+                rendered = await self.cache.render(conn, version_file, "upgrade")
+                files[version_file] = (
+                    cast(List[Step], split_sql(rendered)) if isinstance(rendered, str) else rendered
+                )
+        finally:
+            self.cache.save()
+        tables = {
+            step.table if isinstance(step, Backfill) else get_table(step)
+            for steps in files.values()
+            for step in steps
+        }
+        stats = await self._migrate.ddl.get_table_stats(sorted(filter(None, tables)))
+        return [
+            estimate
+            for version_file, steps in files.items()
+            for estimate in estimate_steps(self._migrate.ddl, version_file, steps, stats)
+        ]
+
     async def heads(self) -> List[str]:
-        ret = []
-        versions = Migrate.get_all_version_files()
-        for version in versions:
-            if not await Aerich.exists(version=version, app=self.app):
-                ret.append(version)
-        return ret
+        return await self._get_migration_files_to_upgrade()
 
     async def history(self) -> List[str]:
-        versions = Migrate.get_all_version_files()
+        versions = self._migrate.get_all_version_files()
         return [version for version in versions]
 
-    async def inspectdb(self, tables: Optional[List[str]] = None) -> str:
+    async def inspectdb(self, tables: Optional[List[str]] = None, concurrency: int = 8) -> str:
+        return await self._get_inspect(tables, concurrency).inspect()
+
+    async def inspectdb_models(
+        self, tables: Optional[List[str]] = None, concurrency: int = 8
+    ) -> AsyncIterator[Tuple[str, str]]:
+        """
+        stream models of tables one by one instead of building the whole source
+        :param tables: tables to inspect, all tables if not given
+        :param concurrency: max tables introspected at once when catalog can't be queried in bulk
+        :return: (table, source of model)
+        """
+        async for table, model in self._get_inspect(tables, concurrency).inspect_models():
+            yield table, model
+
+    async def inspectdb_to_dir(
+        self, directory: str, tables: Optional[List[str]] = None, concurrency: int = 8
+    ) -> AsyncIterator[Path]:
+        """
+        write model of each table to a module of the package directory, the package imports all
+        models so it can be used as models of an app
+        :param directory:
+        :param tables: tables to inspect, all tables if not given
+        :param concurrency: max tables introspected at once when catalog can't be queried in bulk
+        :return: paths of written files
+        """
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        inspect = self._get_inspect(tables, concurrency)
+        imports = []
+        async for table, model in inspect.inspect_models():
+            module = re.sub(r"\W", "_", table)
+            path = Path(directory, f"{module}.py")
+            path.write_text(inspect.module_source([model]) + "\n", encoding="utf-8")
+            imports.append(f"from .{module} import {inspect.model_name(table)}  # noqa:F401\n")
+            yield path
+        path = Path(directory, "__init__.py")
+        path.write_text("".join(imports), encoding="utf-8")
+        yield path
+
+    def _get_inspect(self, tables: Optional[List[str]] = None, concurrency: int = 8) -> Inspect:
         connection = get_app_connection(self.tortoise_config, self.app)
         dialect = connection.schema_generator.DIALECT
         if dialect == "mysql":
-            cls: Type["Inspect"] = InspectMySQL
+            cls: Type[Inspect] = InspectMySQL
         elif dialect == "postgres":
             cls = InspectPostgres
         elif dialect == "sqlite":
             cls = InspectSQLite
         else:
             raise NotImplementedError(f"{dialect} is not supported")
-        inspect = cls(connection, tables)
-        return await inspect.inspect()
+        return cls(connection, tables, concurrency)
 
-    async def migrate(self, name: str = "update", empty: bool = False) -> str:
-        return await Migrate.migrate(name, empty)
+    async def migrate(
+        self,
+        name: str = "update",
+        empty: bool = False,
+        online: Optional[bool] = None,
+        expand_contract: bool = False,
+    ) -> str:
+        try:
+            return await self._migrate.migrate(name, empty, online, expand_contract)
+        finally:
+            self.cache.save()
 
     async def init_db(self, safe: bool) -> None:
         location = self.location
@@ -160,11 +659,11 @@ class Command:
 
         schema = get_schema_sql(connection, safe)
 
-        version = await Migrate.generate_version()
+        version = await self._migrate.generate_version()
         await Aerich.create(
             version=version,
             app=app,
-            content=get_models_describe(app),
+            content=await self._migrate.build_snapshot(get_models_describe(app)),
         )
         version_file = Path(dirname, version)
         content = MIGRATE_TEMPLATE.format(upgrade_sql=schema, downgrade_sql="")
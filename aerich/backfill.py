@@ -0,0 +1,151 @@
+import asyncio
+from typing import Any, Optional, Union, cast
+
+from tortoise import BaseDBAsyncClient
+from tortoise.transactions import in_transaction
+
+from aerich.progress import get_progress, get_progress_db
+
+
+class Backfill:
+    """
+    Data migration step which updates rows of a table in chunks paginated by primary key,
+    so a huge table isn't updated by one long statement holding locks. Return it from upgrade
+    of migration file along with sql, e.g.
+
+        async def upgrade(db: BaseDBAsyncClient) -> List[Union[str, Backfill]]:
+            return [
+                'ALTER TABLE "user" ADD "email_lower" VARCHAR(200)',
+                Backfill("user", '"email_lower" = LOWER("email")', where='"email_lower" IS NULL'),
+                'ALTER TABLE "user" ALTER COLUMN "email_lower" SET NOT NULL',
+            ]
+
+    Each chunk is committed with the progress in aerich table, so an interrupted backfill
+    resumes after the last committed chunk.
+    """
+
+    def __init__(
+        self,
+        table: str,
+        set_sql: str,
+        where: Optional[str] = None,
+        pk: str = "id",
+        batch_size: int = 1000,
+        throttle: float = 0,
+        name: Optional[str] = None,
+    ) -> None:
+        """
+        :param table: table name
+        :param set_sql: assignments of UPDATE, e.g. `"a" = "b" + 1`
+        :param where: condition of rows to update
+        :param pk: column to paginate by, must be unique and ordered
+        :param batch_size: max rows of each chunk
+        :param throttle: seconds to sleep between chunks, to leave room for other queries
+        :param name: name of progress, default to table name, must be unique in migration file
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be positive")
+        self.table = table
+        self.set_sql = set_sql
+        self.where = where
+        self.pk = pk
+        self.batch_size = batch_size
+        self.throttle = throttle
+        self.name = name or table
+
+    def __repr__(self) -> str:
+        # arguments differing from defaults, so it can be rendered into migration file
+        args = [repr(self.table), repr(self.set_sql)]
+        for key, default in (
+            ("where", None),
+            ("pk", "id"),
+            ("batch_size", 1000),
+            ("throttle", 0),
+            ("name", self.table),
+        ):
+            value = getattr(self, key)
+            if value != default:
+                args.append(f"{key}={value!r}")
+        return f"Backfill({', '.join(args)})"
+
+    @staticmethod
+    def _literal(value: Union[int, str]) -> str:
+        if isinstance(value, int):
+            return str(value)
+        return "'{}'".format(value.replace("'", "''"))
+
+    def _condition(self, quote, last: Optional[Union[int, str]]) -> str:
+        conditions = []
+        if last is not None:
+            conditions.append(f"{quote(self.pk)} > {self._literal(last)}")
+        if self.where:
+            conditions.append(f"({self.where})")
+        return f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    async def _next_bound(
+        self, conn: BaseDBAsyncClient, last: Optional[Union[int, str]]
+    ) -> Optional[Union[int, str]]:
+        """
+        get primary key of the last row of the next chunk
+        :param conn:
+        :param last: primary key of the last row of the previous chunk
+        :return: None if there is no row left
+        """
+        quote = conn.schema_generator(conn).quote
+        pk = quote(self.pk)
+        rows = await conn.execute_query_dict(
+            f"SELECT MAX({pk}) AS bound FROM (SELECT {pk} FROM {quote(self.table)}"
+            f"{self._condition(quote, last)} ORDER BY {pk} LIMIT {self.batch_size})"
+            f" AS {quote('chunk')}"
+        )
+        bound: Any = rows[0]["bound"] if rows else None
+        if bound is None or isinstance(bound, int):
+            return bound
+        return str(bound)
+
+    async def _update(
+        self, conn: BaseDBAsyncClient, last: Optional[Union[int, str]], bound: Union[int, str]
+    ) -> int:
+        quote = conn.schema_generator(conn).quote
+        condition = self._condition(quote, last)
+        condition += " AND " if condition else " WHERE "
+        condition += f"{quote(self.pk)} <= {self._literal(bound)}"
+        count, _ = await conn.execute_query(
+            f"UPDATE {quote(self.table)} SET {self.set_sql}{condition}"
+        )
+        return count
+
+    async def run(self, conn: BaseDBAsyncClient, app: str, version: str) -> int:
+        """
+        update all rows chunk by chunk, resume from the progress if it was interrupted
+        :param conn: connection of app out of transaction
+        :param app:
+        :param version: version file name
+        :return: number of updated rows
+        """
+        progress = await get_progress(
+            app, version, f"backfill:{self.name}", {"last": None, "rows": 0, "done": False}
+        )
+        # commit progress with the chunk if aerich table is in the same database
+        same_db = get_progress_db(conn) is not None
+        content = cast(dict, progress.content)
+        while not content["done"]:
+            async with in_transaction(conn.connection_name) as tx:
+                bound = await self._next_bound(tx, content["last"])
+                if bound is None:
+                    content = dict(content, done=True)
+                else:
+                    count = await self._update(tx, content["last"], bound)
+                    content = dict(content, last=bound, rows=content["rows"] + count)
+                progress.content = content
+                if same_db:
+                    await progress.save(using_db=tx, update_fields=["content"])
+            if not same_db:
+                await progress.save(update_fields=["content"])
+            if self.throttle and not content["done"]:
+                await asyncio.sleep(self.throttle)
+        return content["rows"]
+
+
+# step of migration, sql or backfill
+Step = Union[str, Backfill]
@@ -0,0 +1,183 @@
+import ast
+import hashlib
+import json
+import os
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Dict, List, Optional, Union
+
+from tortoise import BaseDBAsyncClient
+
+from aerich.backfill import Step
+from aerich.utils import import_py_file
+
+CACHE_VERSION = 4
+# module level constants of migration file to entry keys
+CONSTANTS = {
+    "UPGRADE_WAVES": "waves",
+    "UPGRADE_NON_TRANSACTIONAL": "upgrade_non_transactional",
+    "DOWNGRADE_NON_TRANSACTIONAL": "downgrade_non_transactional",
+    "EXPAND_VERSION": "expand_version",
+}
+
+
+def _get_static_return(node: Union[ast.FunctionDef, ast.AsyncFunctionDef]) -> Optional[str]:
+    """
+    get the returned string if the function body is only `return "<sql>"`
+    :param node:
+    :return:
+    """
+    body = node.body
+    if (
+        body
+        and isinstance(body[0], ast.Expr)
+        and isinstance(body[0].value, ast.Constant)
+        and isinstance(body[0].value.value, str)
+    ):
+        # skip docstring
+        body = body[1:]
+    if len(body) != 1 or not isinstance(body[0], ast.Return):
+        return None
+    value = body[0].value
+    if isinstance(value, ast.Constant) and isinstance(value.value, str):
+        return value.value
+    return None
+
+
+def _get_literal(node: ast.Assign) -> Any:
+    """
+    get value of assignment if it's a literal
+    :param node:
+    :return:
+    """
+    try:
+        return ast.literal_eval(node.value)
+    except ValueError:
+        return None
+
+
+def compile_migration(source: Union[str, bytes]) -> Dict[str, Any]:
+    """
+    render the sql of upgrade/downgrade functions which return static strings
+    :param source: content of migration file
+    :return: dict of function name to sql, None means it has to be called,
+        and values of CONSTANTS, None if not exist
+    """
+    ret: Dict[str, Any] = {"upgrade": None, "downgrade": None}
+    ret.update(dict.fromkeys(CONSTANTS.values()))
+    for node in ast.parse(source).body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name in ret:
+            ret[node.name] = _get_static_return(node)
+        elif isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name) and target.id in CONSTANTS:
+                    ret[CONSTANTS[target.id]] = _get_literal(node)
+    return ret
+
+
+class MigrationCache:
+    """
+    Cache of rendered migration files, stored next to the version files and
+    keyed by file mtime and content hash, so replaying a long chain of
+    migrations doesn't need to import every module.
+    """
+
+    filename = ".aerich_cache.json"
+
+    def __init__(self, location: Union[str, Path]) -> None:
+        self.location = Path(location)
+        self.path = Path(location, self.filename)
+        self._entries = self._load()
+        self._modules: Dict[str, ModuleType] = {}
+        self._changed = False
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            content = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(content, dict) or content.get("version") != CACHE_VERSION:
+            return {}
+        return content.get("files") or {}
+
+    def save(self) -> None:
+        if not self._changed:
+            return
+        files = set(os.listdir(self.location))
+        content = {
+            "version": CACHE_VERSION,
+            "files": {k: v for k, v in sorted(self._entries.items()) if k in files},
+        }
+        try:
+            self.path.write_text(json.dumps(content, indent=2), encoding="utf-8")
+        except OSError:
+            # cache is optional, e.g. migrations folder may be read-only in deployment
+            return
+        self._changed = False
+
+    def _get_entry(self, version_file: str) -> dict:
+        file_path = Path(self.location, version_file)
+        stat = file_path.stat()
+        entry = self._entries.get(version_file)
+        if entry and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            return entry
+        content = file_path.read_bytes()
+        digest = hashlib.sha256(content).hexdigest()
+        if not entry or entry["hash"] != digest:
+            entry = {"hash": digest, **compile_migration(content)}
+        entry.update(mtime=stat.st_mtime_ns, size=stat.st_size)
+        self._entries[version_file] = entry
+        self._changed = True
+        return entry
+
+    def _import(self, version_file: str) -> ModuleType:
+        module = self._modules.get(version_file)
+        if module is None:
+            module = self._modules[version_file] = import_py_file(Path(self.location, version_file))
+        return module
+
+    def get_waves(self, version_file: str) -> Optional[List[int]]:
+        """
+        get number of statements of each wave of upgrade
+        :param version_file:
+        :return: None if version file has no valid UPGRADE_WAVES
+        """
+        waves = self._get_entry(version_file).get("waves")
+        if isinstance(waves, list) and all(isinstance(x, int) and x > 0 for x in waves):
+            return waves
+        return None
+
+    def get_non_transactional(self, version_file: str, name: str) -> int:
+        """
+        get number of trailing statements which can't run in transaction
+        :param version_file:
+        :param name: upgrade or downgrade
+        :return:
+        """
+        count = self._get_entry(version_file).get(f"{name}_non_transactional")
+        return count if isinstance(count, int) and count > 0 else 0
+
+    def get_expand_version(self, version_file: str) -> Optional[str]:
+        """
+        get the expand migration of a contract migration
+        :param version_file:
+        :return: None if version file isn't a contract migration
+        """
+        expand_version = self._get_entry(version_file).get("expand_version")
+        return expand_version if isinstance(expand_version, str) else None
+
+    async def render(
+        self, conn: BaseDBAsyncClient, version_file: str, name: str
+    ) -> Union[str, List[Step]]:
+        """
+        get sql of upgrade or downgrade of version file
+        :param conn:
+        :param version_file:
+        :param name: upgrade or downgrade
+        :return: sql, or steps if the function returns backfills with sql
+        """
+        sql = self._get_entry(version_file).get(name)
+        if sql is not None:
+            return sql
+        func = getattr(self._import(version_file), name)
+        return await func(conn)
@@ -1,6 +1,6 @@
 import os
 from pathlib import Path
-from typing import Dict, List, cast
+from typing import Any, Dict, List, Optional, cast
 
 import asyncclick as click
 import tomlkit
@@ -9,12 +9,15 @@ from tomlkit.exceptions import NonExistentKey
 
 from aerich import Command
 from aerich.enums import Color
+from aerich.estimate import format_size
 from aerich.exceptions import DowngradeError
 from aerich.utils import add_src_path, get_tortoise_config
 from aerich.version import __version__
 
-CONFIG_DEFAULT_VALUES = {
+CONFIG_DEFAULT_VALUES: Dict[str, Any] = {
     "src_folder": ".",
+    "snapshot_interval": 0,
+    "online_ddl": False,
 }
 
 
@@ -45,6 +48,10 @@ async def cli(ctx: Context, config, app) -> None:
             location = tool["location"]
             tortoise_orm = tool["tortoise_orm"]
             src_folder = tool.get("src_folder", CONFIG_DEFAULT_VALUES["src_folder"])
+            snapshot_interval = int(
+                tool.get("snapshot_interval", CONFIG_DEFAULT_VALUES["snapshot_interval"])
+            )
+            online_ddl = bool(tool.get("online_ddl", CONFIG_DEFAULT_VALUES["online_ddl"]))
         except NonExistentKey:
             raise UsageError("You need run aerich init again when upgrade to 0.6.0+")
         add_src_path(src_folder)
@@ -52,21 +59,43 @@ async def cli(ctx: Context, config, app) -> None:
         if not app:
             apps_config = cast(dict, tortoise_config.get("apps"))
             app = list(apps_config.keys())[0]
-        command = Command(tortoise_config=tortoise_config, app=app, location=location)
+        command = Command(
+            tortoise_config=tortoise_config,
+            app=app,
+            location=location,
+            snapshot_interval=snapshot_interval,
+            online_ddl=online_ddl,
+        )
         ctx.obj["command"] = command
-        if invoked_subcommand != "init-db":
-            if not Path(location, app).exists():
-                raise UsageError("You must exec init-db first", ctx=ctx)
-            await command.init()
+        # upgrade inits the app itself, as --all-apps doesn't need the default one
+        if invoked_subcommand not in ("init-db", "upgrade"):
+            await _init_command(ctx, command)
+
+
+async def _init_command(ctx: Context, command: Command) -> None:
+    if not Path(command.location, command.app).exists():
+        raise UsageError("You must exec init-db first", ctx=ctx)
+    await command.init()
 
 
 @cli.command(help="Generate migrate changes file.")
 @click.option("--name", default="update", show_default=True, help="Migrate name.")
 @click.option("--empty", default=False, is_flag=True, help="Generate empty migration file.")
+@click.option(
+    "--online/--no-online",
+    default=None,
+    help="Generate online DDL which doesn't block writes, default to online_ddl in config.",
+)
+@click.option(
+    "--expand-contract",
+    default=False,
+    is_flag=True,
+    help="Split renames, type changes and drops into an expand and a contract migration.",
+)
 @click.pass_context
-async def migrate(ctx: Context, name, empty) -> None:
+async def migrate(ctx: Context, name, empty, online, expand_contract) -> None:
     command = ctx.obj["command"]
-    ret = await command.migrate(name, empty)
+    ret = await command.migrate(name, empty, online, expand_contract)
     if not ret:
         return click.secho("No changes detected", fg=Color.yellow)
     click.secho(f"Success migrate {ret}", fg=Color.green)
@@ -80,11 +109,83 @@ async def migrate(ctx: Context, name, empty) -> None:
     type=bool,
     help="Make migrations in transaction or not. Can be helpful for large migrations or creating concurrent indexes.",
 )
+@click.option(
+    "--all-apps",
+    is_flag=True,
+    default=False,
+    help="Upgrade all apps, apps of different connections are upgraded concurrently.",
+)
+@click.option(
+    "--concurrency",
+    default=1,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="Run independent statements concurrently with up to this number of connections, requires --in-transaction False.",
+)
+@click.option(
+    "--lock-timeout",
+    type=click.IntRange(min=1),
+    help="Milliseconds a statement waits for locks before it fails.",
+)
+@click.option(
+    "--statement-timeout",
+    type=click.IntRange(min=1),
+    help="Milliseconds a statement can run before it fails, PostgreSQL only.",
+)
+@click.option(
+    "--lock-retries",
+    default=0,
+    type=click.IntRange(min=0),
+    show_default=True,
+    help="Times to retry a statement failed to acquire locks in time, with exponential backoff.",
+)
+@click.option(
+    "--contract",
+    default=False,
+    is_flag=True,
+    help="Apply contract migrations, run it after the app is deployed with their expand migrations.",
+)
 @click.pass_context
-async def upgrade(ctx: Context, in_transaction: bool) -> None:
+async def upgrade(
+    ctx: Context,
+    in_transaction: bool,
+    all_apps: bool,
+    concurrency: int,
+    lock_timeout: Optional[int],
+    statement_timeout: Optional[int],
+    lock_retries: int,
+    contract: bool,
+) -> None:
     command = ctx.obj["command"]
+    if concurrency > 1 and in_transaction:
+        raise click.BadOptionUsage(
+            option_name="--concurrency",
+            message="--concurrency requires --in-transaction False",
+        )
     # TODO: command output moved into the command itself but it requires a better design
-    await command.upgrade(run_in_transaction=in_transaction)
+    if all_apps:
+        await Command.upgrade_all(
+            command.tortoise_config,
+            command.location,
+            command.snapshot_interval,
+            run_in_transaction=in_transaction,
+            concurrency=concurrency,
+            lock_timeout=lock_timeout,
+            statement_timeout=statement_timeout,
+            lock_retries=lock_retries,
+            contract=contract,
+            online_ddl=command.online_ddl,
+        )
+    else:
+        await _init_command(ctx, command)
+        await command.upgrade(
+            run_in_transaction=in_transaction,
+            concurrency=concurrency,
+            lock_timeout=lock_timeout,
+            statement_timeout=statement_timeout,
+            lock_retries=lock_retries,
+            contract=contract,
+        )
 
 
 @cli.command(help="Downgrade to specified version.")
@@ -129,6 +230,34 @@ async def heads(ctx: Context) -> None:
         click.secho(version, fg=Color.green)
 
 
+@cli.command(help="Estimate cost of pending migrations from the size of the tables they change.")
+@click.pass_context
+async def estimate(ctx: Context) -> None:
+    command = ctx.obj["command"]
+    estimates = await command.estimate()
+    if not estimates:
+        return click.secho("No available heads, try migrate first", fg=Color.green)
+    for item in estimates:
+        statement = item.statement.strip().splitlines()[0]
+        if len(statement) > 80:
+            statement = statement[:77] + "..."
+        if item.table is None:
+            stats = ""
+        elif item.rows is None:
+            stats = f" {item.table}"
+        else:
+            stats = f" {item.table} ({item.rows} rows, {format_size(item.size)})"
+        if item.heavy and item.duration not in ("instant", "seconds"):
+            color = Color.red
+        elif item.heavy or item.duration == "unknown":
+            color = Color.yellow
+        else:
+            color = Color.green
+        click.secho(
+            f"{item.version}: {item.impact}, {item.duration}{stats}\n    {statement}", fg=color
+        )
+
+
 @cli.command(help="List all migrate items.")
 @click.pass_context
 async def history(ctx: Context) -> None:
@@ -226,11 +355,32 @@ async def init_db(ctx: Context, safe: bool) -> None:
     multiple=True,
     required=False,
 )
+@click.option(
+    "-o",
+    "--output-dir",
+    help="Write model of each table to a module of the package directory instead.",
+    required=False,
+)
+@click.option(
+    "--concurrency",
+    default=8,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="Max tables introspected at once when the catalog can't be queried in bulk.",
+)
 @click.pass_context
-async def inspectdb(ctx: Context, table: List[str]) -> None:
+async def inspectdb(
+    ctx: Context, table: List[str], output_dir: Optional[str], concurrency: int
+) -> None:
     command = ctx.obj["command"]
-    ret = await command.inspectdb(table)
-    click.secho(ret)
+    if output_dir:
+        async for path in command.inspectdb_to_dir(output_dir, table, concurrency):
+            click.secho(f"Success write {path}", fg=Color.green, err=True)
+        return
+    # stream models as they are generated, so large schemas can be piped
+    click.echo("from tortoise import Model, fields")
+    async for _, model in command.inspectdb_models(table, concurrency):
+        click.echo(f"\n\n{model}")
 
 
 def main() -> None:
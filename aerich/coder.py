@@ -1,6 +1,8 @@
 import base64
+import importlib
 import json
 import pickle  # nosec: B301,B403
+import zlib
 from typing import Any, Union
 
 from tortoise.indexes import Index
@@ -9,24 +11,62 @@ from tortoise.indexes import Index
 class JsonEncoder(json.JSONEncoder):
     def default(self, obj) -> Any:
         if isinstance(obj, Index):
+            if obj.expressions:
+                # expressions are pypika terms which can't be described declaratively
+                return {
+                    "type": "index",
+                    "val": base64.b64encode(pickle.dumps(obj)).decode(),  # nosec: B301
+                }
             return {
                 "type": "index",
-                "val": base64.b64encode(pickle.dumps(obj)).decode(),  # nosec: B301
+                "class": f"{obj.__class__.__module__}.{obj.__class__.__qualname__}",
+                "fields": obj.fields,
+                "name": obj.name,
+                "extra": obj.extra,
             }
         else:
             return super().default(obj)
 
 
+def load_index(obj: dict) -> Index:
+    """
+    rebuild index from declarative encoding without calling __init__,
+    as dialect specific options like condition are already rendered in extra
+    :param obj:
+    :return:
+    """
+    module_name, _, class_name = obj["class"].rpartition(".")
+    index_cls = getattr(importlib.import_module(module_name), class_name)
+    if not (isinstance(index_cls, type) and issubclass(index_cls, Index)):
+        raise TypeError(f"{obj['class']} is not an index class")
+    index = index_cls.__new__(index_cls)
+    index.fields = list(obj["fields"])
+    index.name = obj["name"]
+    index.expressions = ()
+    index.extra = obj["extra"]
+    return index
+
+
 def object_hook(obj) -> Any:
-    _type = obj.get("type")
-    if not _type:
+    if obj.get("type") != "index":
         return obj
-    return pickle.loads(base64.b64decode(obj["val"]))  # nosec: B301
+    if "val" in obj:
+        # legacy pickled index
+        return pickle.loads(base64.b64decode(obj["val"]))  # nosec: B301
+    return load_index(obj)
 
 
-def encoder(obj: dict) -> str:
+def encoder(obj: Any) -> str:
     return json.dumps(obj, cls=JsonEncoder)
 
 
 def decoder(obj: Union[str, bytes]) -> Any:
     return json.loads(obj, object_hook=object_hook)
+
+
+def compress(obj: Any) -> str:
+    return base64.b64encode(zlib.compress(encoder(obj).encode())).decode()
+
+
+def decompress(data: str) -> Any:
+    return decoder(zlib.decompress(base64.b64decode(data)))
@@ -1,10 +1,26 @@
+import math
+import re
 from enum import Enum
-from typing import Any, List, Type, cast
+from typing import Any, Dict, List, Optional, Tuple, Type, TypeVar, cast
 
 from tortoise import BaseDBAsyncClient, Model
 from tortoise.backends.base.schema_generator import BaseSchemaGenerator
+from tortoise.exceptions import BaseORMException, OperationalError
 
-from aerich.utils import is_default_function
+from aerich.estimate import METADATA, SCAN, TableStats
+from aerich.exceptions import NotSupportError
+from aerich.operations import (
+    AddFK,
+    AddIndex,
+    CreateM2M,
+    DropFK,
+    DropIndex,
+    DropM2M,
+    RebuildTable,
+)
+from aerich.utils import is_default_function, split_sql
+
+IndexOperation = TypeVar("IndexOperation", AddIndex, DropIndex)
 
 
 class BaseDDL:
@@ -21,6 +37,10 @@ class BaseDDL:
         'ALTER TABLE "{table_name}" ADD {unique}INDEX "{index_name}" ({column_names})'
     )
     _DROP_INDEX_TEMPLATE = 'ALTER TABLE "{table_name}" DROP INDEX "{index_name}"'
+    # templates of online mode which doesn't block writes, None if not supported
+    _ADD_INDEX_ONLINE_TEMPLATE: Optional[str] = None
+    _DROP_INDEX_ONLINE_TEMPLATE: Optional[str] = None
+    _ONLINE_INDEX_TRANSACTIONAL = True
     _ADD_FK_TEMPLATE = 'ALTER TABLE "{table_name}" ADD CONSTRAINT "{fk_name}" FOREIGN KEY ("{db_column}") REFERENCES "{table}" ("{field}") ON DELETE {on_delete}'
     _DROP_FK_TEMPLATE = 'ALTER TABLE "{table_name}" DROP FOREIGN KEY "{fk_name}"'
     _M2M_TABLE_TEMPLATE = (
@@ -34,10 +54,189 @@ class BaseDDL:
         'ALTER TABLE "{table_name}" CHANGE {old_column_name} {new_column_name} {new_column_type}'
     )
     _RENAME_TABLE_TEMPLATE = 'ALTER TABLE "{old_table_name}" RENAME TO "{new_table_name}"'
+    # ALTER TABLE with comma separated clauses, None if the dialect can't merge them
+    _ALTER_TABLE_TEMPLATE: Optional[str] = None
+    # templates setting timeouts of the following statements in the transaction, None if not
+    # supported
+    _SET_LOCK_TIMEOUT_TEMPLATE: Optional[str] = None
+    _SET_STATEMENT_TIMEOUT_TEMPLATE: Optional[str] = None
+    # templates setting timeouts of the session, with statements restoring them, for statements
+    # out of transaction and dialects which can't scope them to the transaction
+    _SET_SESSION_LOCK_TIMEOUT_TEMPLATE: Optional[str] = None
+    _RESET_SESSION_LOCK_TIMEOUT: Optional[str] = None
+    _SET_SESSION_STATEMENT_TIMEOUT_TEMPLATE: Optional[str] = None
+    _RESET_SESSION_STATEMENT_TIMEOUT: Optional[str] = None
+    # messages of errors raised when a statement failed to acquire locks in time
+    _LOCK_TIMEOUT_ERRORS: Tuple[str, ...] = ()
+    # whether DDL is rolled back with the transaction, MySQL commits it implicitly
+    TRANSACTIONAL_DDL = True
+    # whether columns are altered by rebuilding their table, see rebuild_table
+    REBUILD_TO_ALTER = False
+    # statements of triggers copying writes between the old and new column of a renamed column,
+    # so apps of both versions work during deploy, empty if not supported
+    _ADD_DUAL_WRITE_TEMPLATES: Tuple[str, ...] = ()
+    _DROP_DUAL_WRITE_TEMPLATES: Tuple[str, ...] = ()
+    # (regex, impact) of statements for estimate, the first matched is the impact, so
+    # exceptions go first and heavier patterns before lighter ones
+    _IMPACT_PATTERNS: Tuple[Tuple[str, str], ...] = (
+        (r"^\s*(UPDATE|DELETE)\b", SCAN),
+        (r"^\s*INSERT\b.*\bSELECT\b", SCAN),
+        (r"^\s*CREATE\s+(UNIQUE\s+)?INDEX\b", SCAN),
+        (r"^\s*ALTER\s+TABLE\b.*\b(FOREIGN\s+KEY|UNIQUE|PRIMARY\s+KEY)\b", SCAN),
+    )
+    # estimated rows and bytes of tables in {tables}, None if not supported
+    _TABLE_STATS_TEMPLATE: Optional[str] = None
 
-    def __init__(self, client: "BaseDBAsyncClient") -> None:
+    def __init__(self, client: "BaseDBAsyncClient", online: bool = False) -> None:
         self.client = client
         self.schema_generator = self.schema_generator_cls(client)
+        self.online = online
+
+    def set_timeouts(
+        self,
+        lock_timeout: Optional[int] = None,
+        statement_timeout: Optional[int] = None,
+        session: bool = False,
+    ) -> List[str]:
+        """
+        statements setting timeouts of the statements following them on the connection,
+        timeouts not supported by the dialect are ignored
+        :param lock_timeout: milliseconds to wait for locks
+        :param statement_timeout: milliseconds a statement can run
+        :param session: set them for the session instead of the transaction
+        :return:
+        """
+        templates = (
+            (self._SET_SESSION_LOCK_TIMEOUT_TEMPLATE, self._SET_SESSION_STATEMENT_TIMEOUT_TEMPLATE)
+            if session
+            else (self._SET_LOCK_TIMEOUT_TEMPLATE, self._SET_STATEMENT_TIMEOUT_TEMPLATE)
+        )
+        ret = []
+        for template, timeout in zip(templates, (lock_timeout, statement_timeout)):
+            if template and timeout:
+                ret.append(template.format(milliseconds=timeout, seconds=math.ceil(timeout / 1000)))
+        return ret
+
+    async def _reset_timeouts(
+        self, connection: Any, lock_timeout: Optional[int], statement_timeout: Optional[int]
+    ) -> List[str]:
+        """
+        statements restoring the timeouts of the session set by set_timeouts, read before
+        they are set
+        :param connection: connection acquired from the client
+        :param lock_timeout:
+        :param statement_timeout:
+        :return:
+        """
+        ret = []
+        for statement, timeout in (
+            (self._RESET_SESSION_LOCK_TIMEOUT, lock_timeout),
+            (self._RESET_SESSION_STATEMENT_TIMEOUT, statement_timeout),
+        ):
+            if statement and timeout:
+                ret.append(statement)
+        return ret
+
+    def _is_guarded_script(self, sql: str) -> bool:
+        """
+        whether sql is a script which handles its errors, it's run by _execute_on on one
+        connection of the pool
+        :param sql:
+        :return:
+        """
+        return False
+
+    async def _execute_on(self, connection: Any, sql: str) -> None:
+        """
+        execute sql on a connection acquired from the client
+        :param connection:
+        :param sql:
+        :return:
+        """
+        await connection.execute(sql)
+
+    async def execute_with_timeouts(
+        self,
+        conn: "BaseDBAsyncClient",
+        sql: str,
+        lock_timeout: Optional[int] = None,
+        statement_timeout: Optional[int] = None,
+    ) -> None:
+        """
+        execute sql with the timeouts set for the session of one connection, and restore them
+        after it even if it failed, so they don't stay on the connections reused by the app
+        :param conn:
+        :param sql:
+        :param lock_timeout:
+        :param statement_timeout:
+        :return:
+        """
+        timeouts = self.set_timeouts(lock_timeout, statement_timeout, session=True)
+        if not timeouts and not self._is_guarded_script(sql):
+            await conn.execute_script(sql)
+            return
+        async with conn.acquire_connection() as connection:
+            try:
+                reset = await self._reset_timeouts(connection, lock_timeout, statement_timeout)
+                for statement in timeouts:
+                    await self._execute_on(connection, statement)
+                try:
+                    await self._execute_on(connection, sql)
+                finally:
+                    for statement in reset:
+                        await self._execute_on(connection, statement)
+            except BaseORMException:
+                raise
+            except Exception as e:
+                # as the client does with errors of the driver
+                raise OperationalError(e) from e
+
+    def is_lock_timeout(self, error: Exception) -> bool:
+        """
+        whether error is raised because the statement failed to acquire locks in time
+        :param error:
+        :return:
+        """
+        message = str(error)
+        return any(x in message for x in self._LOCK_TIMEOUT_ERRORS)
+
+    def get_impact(self, statement: str) -> str:
+        """
+        get how statement impacts its table, e.g. whether it rewrites the table
+        :param statement:
+        :return: one of aerich.estimate.IMPACTS
+        """
+        for pattern, impact in self._IMPACT_PATTERNS:
+            if re.search(pattern, statement, re.I | re.S):
+                return impact
+        return METADATA
+
+    async def get_table_stats(self, tables: List[str]) -> TableStats:
+        """
+        get estimated rows and bytes of existing tables
+        :param tables:
+        :return: {table: (rows, bytes)}, None if unknown, tables not exist are left out
+        """
+        if self._TABLE_STATS_TEMPLATE is None:
+            raise NotSupportError(f"Table stats is unsupported in {self.DIALECT}.")
+        if not tables:
+            return {}
+        names = ", ".join("'{}'".format(x.replace("'", "''")) for x in tables)
+        rows = await self.client.execute_query_dict(self._TABLE_STATS_TEMPLATE.format(tables=names))
+        return {
+            row["table_name"]: (
+                self._get_stat(row["table_rows"]),
+                self._get_stat(row["table_size"]),
+            )
+            for row in rows
+        }
+
+    @staticmethod
+    def _get_stat(value: Any) -> Optional[int]:
+        # reltuples of PostgreSQL is -1 before the table is analyzed
+        if value is None or value < 0:
+            return None
+        return int(value)
 
     def create_table(self, model: "Type[Model]") -> str:
         return self.schema_generator._get_table_sql(model, True)["table_creation_string"].rstrip(
@@ -49,13 +248,13 @@ class BaseDDL:
 
     def create_m2m(
         self, model: "Type[Model]", field_describe: dict, reference_table_describe: dict
-    ) -> str:
+    ) -> CreateM2M:
         through = cast(str, field_describe.get("through"))
         description = field_describe.get("description")
         pk_field = cast(dict, reference_table_describe.get("pk_field"))
         reference_id = pk_field.get("db_column")
         db_field_types = cast(dict, pk_field.get("db_field_types"))
-        return self._M2M_TABLE_TEMPLATE.format(
+        sql = self._M2M_TABLE_TEMPLATE.format(
             table_name=through,
             backward_table=model._meta.db_table,
             forward_table=reference_table_describe.get("table"),
@@ -73,9 +272,12 @@ class BaseDDL:
                 else ""
             ),
         )
+        return CreateM2M(
+            sql, through, (model._meta.db_table, cast(str, reference_table_describe.get("table")))
+        )
 
-    def drop_m2m(self, table_name: str) -> str:
-        return self._DROP_TABLE_TEMPLATE.format(table_name=table_name)
+    def drop_m2m(self, table_name: str) -> DropM2M:
+        return DropM2M(self._DROP_TABLE_TEMPLATE.format(table_name=table_name), table_name)
 
     def _get_default(self, model: "Type[Model]", field_describe: dict) -> Any:
         db_table = model._meta.db_table
@@ -112,7 +314,7 @@ class BaseDDL:
 
     def _add_or_modify_column(self, model, field_describe: dict, is_pk: bool, modify=False) -> str:
         db_table = model._meta.db_table
-        description = field_describe.get("description")
+        description = cast(Optional[str], field_describe.get("description"))
         db_column = cast(str, field_describe.get("db_column"))
         db_field_types = cast(dict, field_describe.get("db_field_types"))
         default = self._get_default(model, field_describe)
@@ -131,20 +333,19 @@ class BaseDDL:
                 field_type=db_field_types.get(self.DIALECT, db_field_types.get("")),
                 nullable="NOT NULL" if not field_describe.get("nullable") else "",
                 unique=unique,
-                comment=(
-                    self.schema_generator._column_comment_generator(
-                        table=db_table,
-                        column=db_column,
-                        comment=description,
-                    )
-                    if description
-                    else ""
-                ),
+                comment=self._column_comment(db_table, db_column, description),
                 is_primary_key=is_pk,
                 default=default,
             ),
         )
 
+    def _column_comment(self, db_table: str, db_column: str, description: Optional[str]) -> str:
+        if not description:
+            return ""
+        return self.schema_generator._column_comment_generator(
+            table=db_table, column=db_column, comment=description
+        )
+
     def drop_column(self, model: "Type[Model]", column_name: str) -> str:
         return self._DROP_COLUMN_TEMPLATE.format(
             table_name=model._meta.db_table, column_name=column_name
@@ -172,28 +373,60 @@ class BaseDDL:
             new_column_type=new_column_type,
         )
 
-    def add_index(self, model: "Type[Model]", field_names: List[str], unique=False) -> str:
-        return self._ADD_INDEX_TEMPLATE.format(
+    def _index_operation(
+        self,
+        operation_cls: Type[IndexOperation],
+        template: str,
+        online_template: Optional[str],
+        model: "Type[Model]",
+        **kwargs: str,
+    ) -> IndexOperation:
+        """
+        render index operation, with online template in online mode
+        :param operation_cls: AddIndex or DropIndex
+        :param template:
+        :param online_template:
+        :param model:
+        :param kwargs: params of template
+        :return:
+        """
+        db_table = model._meta.db_table
+        if self.online and online_template:
+            return operation_cls(
+                online_template.format(table_name=db_table, **kwargs),
+                db_table,
+                transactional=self._ONLINE_INDEX_TRANSACTIONAL,
+            )
+        return operation_cls(template.format(table_name=db_table, **kwargs), db_table)
+
+    def add_index(self, model: "Type[Model]", field_names: List[str], unique=False) -> AddIndex:
+        return self._index_operation(
+            AddIndex,
+            self._ADD_INDEX_TEMPLATE,
+            self._ADD_INDEX_ONLINE_TEMPLATE,
+            model,
             unique="UNIQUE " if unique else "",
             index_name=self.schema_generator._generate_index_name(
                 "idx" if not unique else "uid", model, field_names
             ),
-            table_name=model._meta.db_table,
             column_names=", ".join(self.schema_generator.quote(f) for f in field_names),
         )
 
-    def drop_index(self, model: "Type[Model]", field_names: List[str], unique=False) -> str:
-        return self._DROP_INDEX_TEMPLATE.format(
-            index_name=self.schema_generator._generate_index_name(
+    def drop_index(self, model: "Type[Model]", field_names: List[str], unique=False) -> DropIndex:
+        return self.drop_index_by_name(
+            model,
+            self.schema_generator._generate_index_name(
                 "idx" if not unique else "uid", model, field_names
             ),
-            table_name=model._meta.db_table,
         )
 
-    def drop_index_by_name(self, model: "Type[Model]", index_name: str) -> str:
-        return self._DROP_INDEX_TEMPLATE.format(
+    def drop_index_by_name(self, model: "Type[Model]", index_name: str) -> DropIndex:
+        return self._index_operation(
+            DropIndex,
+            self._DROP_INDEX_TEMPLATE,
+            self._DROP_INDEX_ONLINE_TEMPLATE,
+            model,
             index_name=index_name,
-            table_name=model._meta.db_table,
         )
 
     def _generate_fk_name(
@@ -213,13 +446,13 @@ class BaseDDL:
 
     def add_fk(
         self, model: "Type[Model]", field_describe: dict, reference_table_describe: dict
-    ) -> str:
+    ) -> AddFK:
         db_table = model._meta.db_table
 
         db_column = field_describe.get("raw_field")
         pk_field = cast(dict, reference_table_describe.get("pk_field"))
         reference_id = pk_field.get("db_column")
-        return self._ADD_FK_TEMPLATE.format(
+        sql = self._ADD_FK_TEMPLATE.format(
             table_name=db_table,
             fk_name=self._generate_fk_name(db_table, field_describe, reference_table_describe),
             db_column=db_column,
@@ -227,13 +460,18 @@ class BaseDDL:
             field=reference_id,
             on_delete=field_describe.get("on_delete"),
         )
+        return AddFK(sql, db_table, (cast(str, reference_table_describe.get("table")),))
 
     def drop_fk(
         self, model: "Type[Model]", field_describe: dict, reference_table_describe: dict
-    ) -> str:
+    ) -> DropFK:
         db_table = model._meta.db_table
         fk_name = self._generate_fk_name(db_table, field_describe, reference_table_describe)
-        return self._DROP_FK_TEMPLATE.format(table_name=db_table, fk_name=fk_name)
+        return DropFK(
+            self._DROP_FK_TEMPLATE.format(table_name=db_table, fk_name=fk_name),
+            db_table,
+            (cast(str, reference_table_describe.get("table")),),
+        )
 
     def alter_column_default(self, model: "Type[Model]", field_describe: dict) -> str:
         db_table = model._meta.db_table
@@ -247,9 +485,66 @@ class BaseDDL:
     def alter_column_null(self, model: "Type[Model]", field_describe: dict) -> str:
         return self.modify_column(model, field_describe)
 
+    def rebuild_table(
+        self, model: "Type[Model]", describe: dict, models: Dict[str, dict]
+    ) -> RebuildTable:
+        raise NotSupportError(f"Rebuild table is unsupported in {self.DIALECT}.")
+
+    def _dual_write(
+        self, templates: Tuple[str, ...], model: "Type[Model]", old_column: str, new_column: str
+    ) -> List[str]:
+        if not templates:
+            raise NotSupportError(f"Dual write trigger is unsupported in {self.DIALECT}.")
+        trigger_name = self.schema_generator._generate_index_name(
+            "sync", model, [old_column, new_column]
+        )
+        return [
+            template.format(
+                table_name=model._meta.db_table,
+                trigger_name=trigger_name,
+                old_column=old_column,
+                new_column=new_column,
+            )
+            for template in templates
+        ]
+
+    def add_dual_write(self, model: "Type[Model]", old_column: str, new_column: str) -> List[str]:
+        """
+        create triggers keeping old_column and new_column in sync on insert and update,
+        the value written by app wins
+        :param model:
+        :param old_column:
+        :param new_column:
+        :return:
+        """
+        return self._dual_write(self._ADD_DUAL_WRITE_TEMPLATES, model, old_column, new_column)
+
+    def drop_dual_write(self, model: "Type[Model]", old_column: str, new_column: str) -> List[str]:
+        return self._dual_write(self._DROP_DUAL_WRITE_TEMPLATES, model, old_column, new_column)
+
     def set_comment(self, model: "Type[Model]", field_describe: dict) -> str:
         return self.modify_column(model, field_describe)
 
+    def merge_alter_table(self, table_name: str, statements: List[str]) -> Optional[str]:
+        """
+        merge ALTER TABLE statements of a table into one statement with their clauses
+        :param table_name:
+        :param statements:
+        :return: None if the dialect can't merge them, or any of them isn't a single ALTER TABLE
+        """
+        if self._ALTER_TABLE_TEMPLATE is None:
+            return None
+        prefix = self._ALTER_TABLE_TEMPLATE.format(table_name=table_name, clauses="")
+        clauses: List[str] = []
+        for statement in statements:
+            if not statement.startswith(prefix) or len(split_sql(statement)) != 1:
+                return None
+            clause = statement[len(prefix) :]
+            # e.g. MODIFY COLUMN for both nullable and comment changes of MySQL
+            if clause not in clauses:
+                clauses.append(clause)
+        return self._ALTER_TABLE_TEMPLATE.format(table_name=table_name, clauses=", ".join(clauses))
+
     def rename_table(self, model: "Type[Model]", old_table_name: str, new_table_name: str) -> str:
         db_table = model._meta.db_table
         return self._RENAME_TABLE_TEMPLATE.format(
@@ -1,8 +1,10 @@
-from typing import TYPE_CHECKING, List, Type
+from typing import TYPE_CHECKING, Any, List, Type
 
 from tortoise.backends.mysql.schema_generator import MySQLSchemaGenerator
 
 from aerich.ddl import BaseDDL
+from aerich.estimate import ONLINE, REWRITE, SCAN
+from aerich.operations import AddIndex, DropIndex
 
 if TYPE_CHECKING:
     from tortoise import Model  # noqa:F401
@@ -25,6 +27,10 @@ class MysqlDDL(BaseDDL):
         "ALTER TABLE `{table_name}` ADD {unique}INDEX `{index_name}` ({column_names})"
     )
     _DROP_INDEX_TEMPLATE = "ALTER TABLE `{table_name}` DROP INDEX `{index_name}`"
+    _ADD_INDEX_ONLINE_TEMPLATE = "ALTER TABLE `{table_name}` ADD {unique}INDEX `{index_name}` ({column_names}), ALGORITHM=INPLACE, LOCK=NONE"
+    _DROP_INDEX_ONLINE_TEMPLATE = (
+        "ALTER TABLE `{table_name}` DROP INDEX `{index_name}`, ALGORITHM=INPLACE, LOCK=NONE"
+    )
     _ADD_FK_TEMPLATE = "ALTER TABLE `{table_name}` ADD CONSTRAINT `{fk_name}` FOREIGN KEY (`{db_column}`) REFERENCES `{table}` (`{field}`) ON DELETE {on_delete}"
     _DROP_FK_TEMPLATE = "ALTER TABLE `{table_name}` DROP FOREIGN KEY `{fk_name}`"
     _M2M_TABLE_TEMPLATE = (
@@ -35,6 +41,43 @@ class MysqlDDL(BaseDDL):
     )
     _MODIFY_COLUMN_TEMPLATE = "ALTER TABLE `{table_name}` MODIFY COLUMN {column}"
     _RENAME_TABLE_TEMPLATE = "ALTER TABLE `{old_table_name}` RENAME TO `{new_table_name}`"
+    _ALTER_TABLE_TEMPLATE = "ALTER TABLE `{table_name}` {clauses}"
+    # metadata locks taken by DDL, MySQL has no timeout for DDL statements
+    _SET_SESSION_LOCK_TIMEOUT_TEMPLATE = "SET SESSION lock_wait_timeout = {seconds}"
+    _RESET_SESSION_LOCK_TIMEOUT = "SET SESSION lock_wait_timeout = DEFAULT"
+    _LOCK_TIMEOUT_ERRORS = ("Lock wait timeout exceeded",)
+    TRANSACTIONAL_DDL = False
+    # assignments of SET are applied in order
+    _ADD_DUAL_WRITE_TEMPLATES = (
+        "CREATE TRIGGER `{trigger_name}_insert` BEFORE INSERT ON `{table_name}` FOR EACH ROW "
+        "SET NEW.`{old_column}` = IF(NEW.`{new_column}` IS NULL, NEW.`{old_column}`, NEW.`{new_column}`), "
+        "NEW.`{new_column}` = NEW.`{old_column}`",
+        "CREATE TRIGGER `{trigger_name}_update` BEFORE UPDATE ON `{table_name}` FOR EACH ROW "
+        "SET NEW.`{new_column}` = IF(NEW.`{old_column}` <=> OLD.`{old_column}`, NEW.`{new_column}`, NEW.`{old_column}`), "
+        "NEW.`{old_column}` = IF(NEW.`{new_column}` <=> OLD.`{new_column}`, NEW.`{old_column}`, NEW.`{new_column}`)",
+    )
+    _DROP_DUAL_WRITE_TEMPLATES = (
+        "DROP TRIGGER IF EXISTS `{trigger_name}_insert`",
+        "DROP TRIGGER IF EXISTS `{trigger_name}_update`",
+    )
+
+    # ADD COLUMN is instant since MySQL 8.0.12, DROP COLUMN rebuilds the table before 8.0.29
+    _IMPACT_PATTERNS = (
+        (r"\bLOCK\s*=\s*NONE\b", ONLINE),
+        (r"\b(MODIFY\s+COLUMN|CHANGE)\s", REWRITE),
+        (r"\bDROP\s+COLUMN\b", REWRITE),
+        (r"^\s*ALTER\s+TABLE\b.*\bADD\s+(UNIQUE\s+)?INDEX\b", SCAN),
+        *BaseDDL._IMPACT_PATTERNS,
+    )
+    _TABLE_STATS_TEMPLATE = (
+        "SELECT TABLE_NAME AS table_name, TABLE_ROWS AS table_rows,"
+        " DATA_LENGTH + INDEX_LENGTH AS table_size FROM information_schema.TABLES"
+        " WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({tables})"
+    )
+
+    async def _execute_on(self, connection: Any, sql: str) -> None:
+        async with connection.cursor() as cursor:
+            await cursor.execute(sql)
 
     def _index_name(self, unique: bool, model: "Type[Model]", field_names: List[str]) -> str:
         if unique:
@@ -48,16 +91,16 @@ class MysqlDDL(BaseDDL):
             index_prefix = "idx"
         return self.schema_generator._generate_index_name(index_prefix, model, field_names)
 
-    def add_index(self, model: "Type[Model]", field_names: List[str], unique=False) -> str:
-        return self._ADD_INDEX_TEMPLATE.format(
+    def add_index(self, model: "Type[Model]", field_names: List[str], unique=False) -> AddIndex:
+        return self._index_operation(
+            AddIndex,
+            self._ADD_INDEX_TEMPLATE,
+            self._ADD_INDEX_ONLINE_TEMPLATE,
+            model,
             unique="UNIQUE " if unique else "",
             index_name=self._index_name(unique, model, field_names),
-            table_name=model._meta.db_table,
             column_names=", ".join(self.schema_generator.quote(f) for f in field_names),
         )
 
-    def drop_index(self, model: "Type[Model]", field_names: List[str], unique=False) -> str:
-        return self._DROP_INDEX_TEMPLATE.format(
-            index_name=self._index_name(unique, model, field_names),
-            table_name=model._meta.db_table,
-        )
+    def drop_index(self, model: "Type[Model]", field_names: List[str], unique=False) -> DropIndex:
+        return self.drop_index_by_name(model, self._index_name(unique, model, field_names))
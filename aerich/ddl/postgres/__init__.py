@@ -4,6 +4,7 @@ from tortoise import Model
 from tortoise.backends.asyncpg.schema_generator import AsyncpgSchemaGenerator
 
 from aerich.ddl import BaseDDL
+from aerich.estimate import ONLINE, REWRITE, SCAN
 
 
 class PostgresDDL(BaseDDL):
@@ -11,12 +12,63 @@ class PostgresDDL(BaseDDL):
     DIALECT = AsyncpgSchemaGenerator.DIALECT
     _ADD_INDEX_TEMPLATE = 'CREATE {unique}INDEX "{index_name}" ON "{table_name}" ({column_names})'
     _DROP_INDEX_TEMPLATE = 'DROP INDEX "{index_name}"'
+    _ADD_INDEX_ONLINE_TEMPLATE = (
+        'CREATE {unique}INDEX CONCURRENTLY "{index_name}" ON "{table_name}" ({column_names})'
+    )
+    # run after the transaction, when the column may have been dropped with its index
+    _DROP_INDEX_ONLINE_TEMPLATE = 'DROP INDEX CONCURRENTLY IF EXISTS "{index_name}"'
+    _ONLINE_INDEX_TRANSACTIONAL = False
     _ALTER_NULL_TEMPLATE = 'ALTER TABLE "{table_name}" ALTER COLUMN "{column}" {set_drop} NOT NULL'
     _MODIFY_COLUMN_TEMPLATE = (
         'ALTER TABLE "{table_name}" ALTER COLUMN "{column}" TYPE {datatype}{using}'
     )
     _SET_COMMENT_TEMPLATE = 'COMMENT ON COLUMN "{table_name}"."{column}" IS {comment}'
     _DROP_FK_TEMPLATE = 'ALTER TABLE "{table_name}" DROP CONSTRAINT "{fk_name}"'
+    _ALTER_TABLE_TEMPLATE = 'ALTER TABLE "{table_name}" {clauses}'
+    # scoped to the transaction, or the implicit one of a multi-statement script
+    _SET_LOCK_TIMEOUT_TEMPLATE = "SET LOCAL lock_timeout = {milliseconds}"
+    _SET_STATEMENT_TIMEOUT_TEMPLATE = "SET LOCAL statement_timeout = {milliseconds}"
+    # statements out of transaction, e.g. CREATE INDEX CONCURRENTLY, can't run in a script
+    _SET_SESSION_LOCK_TIMEOUT_TEMPLATE = "SET lock_timeout = {milliseconds}"
+    _RESET_SESSION_LOCK_TIMEOUT = "RESET lock_timeout"
+    _SET_SESSION_STATEMENT_TIMEOUT_TEMPLATE = "SET statement_timeout = {milliseconds}"
+    _RESET_SESSION_STATEMENT_TIMEOUT = "RESET statement_timeout"
+    _LOCK_TIMEOUT_ERRORS = ("lock timeout",)
+    _ADD_DUAL_WRITE_TEMPLATES = (
+        'CREATE OR REPLACE FUNCTION "{trigger_name}"() RETURNS TRIGGER AS $$\n'
+        "BEGIN\n"
+        "    IF TG_OP = 'INSERT' THEN\n"
+        '        IF NEW."{new_column}" IS NULL THEN\n'
+        '            NEW."{new_column}" := NEW."{old_column}";\n'
+        "        ELSE\n"
+        '            NEW."{old_column}" := NEW."{new_column}";\n'
+        "        END IF;\n"
+        '    ELSIF NEW."{old_column}" IS DISTINCT FROM OLD."{old_column}" THEN\n'
+        '        NEW."{new_column}" := NEW."{old_column}";\n'
+        '    ELSIF NEW."{new_column}" IS DISTINCT FROM OLD."{new_column}" THEN\n'
+        '        NEW."{old_column}" := NEW."{new_column}";\n'
+        "    END IF;\n"
+        "    RETURN NEW;\n"
+        "END\n"
+        "$$ LANGUAGE plpgsql",
+        'CREATE TRIGGER "{trigger_name}" BEFORE INSERT OR UPDATE ON "{table_name}" '
+        'FOR EACH ROW EXECUTE PROCEDURE "{trigger_name}"()',
+    )
+    _DROP_DUAL_WRITE_TEMPLATES = (
+        'DROP TRIGGER IF EXISTS "{trigger_name}" ON "{table_name}"',
+        'DROP FUNCTION IF EXISTS "{trigger_name}"()',
+    )
+    _IMPACT_PATTERNS = (
+        (r"^\s*(CREATE|DROP)\s+(UNIQUE\s+)?INDEX\s+CONCURRENTLY\b", ONLINE),
+        (r"\bALTER\s+COLUMN\s+\S+\s+TYPE\b", REWRITE),
+        (r"\bSET\s+NOT\s+NULL\b", SCAN),
+        *BaseDDL._IMPACT_PATTERNS,
+    )
+    _TABLE_STATS_TEMPLATE = (
+        "SELECT relname AS table_name, reltuples AS table_rows,"
+        " pg_total_relation_size(oid) AS table_size FROM pg_class"
+        " WHERE relkind IN ('r', 'p') AND relname IN ({tables}) AND pg_table_is_visible(oid)"
+    )
 
     def alter_column_null(self, model: "Type[Model]", field_describe: dict) -> str:
         db_table = model._meta.db_table
@@ -1,15 +1,47 @@
-from typing import Type
+import re
+from typing import Any, Dict, List, Optional, Type, cast
 
 from tortoise import Model
 from tortoise.backends.sqlite.schema_generator import SqliteSchemaGenerator
+from tortoise.indexes import Index
 
 from aerich.ddl import BaseDDL
+from aerich.estimate import REWRITE, TableStats
 from aerich.exceptions import NotSupportError
+from aerich.operations import RebuildTable
+from aerich.utils import split_sql
 
 
 class SqliteDDL(BaseDDL):
     schema_generator_cls = SqliteSchemaGenerator
     DIALECT = SqliteSchemaGenerator.DIALECT
+    _SET_SESSION_LOCK_TIMEOUT_TEMPLATE = "PRAGMA busy_timeout = {milliseconds}"
+    _LOCK_TIMEOUT_ERRORS = ("database is locked",)
+    REBUILD_TO_ALTER = True
+    _GENERATED_PK_TEMPLATE = '"{column}" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL'
+    # https://www.sqlite.org/lang_altertable.html#otheralter, foreign keys are disabled so
+    # dropping the table doesn't cascade, it can only be changed out of transaction, the script
+    # is run statement by statement by _execute_on, so a failure rolls back and enables them
+    _REBUILD_TABLE_TEMPLATE = (
+        "PRAGMA foreign_keys = OFF;\n"
+        "BEGIN;\n"
+        'CREATE TABLE "{new_table_name}" (\n    {columns}\n){comment};\n'
+        'INSERT INTO "{new_table_name}" ({column_names}) SELECT {column_names} FROM "{table_name}";\n'
+        'DROP TABLE "{table_name}";\n'
+        'ALTER TABLE "{new_table_name}" RENAME TO "{table_name}";\n'
+        "{indexes}"
+        "COMMIT;\n"
+        "PRAGMA foreign_keys = ON"
+    )
+    _REBUILD_PATTERN = re.compile(r"^\s*PRAGMA\s+foreign_keys\s*=\s*OFF\b", re.I)
+    # statements of the rebuild script managed by _execute_on
+    _REBUILD_CONTROL_PATTERN = re.compile(r"^(PRAGMA\s+foreign_keys\b|BEGIN\b|COMMIT\b)", re.I)
+    _IMPACT_PATTERNS = (
+        # table rebuild
+        (r"^\s*PRAGMA\s+foreign_keys\b", REWRITE),
+        (r"\bDROP\s+COLUMN\b", REWRITE),
+        *BaseDDL._IMPACT_PATTERNS,
+    )
 
     def modify_column(self, model: "Type[Model]", field_object: dict, is_pk: bool = True):
         raise NotSupportError("Modify column is unsupported in SQLite.")
@@ -22,3 +54,151 @@ class SqliteDDL(BaseDDL):
 
     def set_comment(self, model: "Type[Model]", field_describe: dict):
         raise NotSupportError("Alter column comment is unsupported in SQLite.")
+
+    async def _reset_timeouts(
+        self, connection: Any, lock_timeout: Optional[int], statement_timeout: Optional[int]
+    ) -> List[str]:
+        # busy_timeout has no default to reset to, it may be set by the pragmas of the client
+        if not lock_timeout:
+            return []
+        rows = await connection.execute_fetchall("PRAGMA busy_timeout")
+        return [f"PRAGMA busy_timeout = {rows[0][0]}"]
+
+    def _is_guarded_script(self, sql: str) -> bool:
+        return bool(self._REBUILD_PATTERN.match(sql))
+
+    async def _execute_on(self, connection: Any, sql: str) -> None:
+        if not self._is_guarded_script(sql):
+            await connection.executescript(sql)
+            return
+        # the connection is shared, don't leave a transaction open or foreign keys disabled
+        statements = [x for x in split_sql(sql) if not self._REBUILD_CONTROL_PATTERN.match(x)]
+        await connection.execute("PRAGMA foreign_keys = OFF")
+        try:
+            await connection.execute("BEGIN")
+            try:
+                for statement in statements:
+                    await connection.execute(statement)
+            except BaseException:
+                await connection.execute("ROLLBACK")
+                raise
+            await connection.execute("COMMIT")
+        finally:
+            await connection.execute("PRAGMA foreign_keys = ON")
+
+    async def get_table_stats(self, tables: List[str]) -> TableStats:
+        # counting the rows would scan the tables, SQLite keeps row estimates in sqlite_stat1
+        # once they are analyzed, the rows of other tables are unknown
+        if not tables:
+            return {}
+        names = ", ".join("'{}'".format(x.replace("'", "''")) for x in tables)
+        rows = await self.client.execute_query_dict(
+            f"SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ({names})"
+        )
+        stats: TableStats = {row["name"]: (None, None) for row in rows}
+        if stats and await self.client.execute_query_dict(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+        ):
+            rows = await self.client.execute_query_dict(
+                f"SELECT tbl, stat FROM sqlite_stat1 WHERE tbl IN ({names})"
+            )
+            for row in rows:
+                # the first number of stat is the rows of the table
+                stats[row["tbl"]] = (int(row["stat"].split()[0]), None)
+        return stats
+
+    def _column_definition(
+        self, model: "Type[Model]", describe: dict, field_describe: dict, models: Dict[str, dict]
+    ) -> str:
+        db_table = cast(str, describe["table"])
+        db_column = cast(str, field_describe["db_column"])
+        is_pk = field_describe is describe["pk_field"]
+        if is_pk and field_describe["generated"]:
+            return self._GENERATED_PK_TEMPLATE.format(column=db_column)
+        db_field_types = cast(dict, field_describe["db_field_types"])
+        comment = self._column_comment(db_table, db_column, field_describe.get("description"))
+        references = ""
+        for fk_field in describe["fk_fields"] + describe["o2o_fields"]:
+            if fk_field["raw_field"] == db_column and fk_field.get("db_constraint"):
+                reference = models[fk_field["python_type"]]
+                references = self.schema_generator._create_fk_string(
+                    constraint_name="",
+                    db_column=db_column,
+                    table=reference["table"],
+                    field=reference["pk_field"]["db_column"],
+                    on_delete=fk_field["on_delete"],
+                    comment=comment,
+                )
+                comment = ""
+        return (
+            self.schema_generator._create_string(
+                db_column=db_column,
+                field_type=db_field_types.get(self.DIALECT) or db_field_types[""],
+                nullable="NOT NULL" if not field_describe["nullable"] else "",
+                unique="UNIQUE" if field_describe["unique"] else "",
+                comment=comment,
+                is_primary_key=is_pk,
+                default=self._get_default(model, field_describe) or "",
+            )
+            + references
+        )
+
+    def rebuild_table(
+        self, model: "Type[Model]", describe: dict, models: Dict[str, dict]
+    ) -> RebuildTable:
+        """
+        rebuild table to the describe, by copying rows to a new table and replacing the table
+        with it, the columns of the describe must exist in the table
+        :param model:
+        :param describe: describe of the model to rebuild the table to
+        :param models: describes of all models, to resolve foreign keys
+        :return:
+        """
+        db_table = cast(str, describe["table"])
+        fields = [describe["pk_field"], *describe["data_fields"]]
+        # fk fields and index_together are described by field name
+        db_columns = {field["name"]: field["db_column"] for field in fields}
+        for fk_field in describe["fk_fields"] + describe["o2o_fields"]:
+            db_columns[fk_field["name"]] = fk_field["raw_field"]
+        columns = [self._column_definition(model, describe, field, models) for field in fields]
+        for field_names in describe["unique_together"]:
+            columns.append(
+                self.schema_generator._get_unique_constraint_sql(
+                    cast(Type[Model], db_table), [db_columns[x] for x in field_names]
+                )
+            )
+        indexes: List[str] = []
+        for field in describe["data_fields"]:
+            if field["indexed"] and not field["unique"]:
+                indexes.append(self._index_sql(db_table, [field["db_column"]]))
+        for index in describe["indexes"]:
+            if isinstance(index, Index):
+                indexes.append(index.get_sql(self.schema_generator, model, False).rstrip(";"))
+            else:
+                indexes.append(self._index_sql(db_table, [db_columns[x] for x in index]))
+        sql = self._REBUILD_TABLE_TEMPLATE.format(
+            table_name=db_table,
+            new_table_name=f"_aerich_{db_table}",
+            columns=",\n    ".join(columns),
+            comment=(
+                self.schema_generator._table_comment_generator(
+                    table=db_table, comment=describe["description"]
+                )
+                if describe.get("description")
+                else ""
+            ),
+            column_names=", ".join(f'"{field["db_column"]}"' for field in fields),
+            indexes="".join(f"{index};\n" for index in indexes),
+        )
+        references = [models[x["python_type"]]["table"] for x in describe["fk_fields"]]
+        return RebuildTable(sql, db_table, references, transactional=False)
+
+    def _index_sql(self, db_table: str, db_columns: List[str]) -> str:
+        return self.schema_generator.INDEX_CREATE_TEMPLATE.format(
+            exists="",
+            index_name=self.schema_generator._generate_index_name(
+                "idx", cast(Type[Model], db_table), db_columns
+            ),
+            table_name=db_table,
+            fields=", ".join(self.schema_generator.quote(x) for x in db_columns),
+        ).rstrip(";")
@@ -0,0 +1,135 @@
+import re
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from aerich.backfill import Backfill, Step
+
+if TYPE_CHECKING:
+    from aerich.ddl import BaseDDL  # noqa:F401
+
+# how a statement impacts its table, from the lightest to the heaviest
+METADATA = "metadata"  # changes the catalog only
+ONLINE = "online"  # reads the table without blocking writes
+SCAN = "scan"  # reads the table, blocking writes meanwhile
+REWRITE = "rewrite"  # copies the table under exclusive lock
+IMPACTS = (METADATA, ONLINE, SCAN, REWRITE)
+# rough rows per second processed by impacts
+ROWS_PER_SECOND = {ONLINE: 100_000, SCAN: 500_000, REWRITE: 100_000}
+# (seconds less than, duration class)
+DURATIONS = ((1, "instant"), (60, "seconds"), (3600, "minutes"))
+
+_NAME = r"""(?:["`]([^"`]+)["`]|(\w+))"""
+# the first matched is the table of statement, the last one finds the table rebuilt by a script
+_TABLE_PATTERNS = [
+    re.compile(pattern, re.I | re.S)
+    for pattern in (
+        rf"^\s*ALTER\s+TABLE\s+{_NAME}",
+        rf"^\s*CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?{_NAME}",
+        rf"^\s*CREATE\s+(?:UNIQUE\s+)?INDEX\b.*?\bON\s+{_NAME}",
+        rf"^\s*(?:UPDATE|DELETE\s+FROM|INSERT\s+INTO)\s+{_NAME}",
+        rf"\bDROP\s+TABLE\s+(?:IF\s+EXISTS\s+)?{_NAME}",
+    )
+]
+
+TableStats = Dict[str, Tuple[Optional[int], Optional[int]]]
+
+
+def get_table(statement: str) -> Optional[str]:
+    """
+    get table changed by statement
+    :param statement:
+    :return: None if not found, e.g. DROP INDEX of PostgreSQL
+    """
+    for pattern in _TABLE_PATTERNS:
+        match = pattern.search(statement)
+        if match:
+            return match.group(1) or match.group(2)
+    return None
+
+
+def format_size(size: Optional[int]) -> str:
+    if size is None:
+        return "unknown size"
+    value = float(size)
+    for unit in ("B", "KB", "MB", "GB"):
+        if value < 1024:
+            return f"{value:.0f}{unit}" if unit == "B" else f"{value:.1f}{unit}"
+        value /= 1024
+    return f"{value:.1f}TB"
+
+
+class Estimate:
+    """
+    Rough cost of a pending statement, from how it changes its table and the size of the table
+    """
+
+    def __init__(
+        self,
+        version: str,
+        statement: str,
+        table: Optional[str],
+        impact: str,
+        rows: Optional[int] = None,
+        size: Optional[int] = None,
+    ) -> None:
+        """
+        :param version: version file name
+        :param statement: sql or repr of backfill
+        :param table: table changed by statement, None if unknown
+        :param impact: one of IMPACTS
+        :param rows: estimated rows of the table, None if unknown
+        :param size: bytes of the table with its indexes, None if unknown
+        """
+        self.version = version
+        self.statement = statement
+        self.table = table
+        self.impact = impact
+        self.rows = rows
+        self.size = size
+
+    def __repr__(self) -> str:
+        return f"Estimate({self.version!r}, {self.table!r}, {self.impact!r}, {self.duration!r})"
+
+    @property
+    def heavy(self) -> bool:
+        """
+        whether statement rewrites the table or blocks writes while reading it
+        """
+        return self.impact in (SCAN, REWRITE)
+
+    @property
+    def duration(self) -> str:
+        if self.impact == METADATA:
+            return "instant"
+        if self.rows is None:
+            return "unknown"
+        seconds = self.rows / ROWS_PER_SECOND[self.impact]
+        for limit, duration in DURATIONS:
+            if seconds < limit:
+                return duration
+        return "hours"
+
+
+def estimate_steps(
+    ddl: "BaseDDL", version: str, steps: List[Step], stats: TableStats
+) -> List[Estimate]:
+    """
+    estimate steps of version file
+    :param ddl:
+    :param version: version file name
+    :param steps: statements and backfills
+    :param stats: rows and bytes of existing tables, tables not in it are created by migrations
+    :return:
+    """
+    ret: List[Estimate] = []
+    for step in steps:
+        if isinstance(step, Backfill):
+            # chunks of a backfill are committed one by one
+            table: Optional[str] = step.table
+            statement, impact = repr(step), ONLINE
+        else:
+            table, statement, impact = get_table(step), step, ddl.get_impact(step)
+        rows = size = None
+        if table is not None:
+            rows, size = stats.get(table, (0, 0))
+        ret.append(Estimate(version, statement, table, impact, rows, size))
+    return ret
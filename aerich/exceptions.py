@@ -8,3 +8,9 @@ class DowngradeError(Exception):
     """
     raise when downgrade error
     """
+
+
+class SnapshotError(Exception):
+    """
+    raise when model snapshot can't be restored
+    """
@@ -1,22 +1,88 @@
-from typing import Any, List, Optional
+import asyncio
+import keyword
+from collections import Counter
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
 
-from pydantic import BaseModel
 from tortoise import BaseDBAsyncClient
+from tortoise.exceptions import OperationalError
 
+T = TypeVar("T")
+# on delete rules of foreign keys to constants of tortoise, which defaults to CASCADE
+ON_DELETE = {
+    "SET NULL": "SET_NULL",
+    "SET DEFAULT": "SET_DEFAULT",
+    "RESTRICT": "RESTRICT",
+    "NO ACTION": "NO_ACTION",
+}
 
-class Column(BaseModel):
-    name: str
-    data_type: str
-    null: bool
-    default: Any
-    comment: Optional[str] = None
-    pk: bool
-    unique: bool
-    index: bool
-    length: Optional[int] = None
-    extra: Optional[str] = None
-    decimal_places: Optional[int] = None
-    max_digits: Optional[int] = None
+
+class Column:
+    """
+    Column of a table, built for each row of catalog so it is a plain class with slots
+    """
+
+    __slots__ = (
+        "name",
+        "data_type",
+        "null",
+        "default",
+        "comment",
+        "pk",
+        "unique",
+        "index",
+        "length",
+        "extra",
+        "decimal_places",
+        "max_digits",
+    )
+
+    def __init__(
+        self,
+        *,
+        name: str,
+        data_type: str,
+        null: bool,
+        default: Any,
+        pk: bool,
+        unique: bool,
+        index: bool,
+        comment: Optional[str] = None,
+        length: Optional[int] = None,
+        extra: Optional[str] = None,
+        decimal_places: Optional[int] = None,
+        max_digits: Optional[int] = None,
+    ) -> None:
+        self.name = name
+        self.data_type = data_type
+        self.null = null
+        self.default = default
+        self.pk = pk
+        self.unique = unique
+        self.index = index
+        self.comment = comment
+        self.length = length
+        self.extra = extra
+        self.decimal_places = decimal_places
+        self.max_digits = max_digits
+
+    def __repr__(self) -> str:
+        return f"Column({self.name!r}, {self.data_type!r})"
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Column):
+            return NotImplemented
+        return all(getattr(self, x) == getattr(other, x) for x in self.__slots__)
 
     def translate(self) -> dict:
         comment = default = length = index = null = pk = ""
@@ -73,42 +139,295 @@ class Column(BaseModel):
         }
 
 
+class ForeignKey:
+    """
+    Foreign key of a single column
+    """
+
+    def __init__(
+        self, column: str, to_table: str, to_column: Optional[str], on_delete: str = "CASCADE"
+    ) -> None:
+        """
+        :param column:
+        :param to_table: referenced table
+        :param to_column: referenced column, None for the primary key
+        :param on_delete: rule in SQL, e.g. SET NULL
+        """
+        self.column = column
+        self.to_table = to_table
+        self.to_column = to_column
+        self.on_delete = on_delete.upper()
+
+
+class Constraints:
+    """
+    Foreign keys and indexes of a table, the primary key excluded
+    """
+
+    def __init__(self) -> None:
+        self.foreign_keys: Dict[str, ForeignKey] = {}
+        # (columns, unique) in order of adding
+        self.indexes: List[Tuple[Tuple[str, ...], bool]] = []
+
+    def add_foreign_key(self, foreign_key: ForeignKey) -> None:
+        self.foreign_keys[foreign_key.column] = foreign_key
+
+    def add_index(self, columns: Sequence[str], unique: bool) -> None:
+        index = (tuple(columns), unique)
+        if index not in self.indexes:
+            self.indexes.append(index)
+
+    def apply(self, columns: List[Column]) -> None:
+        """
+        mark columns of single column indexes as unique or indexed
+        :param columns: columns of the table
+        :return:
+        """
+        columns_map = {column.name: column for column in columns}
+        for index_columns, unique in self.indexes:
+            column = columns_map.get(index_columns[0])
+            if len(index_columns) != 1 or column is None:
+                continue
+            if unique:
+                column.unique = True
+            else:
+                column.index = True
+
+    def together(self, unique: bool) -> List[Tuple[str, ...]]:
+        """
+        columns of indexes with several columns
+        :param unique: get unique indexes or not
+        :return:
+        """
+        return [columns for columns, x in self.indexes if x == unique and len(columns) > 1]
+
+
 class Inspect:
+    _header = "from tortoise import Model, fields\n"
     _table_template = "class {table}(Model):\n"
+    # tables whose columns are fetched at once while generating models
+    batch_size = 100
+    # whether get_table_columns and get_table_constraints query catalog other than the bulk
+    # queries, so they work where the bulk queries fail
+    per_table_queries = False
 
-    def __init__(self, conn: BaseDBAsyncClient, tables: Optional[List[str]] = None):
+    def __init__(
+        self, conn: BaseDBAsyncClient, tables: Optional[List[str]] = None, concurrency: int = 8
+    ):
+        """
+        :param conn:
+        :param tables: tables to inspect, all tables if not given
+        :param concurrency: max tables introspected at once when columns can't be fetched in bulk
+        """
         self.conn = conn
+        self.concurrency = concurrency
         try:
             self.database = conn.database  # type:ignore[attr-defined]
         except AttributeError:
             pass
         self.tables = tables
+        # columns of tables, fetched in bulk by the first get_columns
+        self._columns: Dict[str, List[Column]] = {}
 
     @property
     def field_map(self) -> dict:
         raise NotImplementedError
 
     async def inspect(self) -> str:
+        return self.module_source([model async for _, model in self.inspect_models()])
+
+    def module_source(self, models: List[str]) -> str:
+        return self._header + "\n\n" + "\n\n\n".join(models)
+
+    async def inspect_models(self) -> AsyncIterator[Tuple[str, str]]:
+        """
+        generate source of models table by table, columns are fetched by batches of tables so
+        the first models come out before the whole schema is introspected
+        :return: (table, source of model) in order of tables
+        """
         if not self.tables:
             self.tables = await self.get_all_tables()
-        result = "from tortoise import Model, fields\n\n\n"
-        tables = []
-        for table in self.tables:
-            columns = await self.get_columns(table)
-            fields = []
-            model = self._table_template.format(table=table.title().replace("_", ""))
-            for column in columns:
+        for i in range(0, len(self.tables), self.batch_size):
+            batch = self.tables[i : i + self.batch_size]
+            columns, constraints = await self._fetch_tables(batch)
+            for table in batch:
+                yield table, self.model_source(
+                    table, columns.get(table, []), constraints.get(table)
+                )
+
+    @classmethod
+    def model_name(cls, table: str) -> str:
+        return table.title().replace("_", "")
+
+    def model_source(
+        self, table: str, columns: List[Column], constraints: Optional[Constraints] = None
+    ) -> str:
+        """
+        generate source of model
+        :param table:
+        :param columns:
+        :param constraints: foreign keys and indexes of the table
+        :return:
+        """
+        constraints = constraints or Constraints()
+        foreign_keys = constraints.foreign_keys
+        # related names are given only if the default ones would conflict
+        to_tables = Counter(x.to_table for x in foreign_keys.values())
+        model = self._table_template.format(table=self.model_name(table))
+        fields = []
+        # column: name of field in Meta
+        field_names = {}
+        for column in columns:
+            foreign_key = foreign_keys.get(column.name)
+            if foreign_key:
+                kwargs = self._fk_kwargs(
+                    table, column, foreign_key, to_tables[foreign_key.to_table] > 1
+                )
+                field = self.fk_field(**kwargs)
+                field_names[column.name] = kwargs["name"] + "_id"
+            else:
                 field = self.field_map[column.data_type](**column.translate())
-                fields.append("    " + field)
-            tables.append(model + "\n".join(fields))
-        return result + "\n\n\n".join(tables)
+                field_names[column.name] = column.name
+            fields.append("    " + field)
+        meta = []
+        for option, unique in (("unique_together", True), ("indexes", False)):
+            together = constraints.together(unique)
+            if together:
+                names = [[field_names.get(x, x) for x in columns] for columns in together]
+                meta.append(f"        {option} = {self._tuples_source(names)}")
+        source = model + "\n".join(fields)
+        if meta:
+            source += "\n\n    class Meta:\n" + "\n".join(meta)
+        return source
+
+    def _fk_kwargs(
+        self, table: str, column: Column, foreign_key: ForeignKey, conflicted: bool
+    ) -> dict:
+        kwargs = column.translate()
+        name = column.name
+        if name.endswith("_id") and len(name) > 3:
+            name = name[:-3]
+        if keyword.iskeyword(name):
+            name += "_"
+        on_delete = ON_DELETE.get(foreign_key.on_delete)
+        kwargs.update(
+            name=name,
+            field="OneToOneField" if column.unique or column.pk else "ForeignKeyField",
+            model=f'"models.{self.model_name(foreign_key.to_table)}", ',
+            related_name=f'related_name="{table}_{name}", ' if conflicted else "",
+            source_field="" if name + "_id" == column.name else f'source_field="{column.name}", ',
+            to_field=(
+                f'to_field="{foreign_key.to_column}", '
+                if foreign_key.to_column not in (None, "id")
+                else ""
+            ),
+            on_delete=f"on_delete=fields.{on_delete}, " if on_delete else "",
+        )
+        return kwargs
+
+    @staticmethod
+    def _tuples_source(items: List[List[str]]) -> str:
+        tuples = ", ".join("(" + ", ".join(f'"{x}"' for x in item) + ")" for item in items)
+        return f"({tuples},)"
 
     async def get_columns(self, table: str) -> List[Column]:
+        """
+        get columns of table, the first call fetches columns of all tables to inspect at once
+        :param table:
+        :return:
+        """
+        if table not in self._columns:
+            tables = self.tables if self.tables and table in self.tables else [table]
+            self._columns.update({x: [] for x in tables})
+            self._columns.update((await self._fetch_tables(tables))[0])
+        return self._columns[table]
+
+    async def _fetch_tables(
+        self, tables: List[str]
+    ) -> Tuple[Dict[str, List[Column]], Dict[str, Constraints]]:
+        """
+        get columns and constraints of tables, columns of single column indexes are marked
+        :param tables:
+        :return: ({table: columns}, {table: constraints})
+        """
+        columns = await self._fetch(self.get_tables_columns, self.get_table_columns, tables)
+        constraints = await self._fetch(
+            self.get_tables_constraints, self.get_table_constraints, tables
+        )
+        for table, table_constraints in constraints.items():
+            table_constraints.apply(columns.get(table, []))
+        return columns, constraints
+
+    async def _fetch(
+        self,
+        get_tables: Callable[[List[str]], Awaitable[Dict[str, T]]],
+        get_table: Callable[[str], Awaitable[T]],
+        tables: List[str],
+    ) -> Dict[str, T]:
+        """
+        get info of tables in bulk, or one by one with at most `concurrency` tables at once over
+        the pool if catalog can't be queried in bulk, e.g. SQLite without table-valued pragmas
+        :param get_tables: gets info of tables in bulk
+        :param get_table: gets info of a table
+        :param tables:
+        :return: {table: info}
+        """
+        try:
+            return await get_tables(tables)
+        except OperationalError:
+            if not self.per_table_queries:
+                raise
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def get(table: str) -> T:
+            async with semaphore:
+                return await get_table(table)
+
+        ret = await asyncio.gather(*(get(x) for x in tables))
+        return dict(zip(tables, ret))
+
+    async def get_table_columns(self, table: str) -> List[Column]:
+        """
+        get columns of a table, used when columns of tables can't be fetched in bulk
+        :param table:
+        :return: empty if table not exists
+        """
+        raise NotImplementedError
+
+    async def get_tables_columns(self, tables: List[str]) -> Dict[str, List[Column]]:
+        """
+        get columns of tables by a constant number of queries
+        :param tables:
+        :return: {table: columns}, tables not exist are left out
+        """
+        raise NotImplementedError
+
+    async def get_table_constraints(self, table: str) -> Constraints:
+        """
+        get constraints of a table, used when constraints of tables can't be fetched in bulk
+        :param table:
+        :return:
+        """
+        raise NotImplementedError
+
+    async def get_tables_constraints(self, tables: List[str]) -> Dict[str, Constraints]:
+        """
+        get foreign keys and indexes of tables by a constant number of queries
+        :param tables:
+        :return: {table: constraints}, tables not exist are left out
+        """
         raise NotImplementedError
 
     async def get_all_tables(self) -> List[str]:
         raise NotImplementedError
 
+    @classmethod
+    def fk_field(cls, **kwargs) -> str:
+        return (
+            "{name} = fields.{field}({model}{related_name}{source_field}{to_field}{pk}{null}"
+            "{on_delete}{comment})"
+        ).format(**kwargs)
+
     @classmethod
     def decimal_field(cls, **kwargs) -> str:
         return "{name} = fields.DecimalField({pk}{index}{length}{null}{default}{comment})".format(
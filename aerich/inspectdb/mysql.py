@@ -1,9 +1,19 @@
-from typing import List
+import re
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple, cast
 
-from aerich.inspectdb import Column, Inspect
+from aerich.inspectdb import Column, Constraints, ForeignKey, Inspect
 
 
 class InspectMySQL(Inspect):
+    # SHOW statements only need privileges on the table, unlike information_schema
+    per_table_queries = True
+    _FOREIGN_KEY_PATTERN = re.compile(
+        r"CONSTRAINT `(?:[^`]|``)+` FOREIGN KEY \(`((?:[^`]|``)+)`\) "
+        r"REFERENCES (?:`(?:[^`]|``)+`\.)?`((?:[^`]|``)+)` \(`((?:[^`]|``)+)`\)"
+        r"(?: ON DELETE (RESTRICT|CASCADE|SET NULL|NO ACTION|SET DEFAULT))?"
+    )
+
     @property
     def field_map(self) -> dict:
         return {
@@ -29,28 +39,16 @@ class InspectMySQL(Inspect):
         ret = await self.conn.execute_query_dict(sql, [self.database])
         return list(map(lambda x: x["TABLE_NAME"], ret))
 
-    async def get_columns(self, table: str) -> List[Column]:
-        columns = []
-        sql = """select c.*, s.NON_UNIQUE, s.INDEX_NAME
-from information_schema.COLUMNS c
-         left join information_schema.STATISTICS s on c.TABLE_NAME = s.TABLE_NAME
-    and c.TABLE_SCHEMA = s.TABLE_SCHEMA
-    and c.COLUMN_NAME = s.COLUMN_NAME
-where c.TABLE_SCHEMA = %s
-  and c.TABLE_NAME = %s"""
-        ret = await self.conn.execute_query_dict(sql, [self.database, table])
+    async def get_tables_columns(self, tables: List[str]) -> Dict[str, List[Column]]:
+        columns: Dict[str, List[Column]] = defaultdict(list)
+        sql = f"""select *
+from information_schema.COLUMNS
+where TABLE_SCHEMA = %s
+  and TABLE_NAME in ({", ".join(["%s"] * len(tables))})
+order by TABLE_NAME, ORDINAL_POSITION"""  # nosec:B608
+        ret = await self.conn.execute_query_dict(sql, [self.database, *tables])
         for row in ret:
-            non_unique = row["NON_UNIQUE"]
-            if non_unique is None:
-                unique = False
-            else:
-                unique = not non_unique
-            index_name = row["INDEX_NAME"]
-            if index_name is None:
-                index = False
-            else:
-                index = row["INDEX_NAME"] != "PRIMARY"
-            columns.append(
+            columns[row["TABLE_NAME"]].append(
                 Column(
                     name=row["COLUMN_NAME"],
                     data_type=row["DATA_TYPE"],
@@ -58,14 +56,121 @@ where c.TABLE_SCHEMA = %s
                     default=row["COLUMN_DEFAULT"],
                     pk=row["COLUMN_KEY"] == "PRI",
                     comment=row["COLUMN_COMMENT"],
-                    unique=row["COLUMN_KEY"] == "UNI",
+                    # indexes are marked by constraints
+                    unique=False,
+                    index=False,
                     extra=row["EXTRA"],
-                    # TODO: why `unque`?
-                    unque=unique,  # type:ignore
-                    index=index,
                     length=row["CHARACTER_MAXIMUM_LENGTH"],
                     max_digits=row["NUMERIC_PRECISION"],
                     decimal_places=row["NUMERIC_SCALE"],
                 )
             )
         return columns
+
+    async def get_tables_constraints(self, tables: List[str]) -> Dict[str, Constraints]:
+        constraints: Dict[str, Constraints] = defaultdict(Constraints)
+        placeholders = ", ".join(["%s"] * len(tables))
+        # functional indexes of MySQL 8 have no column name
+        sql = f"""select TABLE_NAME, INDEX_NAME, NON_UNIQUE, COLUMN_NAME
+from information_schema.STATISTICS
+where TABLE_SCHEMA = %s
+  and TABLE_NAME in ({placeholders})
+  and INDEX_NAME != 'PRIMARY'
+order by TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX"""  # nosec:B608
+        indexes: Dict[Tuple[str, str], List[Optional[str]]] = {}
+        unique: Dict[Tuple[str, str], bool] = {}
+        for row in await self.conn.execute_query_dict(sql, [self.database, *tables]):
+            key = (row["TABLE_NAME"], row["INDEX_NAME"])
+            indexes.setdefault(key, []).append(row["COLUMN_NAME"])
+            unique[key] = not row["NON_UNIQUE"]
+        sql = f"""select k.TABLE_NAME,
+       k.CONSTRAINT_NAME,
+       k.COLUMN_NAME,
+       k.REFERENCED_TABLE_NAME,
+       k.REFERENCED_COLUMN_NAME,
+       r.DELETE_RULE
+from information_schema.KEY_COLUMN_USAGE k
+         join information_schema.REFERENTIAL_CONSTRAINTS r
+              on r.CONSTRAINT_SCHEMA = k.CONSTRAINT_SCHEMA
+                  and r.TABLE_NAME = k.TABLE_NAME
+                  and r.CONSTRAINT_NAME = k.CONSTRAINT_NAME
+where k.TABLE_SCHEMA = %s
+  and k.TABLE_NAME in ({placeholders})
+order by k.TABLE_NAME, k.CONSTRAINT_NAME, k.ORDINAL_POSITION"""  # nosec:B608
+        foreign_keys: Dict[Tuple[str, str], List[dict]] = {}
+        for row in await self.conn.execute_query_dict(sql, [self.database, *tables]):
+            foreign_keys.setdefault((row["TABLE_NAME"], row["CONSTRAINT_NAME"]), []).append(row)
+        for (table, _), rows in foreign_keys.items():
+            if len(rows) == 1:
+                row = rows[0]
+                constraints[table].add_foreign_key(
+                    ForeignKey(
+                        row["COLUMN_NAME"],
+                        row["REFERENCED_TABLE_NAME"],
+                        row["REFERENCED_COLUMN_NAME"],
+                        row["DELETE_RULE"],
+                    )
+                )
+        for (table, index_name), index_columns in indexes.items():
+            if None not in index_columns:
+                constraints[table].add_index(
+                    cast(List[str], index_columns), unique[(table, index_name)]
+                )
+        return constraints
+
+    async def get_table_columns(self, table: str) -> List[Column]:
+        ret = await self.conn.execute_query_dict(f"SHOW FULL COLUMNS FROM {self._quote(table)}")
+        columns = []
+        for row in ret:
+            # e.g. varchar(200), decimal(10,2) or int unsigned
+            data_type, _, args = row["Type"].partition("(")
+            sizes = [int(x) for x in re.findall(r"\d+", args.split(")")[0])]
+            data_type = data_type.split(" ")[0]
+            columns.append(
+                Column(
+                    name=row["Field"],
+                    data_type=data_type,
+                    null=row["Null"] == "YES",
+                    default=row["Default"],
+                    pk=row["Key"] == "PRI",
+                    comment=row["Comment"],
+                    unique=False,
+                    index=False,
+                    extra=row["Extra"],
+                    length=sizes[0] if sizes and data_type in ("char", "varchar") else None,
+                    max_digits=sizes[0] if sizes and data_type == "decimal" else None,
+                    decimal_places=sizes[1] if len(sizes) > 1 and data_type == "decimal" else None,
+                )
+            )
+        return columns
+
+    async def get_table_constraints(self, table: str) -> Constraints:
+        name = self._quote(table)
+        constraints = Constraints()
+        indexes: Dict[str, List[Optional[str]]] = {}
+        unique: Dict[str, bool] = {}
+        for row in await self.conn.execute_query_dict(f"SHOW INDEX FROM {name}"):
+            if row["Key_name"] != "PRIMARY":
+                indexes.setdefault(row["Key_name"], []).append(row["Column_name"])
+                unique[row["Key_name"]] = not row["Non_unique"]
+        # foreign keys are only listed by information_schema, parse them from the definition
+        ret = await self.conn.execute_query_dict(f"SHOW CREATE TABLE {name}")
+        for match in self._FOREIGN_KEY_PATTERN.finditer(ret[0]["Create Table"]):
+            column, to_table, to_column, on_delete = match.groups()
+            constraints.add_foreign_key(
+                ForeignKey(
+                    column.replace("``", "`"),
+                    to_table.replace("``", "`"),
+                    to_column.replace("``", "`"),
+                    # the default of MySQL
+                    on_delete or "NO ACTION",
+                )
+            )
+        for index_name, index_columns in indexes.items():
+            if None not in index_columns:
+                constraints.add_index(cast(List[str], index_columns), unique[index_name])
+        return constraints
+
+    @staticmethod
+    def _quote(name: str) -> str:
+        return "`{}`".format(name.replace("`", "``"))
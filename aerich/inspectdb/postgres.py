@@ -1,14 +1,17 @@
-from typing import TYPE_CHECKING, List, Optional
+from collections import defaultdict
+from typing import TYPE_CHECKING, Dict, List, Optional
 
-from aerich.inspectdb import Column, Inspect
+from aerich.inspectdb import Column, Constraints, ForeignKey, Inspect
 
 if TYPE_CHECKING:
     from tortoise.backends.base_postgres.client import BasePostgresClient
 
 
 class InspectPostgres(Inspect):
-    def __init__(self, conn: "BasePostgresClient", tables: Optional[List[str]] = None) -> None:
-        super().__init__(conn, tables)
+    def __init__(
+        self, conn: "BasePostgresClient", tables: Optional[List[str]] = None, concurrency: int = 8
+    ) -> None:
+        super().__init__(conn, tables, concurrency)
         self.schema = conn.server_settings.get("schema") or "public"
 
     @property
@@ -39,10 +42,12 @@ class InspectPostgres(Inspect):
         ret = await self.conn.execute_query_dict(sql, [self.database, self.schema])
         return list(map(lambda x: x["table_name"], ret))
 
-    async def get_columns(self, table: str) -> List[Column]:
-        columns = []
-        sql = f"""select c.column_name,
-       col_description('public.{table}'::regclass, ordinal_position) as column_comment,
+    async def get_tables_columns(self, tables: List[str]) -> Dict[str, List[Column]]:
+        columns: Dict[str, List[Column]] = defaultdict(list)
+        sql = """select c.table_name,
+       c.column_name,
+       col_description((quote_ident(c.table_schema) || '.' || quote_ident(c.table_name))::regclass,
+                       ordinal_position) as column_comment,
        t.constraint_type as column_key,
        udt_name as data_type,
        is_nullable,
@@ -55,11 +60,12 @@ from information_schema.constraint_column_usage const
               using (table_catalog, table_schema, table_name, constraint_catalog, constraint_schema, constraint_name)
          right join information_schema.columns c using (column_name, table_catalog, table_schema, table_name)
 where c.table_catalog = $1
-  and c.table_name = $2
-  and c.table_schema = $3"""  # nosec:B608
-        ret = await self.conn.execute_query_dict(sql, [self.database, table, self.schema])
+  and c.table_name = any($2::text[])
+  and c.table_schema = $3
+order by c.table_name, c.ordinal_position"""
+        ret = await self.conn.execute_query_dict(sql, [self.database, tables, self.schema])
         for row in ret:
-            columns.append(
+            columns[row["table_name"]].append(
                 Column(
                     name=row["column_name"],
                     data_type=row["data_type"],
@@ -70,8 +76,56 @@ where c.table_catalog = $1
                     decimal_places=row["numeric_scale"],
                     comment=row["column_comment"],
                     pk=row["column_key"] == "PRIMARY KEY",
-                    unique=False,  # can't get this simply
-                    index=False,  # can't get this simply
+                    unique=False,
+                    index=False,
                 )
             )
         return columns
+
+    async def get_tables_constraints(self, tables: List[str]) -> Dict[str, Constraints]:
+        constraints: Dict[str, Constraints] = defaultdict(Constraints)
+        # indexes on plain columns, expression and partial indexes can't be described by models
+        sql = """select t.relname as table_name,
+       ix.indisunique as is_unique,
+       array_agg(a.attname order by k.position) as column_names
+from pg_index ix
+         join pg_class t on t.oid = ix.indrelid
+         join pg_class i on i.oid = ix.indexrelid
+         join pg_namespace n on n.oid = t.relnamespace
+         cross join lateral unnest(ix.indkey::int2[]) with ordinality as k(attnum, position)
+         join pg_attribute a on a.attrelid = t.oid and a.attnum = k.attnum
+where n.nspname = $1
+  and t.relname = any($2::text[])
+  and not ix.indisprimary
+  and ix.indexprs is null
+  and ix.indpred is null
+group by t.relname, i.relname, ix.indisunique
+order by t.relname, i.relname"""
+        for row in await self.conn.execute_query_dict(sql, [self.schema, tables]):
+            constraints[row["table_name"]].add_index(row["column_names"], row["is_unique"])
+        sql = """select t.relname as table_name,
+       a.attname as column_name,
+       r.relname as to_table,
+       ra.attname as to_column,
+       case c.confdeltype
+           when 'c' then 'CASCADE'
+           when 'n' then 'SET NULL'
+           when 'd' then 'SET DEFAULT'
+           when 'r' then 'RESTRICT'
+           else 'NO ACTION' end as on_delete
+from pg_constraint c
+         join pg_class t on t.oid = c.conrelid
+         join pg_namespace n on n.oid = t.relnamespace
+         join pg_class r on r.oid = c.confrelid
+         join pg_attribute a on a.attrelid = c.conrelid and a.attnum = c.conkey[1]
+         join pg_attribute ra on ra.attrelid = c.confrelid and ra.attnum = c.confkey[1]
+where c.contype = 'f'
+  and cardinality(c.conkey) = 1
+  and n.nspname = $1
+  and t.relname = any($2::text[])
+order by t.relname, c.conname"""
+        for row in await self.conn.execute_query_dict(sql, [self.schema, tables]):
+            constraints[row["table_name"]].add_foreign_key(
+                ForeignKey(row["column_name"], row["to_table"], row["to_column"], row["on_delete"])
+            )
+        return constraints
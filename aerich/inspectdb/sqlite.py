@@ -1,9 +1,12 @@
-from typing import Callable, Dict, List
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
 
-from aerich.inspectdb import Column, Inspect
+from aerich.inspectdb import Column, Constraints, ForeignKey, Inspect
 
 
 class InspectSQLite(Inspect):
+    per_table_queries = True
+
     @property
     def field_map(self) -> Dict[str, Callable[..., str]]:
         return {
@@ -21,39 +24,127 @@ class InspectSQLite(Inspect):
             "BLOB": self.binary_field,
         }
 
-    async def get_columns(self, table: str) -> List[Column]:
-        columns = []
-        sql = f"PRAGMA table_info({table})"
-        ret = await self.conn.execute_query_dict(sql)
-        columns_index = await self._get_columns_index(table)
-        for row in ret:
-            try:
-                length = row["type"].split("(")[1].split(")")[0]
-            except IndexError:
-                length = None
-            columns.append(
-                Column(
-                    name=row["name"],
-                    data_type=row["type"].split("(")[0],
-                    null=row["notnull"] == 0,
-                    default=row["dflt_value"],
-                    length=length,
-                    pk=row["pk"] == 1,
-                    unique=columns_index.get(row["name"]) == "unique",
-                    index=columns_index.get(row["name"]) == "index",
-                )
-            )
+    async def get_tables_columns(self, tables: List[str]) -> Dict[str, List[Column]]:
+        columns: Dict[str, List[Column]] = defaultdict(list)
+        placeholders = ", ".join("?" * len(tables))
+        sql = f"""select m.name as table_name, p.*
+from sqlite_master m
+         join pragma_table_info(m.name) p
+where m.type = 'table'
+  and m.name in ({placeholders})
+order by m.name, p.cid"""  # nosec:B608
+        for row in await self.conn.execute_query_dict(sql, tables):
+            columns[row["table_name"]].append(self._make_column(row))
         return columns
 
-    async def _get_columns_index(self, table: str) -> Dict[str, str]:
-        sql = f"PRAGMA index_list ({table})"
-        indexes = await self.conn.execute_query_dict(sql)
-        ret = {}
-        for index in indexes:
-            sql = f"PRAGMA index_info({index['name']})"
-            index_info = (await self.conn.execute_query_dict(sql))[0]
-            ret[index_info["name"]] = "unique" if index["unique"] else "index"
-        return ret
+    async def get_table_columns(self, table: str) -> List[Column]:
+        # plain pragmas, SQLite before 3.16 has no table-valued pragma functions
+        ret = await self.conn.execute_query_dict(f"PRAGMA table_info({self._quote(table)})")
+        return [self._make_column(row) for row in ret]
+
+    async def get_tables_constraints(self, tables: List[str]) -> Dict[str, Constraints]:
+        constraints: Dict[str, Constraints] = defaultdict(Constraints)
+        placeholders = ", ".join("?" * len(tables))
+        sql = f"""select m.name as table_name, l.name as index_name, l."unique", i.name
+from sqlite_master m
+         join pragma_index_list(m.name) l
+         join pragma_index_info(l.name) i
+where m.type = 'table'
+  and m.name in ({placeholders})
+  and l.origin != 'pk'
+order by m.name, l.seq, i.seqno"""  # nosec:B608
+        self._add_indexes(constraints, await self.conn.execute_query_dict(sql, tables))
+        sql = f"""select m.name as table_name, f.*
+from sqlite_master m
+         join pragma_foreign_key_list(m.name) f
+where m.type = 'table'
+  and m.name in ({placeholders})
+order by m.name, f.id, f.seq"""  # nosec:B608
+        self._add_foreign_keys(constraints, await self.conn.execute_query_dict(sql, tables))
+        return constraints
+
+    async def get_table_constraints(self, table: str) -> Constraints:
+        name = self._quote(table)
+        rows = []
+        for index in await self.conn.execute_query_dict(f"PRAGMA index_list({name})"):
+            if index["origin"] == "pk":
+                continue
+            sql = f"PRAGMA index_info({self._quote(index['name'])})"
+            for row in sorted(await self.conn.execute_query_dict(sql), key=lambda x: x["seqno"]):
+                rows.append(
+                    dict(
+                        table_name=table,
+                        index_name=index["name"],
+                        unique=index["unique"],
+                        name=row["name"],
+                    )
+                )
+        constraints: Dict[str, Constraints] = defaultdict(Constraints)
+        self._add_indexes(constraints, rows)
+        rows = await self.conn.execute_query_dict(f"PRAGMA foreign_key_list({name})")
+        self._add_foreign_keys(constraints, [dict(row, table_name=table) for row in rows])
+        return constraints[table]
+
+    @staticmethod
+    def _add_indexes(constraints: Dict[str, Constraints], rows: List[dict]) -> None:
+        """
+        add indexes from rows of index_info pragma, ordered by index and position in it
+        :param constraints:
+        :param rows: rows with table_name, index_name and unique of the index
+        :return:
+        """
+        indexes: Dict[Tuple[str, str], List[str]] = {}
+        unique: Dict[Tuple[str, str], bool] = {}
+        for row in rows:
+            key = (row["table_name"], row["index_name"])
+            indexes.setdefault(key, []).append(row["name"])
+            unique[key] = bool(row["unique"])
+        for (table, index_name), columns in indexes.items():
+            constraints[table].add_index(columns, unique[(table, index_name)])
+
+    @staticmethod
+    def _add_foreign_keys(constraints: Dict[str, Constraints], rows: List[dict]) -> None:
+        """
+        add single column foreign keys from rows of foreign_key_list pragma
+        :param constraints:
+        :param rows: rows with table_name
+        :return:
+        """
+        foreign_keys: Dict[Tuple[str, int], List[dict]] = {}
+        for row in rows:
+            foreign_keys.setdefault((row["table_name"], row["id"]), []).append(row)
+        for (table, _), foreign_key in foreign_keys.items():
+            if len(foreign_key) == 1:
+                row = foreign_key[0]
+                constraints[table].add_foreign_key(
+                    ForeignKey(row["from"], row["table"], row["to"], row["on_delete"])
+                )
+
+    @staticmethod
+    def _quote(name: str) -> str:
+        return '"{}"'.format(name.replace('"', '""'))
+
+    @staticmethod
+    def _make_column(row: dict) -> Column:
+        """
+        make column from row of table_info pragma, indexes are marked by constraints
+        :param row:
+        :return:
+        """
+        try:
+            length: Optional[int] = int(row["type"].split("(")[1].split(")")[0])
+        except (IndexError, ValueError):
+            length = None
+        return Column(
+            name=row["name"],
+            data_type=row["type"].split("(")[0],
+            null=row["notnull"] == 0,
+            default=row["dflt_value"],
+            length=length,
+            pk=row["pk"] == 1,
+            unique=False,
+            index=False,
+        )
 
     async def get_all_tables(self) -> List[str]:
         sql = "select tbl_name from sqlite_master where type='table' and name!='sqlite_sequence'"
@@ -1,19 +1,56 @@
 import hashlib
 import importlib
+import json
 import os
+from collections import defaultdict
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional, Set, Tuple, Type, Union, cast
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    Union,
+    cast,
+)
 
 import asyncclick as click
-from dictdiffer import diff
+from dictdiffer import diff, patch
 from tortoise import BaseDBAsyncClient, Model, Tortoise
 from tortoise.exceptions import OperationalError
+from tortoise.fields.relational import ForeignKeyFieldInstance
 from tortoise.indexes import Index
 
+from aerich.backfill import Backfill
+from aerich.cache import MigrationCache
+from aerich.coder import compress, decompress
 from aerich.ddl import BaseDDL
+from aerich.exceptions import SnapshotError
 from aerich.models import MAX_VERSION_LENGTH, Aerich
-from aerich.utils import get_app_connection, get_models_describe, is_default_function
+from aerich.operations import (
+    AddIndex,
+    AlterTable,
+    CreateTable,
+    DropTable,
+    Operation,
+    RebuildTable,
+    get_phase,
+    get_waves,
+    is_transactional,
+)
+from aerich.utils import (
+    get_app_connection,
+    get_model_fingerprint,
+    get_models_describe,
+    hybridmethod,
+    is_default_function,
+    split_sql,
+)
 
 MIGRATE_TEMPLATE = """from tortoise import BaseDBAsyncClient
 
@@ -28,17 +65,67 @@ async def downgrade(db: BaseDBAsyncClient) -> str:
         {downgrade_sql}\"\"\"
 """
 
+WAVES_TEMPLATE = """
+
+# number of statements of each wave of upgrade, statements of a wave don't depend on each other
+UPGRADE_WAVES = {upgrade_waves}
+"""
+
+NON_TRANSACTIONAL_TEMPLATE = """
+
+# number of trailing statements which can't run in a transaction, they run after it
+UPGRADE_NON_TRANSACTIONAL = {upgrade}
+DOWNGRADE_NON_TRANSACTIONAL = {downgrade}
+"""
+
+STEPS_TEMPLATE = """from typing import List
+
+from tortoise import BaseDBAsyncClient
+
+from aerich.backfill import Backfill, Step
+
+
+async def upgrade(db: BaseDBAsyncClient) -> List[Step]:
+    return [{upgrade_steps}
+    ]
+
+
+async def downgrade(db: BaseDBAsyncClient) -> List[Step]:
+    return [{downgrade_steps}
+    ]
+"""
+
+CONTRACT_TEMPLATE = """
+
+# expand migration of this contract migration, apply this one after the app is deployed with it
+EXPAND_VERSION = "{expand_version}"
+"""
+
 
 class Migrate:
+    """
+    Migration planner, methods can be called on the class, which keeps the state shared
+    in the process, or on an instance, which keeps its own state, e.g. to diff multiple
+    apps concurrently
+    """
+
     upgrade_operators: List[str] = []
     downgrade_operators: List[str] = []
-    _upgrade_fk_m2m_index_operators: List[str] = []
-    _downgrade_fk_m2m_index_operators: List[str] = []
     _upgrade_m2m: List[str] = []
     _downgrade_m2m: List[str] = []
     _aerich = Aerich.__name__
     _rename_old: List[str] = []
     _rename_new: List[str] = []
+    # number of statements of each dependency wave of upgrade_operators
+    upgrade_waves: List[int] = []
+    upgrade_non_transactional = 0
+    downgrade_non_transactional = 0
+    # operators deferred to the contract migration in expand/contract mode
+    contract_upgrade_operators: List[str] = []
+    contract_downgrade_operators: List[str] = []
+    # backfills copying renamed columns, of the expand upgrade and the contract downgrade
+    _upgrade_backfills: List[Backfill] = []
+    _contract_downgrade_backfills: List[Backfill] = []
 
     ddl: BaseDDL
     ddl_class: Type[BaseDDL]
@@ -47,110 +134,350 @@ class Migrate:
     migrate_location: Path
     dialect: str
     _db_version: Optional[str] = None
+    # write a full snapshot every N versions and deltas in between, 0 means always plain content
+    snapshot_interval: int = 0
+    # render online DDL which doesn't block writes, e.g. CREATE INDEX CONCURRENTLY
+    online_ddl: bool = False
+    # split breaking changes into expand and contract migrations of the current diff
+    expand_contract: bool = False
+    _cache: Optional[MigrationCache] = None
+
+    def __init__(
+        self, app: Optional[str] = None, snapshot_interval: int = 0, online_ddl: bool = False
+    ) -> None:
+        if app is not None:
+            self.app = app
+        self.snapshot_interval = snapshot_interval
+        self.online_ddl = online_ddl
+        self._last_version_content = None
+        self._db_version = None
+        self._cache = None
+        self.reset()
+
+    @hybridmethod
+    def reset(cls) -> None:
+        """
+        reset operators of last diff
+        :return:
+        """
+        cls.upgrade_operators = []
+        cls.downgrade_operators = []
+        cls._upgrade_m2m = []
+        cls._downgrade_m2m = []
+        cls._rename_old = []
+        cls._rename_new = []
+        cls.upgrade_waves = []
+        cls.upgrade_non_transactional = 0
+        cls.downgrade_non_transactional = 0
+        cls.contract_upgrade_operators = []
+        cls.contract_downgrade_operators = []
+        cls._upgrade_backfills = []
+        cls._contract_downgrade_backfills = []
 
     @staticmethod
     def get_field_by_name(name: str, fields: List[dict]) -> dict:
         return next(filter(lambda x: x.get("name") == name, fields))
 
-    @classmethod
+    @staticmethod
+    def get_fields_map(fields: List[dict]) -> Dict[str, dict]:
+        """
+        map field name to field describe, to avoid scanning fields for every lookup
+        :param fields:
+        :return:
+        """
+        return {cast(str, field.get("name")): field for field in fields}
+
+    @staticmethod
+    def get_rename_signature(field: dict) -> str:
+        """
+        signature of all attributes except name and db_column, fields can only be renamed to
+        fields with the same signature
+        :param field:
+        :return:
+        """
+        return json.dumps(
+            {k: v for k, v in field.items() if k not in ("name", "db_column")},
+            sort_keys=True,
+            default=str,
+        )
+
+    @hybridmethod
+    def get_rename_candidates(cls, fields: List[dict]) -> Dict[str, List[dict]]:
+        """
+        bucket fields by rename signature
+        :param fields:
+        :return:
+        """
+        ret: Dict[str, List[dict]] = defaultdict(list)
+        for field in fields:
+            ret[cls.get_rename_signature(field)].append(field)
+        return ret
+
+    @hybridmethod
     def get_all_version_files(cls) -> List[str]:
         return sorted(
             filter(lambda x: x.endswith("py"), os.listdir(cls.migrate_location)),
             key=lambda x: int(x.split("_")[0]),
         )
 
-    @classmethod
+    @hybridmethod
     def _get_model(cls, model: str) -> Type[Model]:
         return Tortoise.apps[cls.app][model]
 
-    @classmethod
+    @hybridmethod
     async def get_last_version(cls) -> Optional[Aerich]:
         try:
-            return await Aerich.filter(app=cls.app).first()
+            last_version = await Aerich.filter(app=cls.app).first()
         except OperationalError:
             return None
+        if last_version:
+            last_version.content = await cls._restore_snapshot(last_version.content)
+        return last_version
 
-    @classmethod
+    @hybridmethod
+    async def _restore_snapshot(cls, content: Any) -> Any:
+        """
+        restore models describe from content of Aerich
+        :param content: full describe, compressed full snapshot or delta to a full snapshot
+        :return:
+        """
+        if not isinstance(content, dict):
+            return content
+        snapshot = content.get("snapshot")
+        if snapshot == "full":
+            return decompress(content["data"])
+        if snapshot == "delta":
+            base = await Aerich.get_or_none(pk=content["base"])
+            if base is None:
+                # a delta is a diff to its own base, it can't be applied to another snapshot
+                raise SnapshotError(
+                    f"Full snapshot {content['base']} of app {cls.app} was deleted, "
+                    "regenerate the last version with snapshot_interval = 0"
+                )
+            base_content = decompress(cast(dict, base.content)["data"])
+            return patch(decompress(content["data"]), base_content, in_place=True)
+        return content
+
+    @hybridmethod
+    async def build_snapshot(cls, content: dict) -> dict:
+        """
+        build content to store in Aerich according to snapshot_interval
+        :param content: models describe
+        :return:
+        """
+        if cls.snapshot_interval <= 0:
+            return content
+        try:
+            last_version = await Aerich.filter(app=cls.app).first()
+        except OperationalError:
+            last_version = None
+        last_content = last_version.content if last_version else None
+        base, depth = None, 0
+        if isinstance(last_content, dict):
+            if last_content.get("snapshot") == "full":
+                base, depth = last_version, 1
+            elif last_content.get("snapshot") == "delta":
+                # a new full snapshot is stored if the base was deleted
+                base = await Aerich.get_or_none(pk=last_content["base"])
+                depth = last_content["depth"] + 1
+        if base is None or depth >= cls.snapshot_interval:
+            return {"snapshot": "full", "data": compress(content)}
+        base_content = decompress(cast(dict, base.content)["data"])
+        return {
+            "snapshot": "delta",
+            "base": base.pk,
+            "depth": depth,
+            "data": compress(list(diff(base_content, content))),
+        }
+
+    @hybridmethod
     async def _get_db_version(cls, connection: BaseDBAsyncClient) -> None:
         if cls.dialect == "mysql":
             sql = "select version() as version"
             ret = await connection.execute_query(sql)
             cls._db_version = ret[1][0].get("version")
 
-    @classmethod
+    @hybridmethod
     async def load_ddl_class(cls) -> Type[BaseDDL]:
         ddl_dialect_module = importlib.import_module(f"aerich.ddl.{cls.dialect}")
         return getattr(ddl_dialect_module, f"{cls.dialect.capitalize()}DDL")
 
-    @classmethod
-    async def init(cls, config: dict, app: str, location: str) -> None:
-        await Tortoise.init(config=config)
-        last_version = await cls.get_last_version()
+    @hybridmethod
+    async def init(cls, config: dict, app: str, location: str, init_tortoise: bool = True) -> None:
+        """
+        init tortoise and load last version of app
+        :param config: tortoise config
+        :param app:
+        :param location:
+        :param init_tortoise: False if Tortoise is already initialized, e.g. by a long-lived service
+        :return:
+        """
+        if init_tortoise:
+            await Tortoise.init(config=config)
         cls.app = app
         cls.migrate_location = Path(location, app)
+        last_version = await cls.get_last_version()
         if last_version:
             cls._last_version_content = cast(dict, last_version.content)
 
         connection = get_app_connection(config, app)
         cls.dialect = connection.schema_generator.DIALECT
         cls.ddl_class = await cls.load_ddl_class()
-        cls.ddl = cls.ddl_class(connection)
+        cls.ddl = cls.ddl_class(connection, online=cls.online_ddl)
         await cls._get_db_version(connection)
 
-    @classmethod
+    @hybridmethod
+    def get_cache(cls) -> MigrationCache:
+        """
+        rendered migration files cache of migrate location
+        :return:
+        """
+        if cls._cache is None or cls._cache.location != Path(cls.migrate_location):
+            cls._cache = MigrationCache(cls.migrate_location)
+        return cls._cache
+
+    @hybridmethod
     async def _get_last_version_num(cls) -> Optional[int]:
         last_version = await cls.get_last_version()
         if not last_version:
             return None
-        version = last_version.version
-        return int(version.split("_", 1)[0])
+        applied_num = last_version_num = int(last_version.version.split("_", 1)[0])
+        # a contract migration waiting for the deploy of its applied expand migration is kept,
+        # versions are applied in order, so the expand migration is applied if it's not after
+        # the last version
+        cache = cls.get_cache()
+        for version_file in cls.get_all_version_files():
+            version_num = int(version_file.split("_", 1)[0])
+            if version_num <= applied_num:
+                continue
+            expand_version = cache.get_expand_version(version_file)
+            if expand_version and int(expand_version.split("_", 1)[0]) <= applied_num:
+                last_version_num = version_num
+        return last_version_num
 
-    @classmethod
-    async def generate_version(cls, name=None) -> str:
+    @hybridmethod
+    async def generate_version(cls, name=None, offset: int = 0) -> str:
+        """
+        :param name:
+        :param offset: offset of version number to the next one
+        :return:
+        """
         now = datetime.now().strftime("%Y%m%d%H%M%S").replace("/", "")
         last_version_num = await cls._get_last_version_num()
         if last_version_num is None:
             return f"0_{now}_init.py"
-        version = f"{last_version_num + 1}_{now}_{name}.py"
+        version = f"{last_version_num + 1 + offset}_{now}_{name}.py"
         if len(version) > MAX_VERSION_LENGTH:
             raise ValueError(f"Version name exceeds maximum length ({MAX_VERSION_LENGTH})")
         return version
 
-    @classmethod
-    async def _generate_diff_py(cls, name) -> str:
-        version = await cls.generate_version(name)
-        # delete if same version exists
+    @hybridmethod
+    async def _generate_diff_py(cls, name, content: Optional[str] = None, offset: int = 0) -> str:
+        """
+        :param name:
+        :param content: content of version file, default to the diff
+        :param offset: offset of version number to the next one
+        :return: version file name
+        """
+        version = await cls.generate_version(name, offset)
+        # delete if same version exists, and the contract migrations of it, which follow it
+        version_num = int(version.split("_", 1)[0])
+        deleted = set()
+        cache = cls.get_cache()
         for version_file in cls.get_all_version_files():
-            if version_file.startswith(version.split("_")[0]):
+            num = int(version_file.split("_", 1)[0])
+            if num == version_num or (
+                num > version_num and cache.get_expand_version(version_file) in deleted
+            ):
+                deleted.add(version_file)
                 os.unlink(Path(cls.migrate_location, version_file))
 
-        content = cls._get_diff_file_content()
+        if content is None:
+            content = cls._get_diff_file_content()
         Path(cls.migrate_location, version).write_text(content, encoding="utf-8")
         return version
 
-    @classmethod
-    async def migrate(cls, name: str, empty: bool) -> str:
+    @hybridmethod
+    async def _generate_expand_contract_py(cls, name: str) -> str:
+        """
+        generate the expand migration, applied before the app is deployed, and the contract
+        migration linked to it, applied after
+        :param name:
+        :return: version file names
+        """
+        # generated even if there is nothing to expand, applying it records the models of the
+        # new app, so the changes deferred to the contract migration are not diffed again
+        expand_version = await cls._generate_diff_py(
+            f"{name}_expand",
+            cls._get_steps_file_content(
+                cls.upgrade_operators, cls._upgrade_backfills, cls.downgrade_operators, []
+            ),
+        )
+        content = cls._get_steps_file_content(
+            cls.contract_upgrade_operators,
+            [],
+            cls.contract_downgrade_operators,
+            cls._contract_downgrade_backfills,
+        )
+        content += CONTRACT_TEMPLATE.format(expand_version=expand_version)
+        contract_version = await cls._generate_diff_py(f"{name}_contract", content, 1)
+        return f"{expand_version} and {contract_version}"
+
+    @hybridmethod
+    async def migrate(
+        cls,
+        name: str,
+        empty: bool,
+        online: Optional[bool] = None,
+        expand_contract: bool = False,
+    ) -> str:
         """
         diff old models and new models to generate diff content
         :param name: str name for migration
         :param empty: bool if True generates empty migration
+        :param online: render online DDL for this migration, default to online_ddl
+        :param expand_contract: split renames, type changes and drops into an expand migration,
+            compatible with the app of both versions, and a contract migration
         :return:
         """
         if empty:
             return await cls._generate_diff_py(name)
+        if expand_contract and not cls.ddl._ADD_DUAL_WRITE_TEMPLATES:
+            # renamed columns can't be kept in sync while apps of both versions run
+            raise click.UsageError(
+                f"Expand/contract migration is unsupported in {cls.ddl.DIALECT}."
+            )
         new_version_content = get_models_describe(cls.app)
         last_version = cast(dict, cls._last_version_content)
-        cls.diff_models(last_version, new_version_content)
-        cls.diff_models(new_version_content, last_version, False)
+        default_online = cls.ddl.online
+        if online is not None:
+            cls.ddl.online = online
+        cls.expand_contract = expand_contract
+        try:
+            cls.diff_models(last_version, new_version_content)
+            cls.diff_models(new_version_content, last_version, False)
+        finally:
+            cls.ddl.online = default_online
+            cls.expand_contract = False
 
         cls._merge_operators()
 
+        if cls.contract_upgrade_operators:
+            return await cls._generate_expand_contract_py(name)
         if not cls.upgrade_operators:
             return ""
+        if any(
+            isinstance(x, RebuildTable) for x in cls.upgrade_operators + cls.downgrade_operators
+        ):
+            # table rebuild is a script which can't be split into statements
+            return await cls._generate_diff_py(
+                name,
+                cls._get_steps_file_content(cls.upgrade_operators, [], cls.downgrade_operators, []),
+            )
 
         return await cls._generate_diff_py(name)
 
-    @classmethod
+    @hybridmethod
     def _get_diff_file_content(cls) -> str:
         """
         builds content for diff file from template
@@ -161,33 +488,87 @@ class Migrate:
                 return ""
             return ";\n        ".join(lines) + ";"
 
-        return MIGRATE_TEMPLATE.format(
+        content = MIGRATE_TEMPLATE.format(
             upgrade_sql=join_lines(cls.upgrade_operators),
             downgrade_sql=join_lines(cls.downgrade_operators),
         )
+        if cls.upgrade_waves:
+            content += WAVES_TEMPLATE.format(upgrade_waves=cls.upgrade_waves)
+        if cls.upgrade_non_transactional or cls.downgrade_non_transactional:
+            content += NON_TRANSACTIONAL_TEMPLATE.format(
+                upgrade=cls.upgrade_non_transactional, downgrade=cls.downgrade_non_transactional
+            )
+        return content
 
-    @classmethod
-    def _add_operator(cls, operator: str, upgrade=True, fk_m2m_index=False) -> None:
+    @staticmethod
+    def _get_steps_file_content(
+        upgrade_operators: List[str],
+        upgrade_backfills: List[Backfill],
+        downgrade_operators: List[str],
+        downgrade_backfills: List[Backfill],
+    ) -> str:
+        """
+        builds content of version file whose functions return steps, backfills run after the
+        transaction, followed by statements which can't run in it
+        """
+
+        def split(operator: str) -> List[str]:
+            return [operator] if isinstance(operator, RebuildTable) else split_sql(operator)
+
+        def get_steps(operators: List[str], backfills: List[Backfill]) -> Tuple[str, int]:
+            transactional = [
+                x for operator in operators if is_transactional(operator) for x in split(operator)
+            ]
+            non_transactional = [
+                x
+                for operator in operators
+                if not is_transactional(operator)
+                for x in split(operator)
+            ]
+            steps = [
+                *map(str.__repr__, transactional),
+                *map(repr, backfills),
+                *map(str.__repr__, non_transactional),
+            ]
+            return "".join(f"\n        {step}," for step in steps), len(non_transactional)
+
+        upgrade_steps, upgrade_non_transactional = get_steps(upgrade_operators, upgrade_backfills)
+        downgrade_steps, downgrade_non_transactional = get_steps(
+            downgrade_operators, downgrade_backfills
+        )
+        content = STEPS_TEMPLATE.format(
+            upgrade_steps=upgrade_steps, downgrade_steps=downgrade_steps
+        )
+        if upgrade_non_transactional or downgrade_non_transactional:
+            content += NON_TRANSACTIONAL_TEMPLATE.format(
+                upgrade=upgrade_non_transactional, downgrade=downgrade_non_transactional
+            )
+        return content
+
+    @hybridmethod
+    def _add_operator(cls, operator: str, upgrade=True, contract=False) -> None:
         """
-        add operator,differentiate fk because fk is order limit
+        add operator, fk/m2m/index operators are typed and ordered by _merge_operators
         :param operator:
         :param upgrade:
-        :param fk_m2m_index:
+        :param contract: defer it to the contract migration
         :return:
         """
-        operator = operator.rstrip(";")
-        if upgrade:
-            if fk_m2m_index:
-                cls._upgrade_fk_m2m_index_operators.append(operator)
-            else:
-                cls.upgrade_operators.append(operator)
+        if isinstance(operator, Operation):
+            operator = operator.replace_sql(operator.rstrip(";"))
         else:
-            if fk_m2m_index:
-                cls._downgrade_fk_m2m_index_operators.append(operator)
+            operator = operator.rstrip(";")
+        if contract:
+            if upgrade:
+                cls.contract_upgrade_operators.append(operator)
             else:
-                cls.downgrade_operators.append(operator)
+                cls.contract_downgrade_operators.append(operator)
+        elif upgrade:
+            cls.upgrade_operators.append(operator)
+        else:
+            cls.downgrade_operators.append(operator)
 
-    @classmethod
+    @hybridmethod
     def _handle_indexes(cls, model: Type[Model], indexes: List[Union[Tuple[str], Index]]) -> list:
         ret: list = []
 
@@ -205,7 +586,7 @@ class Migrate:
             ret.append(index)
         return ret
 
-    @classmethod
+    @hybridmethod
     def _get_indexes(cls, model, model_describe: dict) -> Set[Union[Index, Tuple[str, ...]]]:
         indexes: Set[Union[Index, Tuple[str, ...]]] = set()
         for x in cls._handle_indexes(model, model_describe.get("indexes", [])):
@@ -215,7 +596,7 @@ class Migrate:
                 indexes.add(cast(Tuple[str, ...], tuple(x)))
         return indexes
 
-    @classmethod
+    @hybridmethod
     def diff_models(
         cls, old_models: Dict[str, dict], new_models: Dict[str, dict], upgrade=True
     ) -> None:
@@ -231,16 +612,21 @@ class Migrate:
         new_models.pop(_aerich, None)
 
         for new_model_str, new_model_describe in new_models.items():
+            old_model_describe = old_models.get(new_model_str)
+            if old_model_describe is not None and get_model_fingerprint(
+                old_model_describe
+            ) == get_model_fingerprint(new_model_describe):
+                # model unchanged
+                continue
             model = cls._get_model(new_model_describe["name"].split(".")[1])
 
-            if new_model_str not in old_models:
+            if old_model_describe is None:
                 if upgrade:
                     cls._add_operator(cls.add_model(model), upgrade)
                 else:
                     # we can't find origin model when downgrade, so skip
                     pass
             else:
-                old_model_describe = cast(dict, old_models.get(new_model_str))
                 # rename table
                 new_table = cast(str, new_model_describe.get("table"))
                 old_table = cast(str, old_model_describe.get("table"))
@@ -295,7 +681,7 @@ class Migrate:
                             cls._add_operator(
                                 cls.create_m2m(model, new_value, ref_desc),
                                 upgrade,
-                                fk_m2m_index=True,
+                                cls.expand_contract and not upgrade,
                             )
                     elif action == "remove":
                         add = False
@@ -306,19 +692,21 @@ class Migrate:
                             cls._downgrade_m2m.append(table)
                             add = True
                         if add:
-                            cls._add_operator(cls.drop_m2m(table), upgrade, True)
+                            cls._add_operator(
+                                cls.drop_m2m(table), upgrade, cls.expand_contract and upgrade
+                            )
                 # add unique_together
                 for index in new_unique_together.difference(old_unique_together):
-                    cls._add_operator(cls._add_index(model, index, True), upgrade, True)
+                    cls._add_operator(cls._add_index(model, index, True), upgrade)
                 # remove unique_together
                 for index in old_unique_together.difference(new_unique_together):
-                    cls._add_operator(cls._drop_index(model, index, True), upgrade, True)
+                    cls._add_operator(cls._drop_index(model, index, True), upgrade)
                 # add indexes
                 for idx in new_indexes.difference(old_indexes):
-                    cls._add_operator(cls._add_index(model, idx, False), upgrade, True)
+                    cls._add_operator(cls._add_index(model, idx, False), upgrade)
                 # remove indexes
                 for idx in old_indexes.difference(new_indexes):
-                    cls._add_operator(cls._drop_index(model, idx, False), upgrade, True)
+                    cls._add_operator(cls._drop_index(model, idx, False), upgrade)
                 old_data_fields = list(
                     filter(
                         lambda x: x.get("db_field_types") is not None,
@@ -332,16 +720,20 @@ class Migrate:
                     )
                 )
 
-                old_data_fields_name = cast(List[str], [i.get("name") for i in old_data_fields])
-                new_data_fields_name = cast(List[str], [i.get("name") for i in new_data_fields])
+                old_data_fields_map = cls.get_fields_map(old_data_fields)
+                new_data_fields_map = cls.get_fields_map(new_data_fields)
 
                 # add fields or rename fields
-                for new_data_field_name in set(new_data_fields_name).difference(
-                    set(old_data_fields_name)
-                ):
-                    new_data_field = cls.get_field_by_name(new_data_field_name, new_data_fields)
+                rename_candidates: Optional[Dict[str, List[dict]]] = None
+                for new_data_field_name, new_data_field in new_data_fields_map.items():
+                    if new_data_field_name in old_data_fields_map:
+                        continue
+                    if rename_candidates is None:
+                        rename_candidates = cls.get_rename_candidates(old_data_fields)
                     is_rename = False
-                    for old_data_field in old_data_fields:
+                    for old_data_field in rename_candidates.get(
+                        cls.get_rename_signature(new_data_field), []
+                    ):
                         changes = list(diff(old_data_field, new_data_field))
                         old_data_field_name = cast(str, old_data_field.get("name"))
                         if len(changes) == 2:
@@ -362,7 +754,7 @@ class Migrate:
                                         new_data_field.get("db_column"),
                                     ),
                                 )
-                                and old_data_field_name not in new_data_fields_name
+                                and old_data_field_name not in new_data_fields_map
                             ):
                                 if upgrade:
                                     is_rename = click.prompt(
@@ -376,8 +768,18 @@ class Migrate:
                                 if is_rename:
                                     cls._rename_new.append(new_data_field_name)
                                     cls._rename_old.append(old_data_field_name)
+                                    if cls.expand_contract:
+                                        cls._expand_contract_rename(
+                                            model,
+                                            *(
+                                                (old_data_field, new_data_field)
+                                                if upgrade
+                                                else (new_data_field, old_data_field)
+                                            ),
+                                            upgrade,
+                                        )
                                     # only MySQL8+ has rename syntax
-                                    if (
+                                    elif (
                                         cls.dialect == "mysql"
                                         and cls._db_version
                                         and cls._db_version.startswith("5.")
@@ -394,12 +796,15 @@ class Migrate:
                                             upgrade,
                                         )
                     if not is_rename:
+                        # restores the field dropped by the contract migration
+                        contract = cls.expand_contract and not upgrade
                         cls._add_operator(
                             cls._add_field(
                                 model,
                                 new_data_field,
                             ),
                             upgrade,
+                            contract,
                         )
                         if new_data_field["indexed"]:
                             cls._add_operator(
@@ -407,66 +812,64 @@ class Migrate:
                                     model, (new_data_field["db_column"],), new_data_field["unique"]
                                 ),
                                 upgrade,
-                                True,
+                                contract,
                             )
                 # remove fields
-                for old_data_field_name in set(old_data_fields_name).difference(
-                    set(new_data_fields_name)
-                ):
+                for old_data_field_name, old_data_field in old_data_fields_map.items():
+                    if old_data_field_name in new_data_fields_map:
+                        continue
                     # don't remove field if is renamed
                     if (upgrade and old_data_field_name in cls._rename_old) or (
                         not upgrade and old_data_field_name in cls._rename_new
                     ):
                         continue
-                    old_data_field = cls.get_field_by_name(old_data_field_name, old_data_fields)
                     db_column = cast(str, old_data_field["db_column"])
+                    # the app of last version still uses the field until it's deployed
+                    contract = cls.expand_contract and upgrade
                     cls._add_operator(
                         cls._remove_field(model, db_column),
                         upgrade,
+                        contract,
                     )
                     if old_data_field["indexed"]:
                         cls._add_operator(
                             cls._drop_index(model, {db_column}),
                             upgrade,
-                            True,
+                            contract,
                         )
 
                 old_fk_fields = cast(List[dict], old_model_describe.get("fk_fields"))
                 new_fk_fields = cast(List[dict], new_model_describe.get("fk_fields"))
 
-                old_fk_fields_name: List[str] = [i.get("name", "") for i in old_fk_fields]
-                new_fk_fields_name: List[str] = [i.get("name", "") for i in new_fk_fields]
+                old_fk_fields_map = cls.get_fields_map(old_fk_fields)
+                new_fk_fields_map = cls.get_fields_map(new_fk_fields)
 
                 # add fk
-                for new_fk_field_name in set(new_fk_fields_name).difference(
-                    set(old_fk_fields_name)
-                ):
-                    fk_field = cls.get_field_by_name(new_fk_field_name, new_fk_fields)
+                for new_fk_field_name, fk_field in new_fk_fields_map.items():
+                    if new_fk_field_name in old_fk_fields_map:
+                        continue
                     if fk_field.get("db_constraint"):
                         ref_describe = cast(dict, new_models[fk_field["python_type"]])
                         cls._add_operator(
                             cls._add_fk(model, fk_field, ref_describe),
                             upgrade,
-                            fk_m2m_index=True,
                         )
                 # drop fk
-                for old_fk_field_name in set(old_fk_fields_name).difference(
-                    set(new_fk_fields_name)
-                ):
-                    old_fk_field = cls.get_field_by_name(
-                        old_fk_field_name, cast(List[dict], old_fk_fields)
-                    )
+                for old_fk_field_name, old_fk_field in old_fk_fields_map.items():
+                    if old_fk_field_name in new_fk_fields_map:
+                        continue
                     if old_fk_field.get("db_constraint"):
                         ref_describe = cast(dict, old_models[old_fk_field["python_type"]])
                         cls._add_operator(
                             cls._drop_fk(model, old_fk_field, ref_describe),
                             upgrade,
-                            fk_m2m_index=True,
                         )
                 # change fields
-                for field_name in set(new_data_fields_name).intersection(set(old_data_fields_name)):
-                    old_data_field = cls.get_field_by_name(field_name, old_data_fields)
-                    new_data_field = cls.get_field_by_name(field_name, new_data_fields)
+                rebuild = False
+                for field_name, new_data_field in new_data_fields_map.items():
+                    if field_name not in old_data_fields_map:
+                        continue
+                    old_data_field = old_data_fields_map[field_name]
                     changes = diff(old_data_field, new_data_field)
                     modified = False
                     for change in changes:
@@ -476,19 +879,22 @@ class Migrate:
                             if old_new[0] is False and old_new[1] is True:
                                 unique = new_data_field.get("unique")
                                 cls._add_operator(
-                                    cls._add_index(model, (field_name,), unique), upgrade, True
+                                    cls._add_index(model, (field_name,), unique), upgrade
                                 )
                             else:
                                 unique = old_data_field.get("unique")
                                 cls._add_operator(
-                                    cls._drop_index(model, (field_name,), unique), upgrade, True
+                                    cls._drop_index(model, (field_name,), unique), upgrade
                                 )
                         elif option == "db_field_types.":
                             if new_data_field.get("field_type") == "DecimalField":
                                 # modify column
-                                cls._add_operator(
-                                    cls._modify_field(model, new_data_field),
+                                rebuild |= not cls._add_alter_operator(
+                                    cls._modify_field,
+                                    model,
+                                    new_data_field,
                                     upgrade,
+                                    cls.expand_contract,
                                 )
                             else:
                                 continue
@@ -497,54 +903,169 @@ class Migrate:
                                 is_default_function(old_new[0]) or is_default_function(old_new[1])
                             ):
                                 # change column default
-                                cls._add_operator(
-                                    cls._alter_default(model, new_data_field), upgrade
+                                rebuild |= not cls._add_alter_operator(
+                                    cls._alter_default, model, new_data_field, upgrade
                                 )
                         elif option == "unique":
                             # because indexed include it
                             continue
                         elif option == "nullable":
                             # change nullable
-                            cls._add_operator(cls._alter_null(model, new_data_field), upgrade)
+                            rebuild |= not cls._add_alter_operator(
+                                cls._alter_null, model, new_data_field, upgrade
+                            )
                         elif option == "description":
                             # change comment
-                            cls._add_operator(cls._set_comment(model, new_data_field), upgrade)
+                            rebuild |= not cls._add_alter_operator(
+                                cls._set_comment, model, new_data_field, upgrade
+                            )
                         else:
                             if modified:
                                 continue
                             # modify column
-                            cls._add_operator(
-                                cls._modify_field(model, new_data_field),
+                            rebuild |= not cls._add_alter_operator(
+                                cls._modify_field,
+                                model,
+                                new_data_field,
                                 upgrade,
+                                cls.expand_contract,
                             )
                             modified = True
+                if rebuild:
+                    # all column changes of the table are applied by a single rebuild
+                    cls._add_operator(
+                        cls.rebuild_table(model, new_model_describe, new_models),
+                        upgrade,
+                        cls.expand_contract,
+                    )
 
         for old_model in old_models.keys() - new_models.keys():
-            cls._add_operator(cls.drop_model(old_models[old_model]["table"]), upgrade)
+            cls._add_operator(
+                cls.drop_model(old_models[old_model]["table"]),
+                upgrade,
+                cls.expand_contract and upgrade,
+            )
 
-    @classmethod
+    @hybridmethod
+    def _add_alter_operator(
+        cls,
+        alter: Callable[[Type[Model], dict], str],
+        model: Type[Model],
+        field_describe: dict,
+        upgrade=True,
+        contract=False,
+    ) -> bool:
+        """
+        add operator altering a column
+        :param alter: operator wrapper, e.g. _alter_null
+        :param model:
+        :param field_describe:
+        :param upgrade:
+        :param contract:
+        :return: False if the dialect can't alter columns and the table has to be rebuilt
+        """
+        if cls.ddl.REBUILD_TO_ALTER:
+            return False
+        cls._add_operator(alter(model, field_describe), upgrade, contract)
+        return True
+
+    @hybridmethod
+    def _expand_contract_rename(
+        cls, model: Type[Model], old_field: dict, new_field: dict, upgrade=True
+    ) -> None:
+        """
+        rename field in expand/contract mode, the expand migration adds the new column, keeps it
+        in sync with the old one by triggers and backfills it, the contract migration drops the
+        old column once the app using it is replaced
+        :param model:
+        :param old_field: describe of field before rename
+        :param new_field: describe of field after rename
+        :param upgrade:
+        :return:
+        """
+        table = model._meta.db_table
+        old_column = cast(str, old_field["db_column"])
+        new_column = cast(str, new_field["db_column"])
+        if upgrade:
+            # the contract migration drops the triggers and the old column
+            column, source, target = new_field, old_column, new_column
+            for sql in cls.ddl.drop_dual_write(model, old_column, new_column):
+                cls._add_operator(Operation(sql, table), upgrade, True)
+            cls._add_operator(cls._remove_field(model, old_column), upgrade, True)
+        else:
+            # the contract migration is reverted by adding the old column back
+            column, source, target = old_field, new_column, old_column
+            for sql in cls.ddl.drop_dual_write(model, old_column, new_column):
+                cls._add_operator(Operation(sql, table), upgrade)
+            cls._add_operator(cls._remove_field(model, new_column), upgrade)
+        # added nullable, constraints of the column are restored after it's filled
+        operators = [cls._add_field(model, dict(column, nullable=True, default=None))]
+        if column["indexed"] and not column["unique"]:
+            # unique column is indexed by its constraint
+            operators.append(cls.ddl.add_index(model, [target]))
+        operators.extend(
+            Operation(sql, table) for sql in cls.ddl.add_dual_write(model, old_column, new_column)
+        )
+        constraints = []
+        if not column["nullable"]:
+            constraints.append(cls._alter_null(model, column))
+        if cls.ddl._get_default(model, column):
+            constraints.append(cls._alter_default(model, column))
+        quote = cls.ddl.schema_generator.quote
+        backfill = Backfill(
+            table,
+            f"{quote(target)} = {quote(source)}",
+            where=f"{quote(target)} IS NULL",
+            pk=model._meta.db_pk_column,
+            name=f"{table}.{target}",
+        )
+        if upgrade:
+            for operator in operators:
+                cls._add_operator(operator, upgrade)
+            cls._upgrade_backfills.append(backfill)
+            for operator in constraints:
+                cls._add_operator(operator, upgrade, True)
+        else:
+            for operator in operators:
+                cls._add_operator(operator, upgrade, True)
+            cls._contract_downgrade_backfills.append(backfill)
+            for operator in constraints:
+                cls._add_operator(operator, upgrade)
+
+    @hybridmethod
     def rename_table(cls, model: Type[Model], old_table_name: str, new_table_name: str) -> str:
         return cls.ddl.rename_table(model, old_table_name, new_table_name)
 
-    @classmethod
-    def add_model(cls, model: Type[Model]) -> str:
-        return cls.ddl.create_table(model)
+    @hybridmethod
+    def add_model(cls, model: Type[Model]) -> CreateTable:
+        references = []
+        for field_name in model._meta.fk_fields | model._meta.o2o_fields:
+            field = cast(ForeignKeyFieldInstance, model._meta.fields_map[field_name])
+            if field.db_constraint:
+                references.append(field.related_model._meta.db_table)
+        return CreateTable(cls.ddl.create_table(model), model._meta.db_table, references)
 
-    @classmethod
-    def drop_model(cls, table_name: str) -> str:
-        return cls.ddl.drop_table(table_name)
+    @hybridmethod
+    def rebuild_table(
+        cls, model: Type[Model], describe: dict, models: Dict[str, dict]
+    ) -> RebuildTable:
+        return cls.ddl.rebuild_table(model, describe, models)
 
-    @classmethod
+    @hybridmethod
+    def drop_model(cls, table_name: str) -> DropTable:
+        return DropTable(cls.ddl.drop_table(table_name), table_name)
+
+    @hybridmethod
     def create_m2m(
         cls, model: Type[Model], field_describe: dict, reference_table_describe: dict
     ) -> str:
         return cls.ddl.create_m2m(model, field_describe, reference_table_describe)
 
-    @classmethod
+    @hybridmethod
     def drop_m2m(cls, table_name: str) -> str:
         return cls.ddl.drop_m2m(table_name)
 
-    @classmethod
+    @hybridmethod
     def _resolve_fk_fields_name(cls, model: Type[Model], fields_name: Iterable[str]) -> List[str]:
         ret = []
         for field_name in fields_name:
@@ -557,7 +1078,7 @@ class Migrate:
                 ret.append(field_name)
         return ret
 
-    @classmethod
+    @hybridmethod
     def _drop_index(
         cls, model: Type[Model], fields_name: Union[Iterable[str], Index], unique=False
     ) -> str:
@@ -568,62 +1089,67 @@ class Migrate:
         field_names = cls._resolve_fk_fields_name(model, fields_name)
         return cls.ddl.drop_index(model, field_names, unique)
 
-    @classmethod
+    @hybridmethod
     def _add_index(
         cls, model: Type[Model], fields_name: Union[Iterable[str], Index], unique=False
     ) -> str:
         if isinstance(fields_name, Index):
-            return fields_name.get_sql(cls.ddl.schema_generator, model, False)
+            return AddIndex(
+                fields_name.get_sql(cls.ddl.schema_generator, model, False), model._meta.db_table
+            )
         field_names = cls._resolve_fk_fields_name(model, fields_name)
         return cls.ddl.add_index(model, field_names, unique)
 
-    @classmethod
+    @hybridmethod
     def _add_field(cls, model: Type[Model], field_describe: dict, is_pk: bool = False) -> str:
-        return cls.ddl.add_column(model, field_describe, is_pk)
+        return AlterTable(cls.ddl.add_column(model, field_describe, is_pk), model._meta.db_table)
 
-    @classmethod
+    @hybridmethod
     def _alter_default(cls, model: Type[Model], field_describe: dict) -> str:
-        return cls.ddl.alter_column_default(model, field_describe)
+        return AlterTable(cls.ddl.alter_column_default(model, field_describe), model._meta.db_table)
 
-    @classmethod
+    @hybridmethod
     def _alter_null(cls, model: Type[Model], field_describe: dict) -> str:
-        return cls.ddl.alter_column_null(model, field_describe)
+        return AlterTable(cls.ddl.alter_column_null(model, field_describe), model._meta.db_table)
 
-    @classmethod
+    @hybridmethod
     def _set_comment(cls, model: Type[Model], field_describe: dict) -> str:
-        return cls.ddl.set_comment(model, field_describe)
+        return AlterTable(cls.ddl.set_comment(model, field_describe), model._meta.db_table)
 
-    @classmethod
+    @hybridmethod
     def _modify_field(cls, model: Type[Model], field_describe: dict) -> str:
-        return cls.ddl.modify_column(model, field_describe)
+        return AlterTable(cls.ddl.modify_column(model, field_describe), model._meta.db_table)
 
-    @classmethod
+    @hybridmethod
     def _drop_fk(
         cls, model: Type[Model], field_describe: dict, reference_table_describe: dict
     ) -> str:
         return cls.ddl.drop_fk(model, field_describe, reference_table_describe)
 
-    @classmethod
+    @hybridmethod
     def _remove_field(cls, model: Type[Model], column_name: str) -> str:
-        return cls.ddl.drop_column(model, column_name)
+        return AlterTable(cls.ddl.drop_column(model, column_name), model._meta.db_table)
 
-    @classmethod
+    @hybridmethod
     def _rename_field(cls, model: Type[Model], old_field_name: str, new_field_name: str) -> str:
-        return cls.ddl.rename_column(model, old_field_name, new_field_name)
+        return Operation(
+            cls.ddl.rename_column(model, old_field_name, new_field_name), model._meta.db_table
+        )
 
-    @classmethod
+    @hybridmethod
     def _change_field(
         cls, model: Type[Model], old_field_describe: dict, new_field_describe: dict
     ) -> str:
         db_field_types = cast(dict, new_field_describe.get("db_field_types"))
-        return cls.ddl.change_column(
+        sql = cls.ddl.change_column(
             model,
             cast(str, old_field_describe.get("db_column")),
             cast(str, new_field_describe.get("db_column")),
             cast(str, db_field_types.get(cls.dialect) or db_field_types.get("")),
         )
+        return Operation(sql, model._meta.db_table)
 
-    @classmethod
+    @hybridmethod
     def _add_fk(
         cls, model: Type[Model], field_describe: dict, reference_table_describe: dict
     ) -> str:
@@ -636,20 +1162,125 @@ class Migrate:
         """
         return cls.ddl.add_fk(model, field_describe, reference_table_describe)
 
-    @classmethod
+    @hybridmethod
     def _merge_operators(cls) -> None:
         """
-        fk/m2m/index must be last when add,first when drop
+        fk/m2m/index must be last when add, first when drop, keeping the order they were added,
+        column changes of a table are merged, then schedule operators in dependency waves,
+        e.g. tables are created before referenced
         :return:
         """
-        for _upgrade_fk_m2m_operator in cls._upgrade_fk_m2m_index_operators:
-            if "ADD" in _upgrade_fk_m2m_operator or "CREATE" in _upgrade_fk_m2m_operator:
-                cls.upgrade_operators.append(_upgrade_fk_m2m_operator)
-            else:
-                cls.upgrade_operators.insert(0, _upgrade_fk_m2m_operator)
+        cls.upgrade_operators = cls._coalesce_operators(cls.upgrade_operators)
+        cls.downgrade_operators = cls._coalesce_operators(cls.downgrade_operators)
+        cls.contract_upgrade_operators = cls._coalesce_operators(cls.contract_upgrade_operators)
+        cls.contract_downgrade_operators = cls._coalesce_operators(cls.contract_downgrade_operators)
+        upgrade_waves = cls._schedule_operators(cls.upgrade_operators)
+        cls.upgrade_operators = [operator for wave in upgrade_waves for operator in wave]
+        cls.upgrade_waves = [size for wave in upgrade_waves for size in cls._count_waves(wave)]
+        cls.upgrade_non_transactional = cls._count_statements(
+            filter(lambda x: not is_transactional(x), cls.upgrade_operators)
+        )
+        downgrade_waves = cls._schedule_operators(cls.downgrade_operators)
+        cls.downgrade_operators = [operator for wave in downgrade_waves for operator in wave]
+        cls.downgrade_non_transactional = cls._count_statements(
+            filter(lambda x: not is_transactional(x), cls.downgrade_operators)
+        )
+        cls.contract_upgrade_operators = [
+            operator
+            for wave in cls._schedule_operators(cls.contract_upgrade_operators)
+            for operator in wave
+        ]
+        cls.contract_downgrade_operators = [
+            operator
+            for wave in cls._schedule_operators(cls.contract_downgrade_operators)
+            for operator in wave
+        ]
 
-        for _downgrade_fk_m2m_operator in cls._downgrade_fk_m2m_index_operators:
-            if "ADD" in _downgrade_fk_m2m_operator or "CREATE" in _downgrade_fk_m2m_operator:
-                cls.downgrade_operators.append(_downgrade_fk_m2m_operator)
-            else:
-                cls.downgrade_operators.insert(0, _downgrade_fk_m2m_operator)
+    @hybridmethod
+    def _coalesce_operators(cls, operators: List[str]) -> List[str]:
+        """
+        merge column changes of a table into the first of them, e.g. adding several columns
+        rewrites a MySQL table once, a change is only moved before operators of other tables
+        which don't reference its table
+        :param operators:
+        :return:
+        """
+        operators = cls._sort_operators(operators)
+        merged: List[str] = []
+        # table -> index of the change merged into
+        heads: Dict[str, int] = {}
+        for operator in operators:
+            if not isinstance(operator, Operation) or operator.table is None:
+                heads.clear()
+                merged.append(operator)
+                continue
+            table = operator.table
+            if isinstance(operator, AlterTable) and table in heads:
+                head = cast(AlterTable, merged[heads[table]])
+                sql = cls.ddl.merge_alter_table(table, [head, operator])
+                if sql is not None:
+                    merged[heads[table]] = head.replace_sql(sql)
+                    continue
+            for x in (table, *operator.references):
+                heads.pop(x, None)
+            if isinstance(operator, AlterTable):
+                heads[table] = len(merged)
+            merged.append(operator)
+        return merged
+
+    @staticmethod
+    def _count_statements(operators: Iterable[str]) -> int:
+        return sum(len(split_sql(operator)) for operator in operators)
+
+    @staticmethod
+    def _count_waves(operators: Iterable[str]) -> List[int]:
+        """
+        split a wave of operators into waves of statements, statements of an operator depend on
+        each other, e.g. CREATE INDEX on the table just created, so only the first one runs with
+        the wave and the last one with the next
+        :param operators: independent operators
+        :return: number of statements of each wave
+        """
+        waves: List[int] = []
+        size = 0
+        for operator in operators:
+            count = len(split_sql(operator))
+            if not count:
+                continue
+            if count > 1:
+                waves.append(size + 1)
+                waves.extend([1] * (count - 2))
+                size = 0
+            size += 1
+        if size:
+            waves.append(size)
+        return waves
+
+    @classmethod
+    def _schedule_operators(cls, operators: List[str]) -> List[List[str]]:
+        """
+        schedule operators in dependency waves, operators which can't run in transaction
+        are scheduled after all others, so they can run after the transaction
+        :param operators:
+        :return:
+        """
+        operators = cls._sort_operators(operators)
+        return get_waves([x for x in operators if is_transactional(x)]) + get_waves(
+            [x for x in operators if not is_transactional(x)]
+        )
+
+    @staticmethod
+    def _sort_operators(operators: List[str]) -> List[str]:
+        """
+        stable sort operators by phase in a single pass
+        :param operators:
+        :return:
+        """
+        phases: Dict[int, List[str]] = {
+            Operation.BEFORE: [],
+            Operation.MAIN: [],
+            Operation.AFTER: [],
+        }
+        for operator in operators:
+            phases[get_phase(operator)].append(operator)
+        return phases[Operation.BEFORE] + phases[Operation.MAIN] + phases[Operation.AFTER]
@@ -0,0 +1,196 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Type, TypeVar
+
+_T = TypeVar("_T", bound="Operation")
+
+
+class Operation(str):
+    """
+    SQL of a DDL statement, typed so the planner can order statements without parsing the SQL.
+    It's a str subclass, so it can be used everywhere a plain statement is expected.
+    `table` is the table it changes and `references` the tables it depends on, statements
+    without table, e.g. table renames, are barriers for all other statements.
+    """
+
+    # operations of BEFORE phase run before plain statements and AFTER phase after them
+    BEFORE = -1
+    MAIN = 0
+    AFTER = 1
+
+    phase = MAIN
+    table: Optional[str]
+    references: Tuple[str, ...]
+    # False for statements can't run in a transaction, e.g. CREATE INDEX CONCURRENTLY
+    transactional: bool
+
+    def __new__(
+        cls: Type[_T],
+        sql: str,
+        table: Optional[str] = None,
+        references: Iterable[str] = (),
+        transactional: bool = True,
+    ) -> _T:
+        obj = super().__new__(cls, sql)
+        obj.table = table
+        obj.references = tuple(references)
+        obj.transactional = transactional
+        return obj
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({str.__repr__(self)}, table={self.table!r})"
+
+    def replace_sql(self: _T, sql: str) -> _T:
+        return self.__class__(sql, self.table, self.references, self.transactional)
+
+
+class CreateTable(Operation):
+    pass
+
+
+class DropTable(Operation):
+    pass
+
+
+class AlterTable(Operation):
+    """
+    Column change of a table, e.g. add, drop or modify a column, changes of the same table can be
+    merged into a single ALTER TABLE, so the table is rewritten once.
+    """
+
+
+class DropFK(Operation):
+    phase = Operation.BEFORE
+
+
+class DropIndex(Operation):
+    phase = Operation.BEFORE
+
+
+class DropM2M(Operation):
+    phase = Operation.BEFORE
+
+
+class AddFK(Operation):
+    phase = Operation.AFTER
+
+
+class AddIndex(Operation):
+    phase = Operation.AFTER
+
+
+class CreateM2M(Operation):
+    phase = Operation.AFTER
+
+
+class RebuildTable(Operation):
+    """
+    Script rebuilding a table to alter its columns, it manages its own transaction, so it isn't
+    split into statements of the migration and runs after the transaction of the migration.
+    """
+
+    phase = Operation.AFTER
+
+
+def get_phase(operator: str) -> int:
+    """
+    get phase of operator, plain strings are in MAIN phase
+    :param operator:
+    :return:
+    """
+    return operator.phase if isinstance(operator, Operation) else Operation.MAIN
+
+
+def is_transactional(operator: str) -> bool:
+    """
+    whether operator can run in a transaction, plain strings can
+    :param operator:
+    :return:
+    """
+    return operator.transactional if isinstance(operator, Operation) else True
+
+
+def get_dependencies(operators: List[str]) -> List[Set[int]]:
+    """
+    build dependency graph of operators, an operator depends on:
+    - creation of tables it references, even if it's created later
+    - last previous operator changing its table or the tables it references
+    - previous operators referencing its table since the table was last changed
+    - previous barrier, and a barrier depends on all previous operators
+    :param operators:
+    :return: indexes of operators each operator depends on
+    """
+    creators: Dict[str, int] = {}
+    for i, operator in enumerate(operators):
+        if isinstance(operator, CreateTable) and operator.table:
+            creators.setdefault(operator.table, i)
+    dependencies: List[Set[int]] = []
+    last_writer: Dict[str, int] = {}
+    readers: Dict[str, List[int]] = {}
+    barrier: Optional[int] = None
+    since_barrier: List[int] = []
+    for i, operator in enumerate(operators):
+        deps: Set[int] = set()
+        if not isinstance(operator, Operation) or operator.table is None:
+            deps.update(since_barrier)
+            if barrier is not None:
+                deps.add(barrier)
+            barrier, since_barrier = i, []
+            last_writer.clear()
+            readers.clear()
+            dependencies.append(deps)
+            continue
+        table = operator.table
+        if barrier is not None:
+            deps.add(barrier)
+        for reference in operator.references:
+            if reference == table:
+                continue
+            if creators.get(reference, -1) > i:
+                # created later in the plan, which must run first
+                deps.add(creators[reference])
+                continue
+            if reference in last_writer:
+                deps.add(last_writer[reference])
+            readers.setdefault(reference, []).append(i)
+        if table in last_writer:
+            deps.add(last_writer[table])
+        deps.update(readers.pop(table, []))
+        deps.discard(i)
+        last_writer[table] = i
+        since_barrier.append(i)
+        dependencies.append(deps)
+    return dependencies
+
+
+def get_waves(operators: List[str]) -> List[List[str]]:
+    """
+    schedule operators in topological waves, operators of the same wave don't depend on each
+    other, each wave keeps the original order, operators in a dependency cycle keep original order
+    :param operators:
+    :return:
+    """
+    dependencies = get_dependencies(operators)
+    successors: List[List[int]] = [[] for _ in operators]
+    indegree = [len(deps) for deps in dependencies]
+    for i, deps in enumerate(dependencies):
+        for dep in deps:
+            successors[dep].append(i)
+    done = [False] * len(operators)
+    ready = [i for i, degree in enumerate(indegree) if not degree]
+    waves: List[List[str]] = []
+    remaining = len(operators)
+    while remaining:
+        if not ready:
+            # dependency cycle, release the first pending operator
+            ready = [done.index(False)]
+        wave = sorted(ready)
+        ready = []
+        for i in wave:
+            done[i] = True
+        for i in wave:
+            for successor in successors[i]:
+                indegree[successor] -= 1
+                if not indegree[successor] and not done[successor]:
+                    ready.append(successor)
+        remaining -= len(wave)
+        waves.append([operators[i] for i in wave])
+    return waves
@@ -0,0 +1,156 @@
+import hashlib
+from collections import Counter
+from typing import Optional, cast
+
+from tortoise import BaseDBAsyncClient
+
+from aerich.models import MAX_VERSION_LENGTH, Aerich
+
+# suffix of app of progress rows in aerich table, so they are not taken as versions
+PROGRESS_APP_SUFFIX = ":progress"
+# length of sha1 hex digest replacing the overflow of too long keys of progress
+_DIGEST_LENGTH = 40
+
+
+def get_progress_db(conn: BaseDBAsyncClient) -> Optional[BaseDBAsyncClient]:
+    """
+    get connection to save progress with, so it's committed with the changes of conn
+    :param conn: connection of app
+    :return: None if aerich table is in another database
+    """
+    if Aerich._meta.db.connection_name == conn.connection_name:
+        return conn
+    return None
+
+
+def _get_key(version: str, name: str) -> str:
+    """
+    get key of progress in version column, too long keys are cut and end with sha1 of the
+    whole key, so keys of different names don't collide
+    :param version:
+    :param name:
+    :return:
+    """
+    key = f"{version}:{name}"
+    if len(key) <= MAX_VERSION_LENGTH:
+        return key
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()  # nosec: B324
+    return key[: MAX_VERSION_LENGTH - _DIGEST_LENGTH] + digest
+
+
+async def get_progress(
+    app: str, version: str, name: str, default: dict, using_db: Optional[BaseDBAsyncClient] = None
+) -> Aerich:
+    """
+    get progress of version file, create it if not exist
+    :param app:
+    :param version: version file name
+    :param name: name of progress, unique in version file
+    :param default: content of new progress
+    :param using_db:
+    :return:
+    """
+    app = f"{app}{PROGRESS_APP_SUFFIX}"
+    version = _get_key(version, name)
+    progress = await Aerich.filter(app=app, version=version).using_db(using_db).first()
+    if progress is None:
+        progress = await Aerich.create(app=app, version=version, content=default, using_db=using_db)
+    return progress
+
+
+async def clear_progress(app: str, version: str) -> None:
+    """
+    delete progress of version file once the version is applied
+    :param app:
+    :param version:
+    :return:
+    """
+    # the part of version kept in cut keys, it's unique as versions start with their number
+    prefix = f"{version}:"[: MAX_VERSION_LENGTH - _DIGEST_LENGTH]
+    await Aerich.filter(app=f"{app}{PROGRESS_APP_SUFFIX}", version__startswith=prefix).delete()
+
+
+class Checkpoint:
+    """
+    Statements of version file applied out of transaction, so a rerun after failure skips them
+    and continues from the failed one. Statements are identified by content and occurrence,
+    so an edited statement runs again.
+    """
+
+    def __init__(self, progress: Aerich) -> None:
+        self.progress = progress
+        self.content = cast(dict, progress.content)
+        self._seen: Counter = Counter()
+        # number of statements recorded since the last save
+        self.unsaved = 0
+
+    @classmethod
+    async def load(
+        cls, app: str, version: str, name: str, using_db: Optional[BaseDBAsyncClient] = None
+    ) -> "Checkpoint":
+        """
+        :param app:
+        :param version: version file name
+        :param name: upgrade or downgrade
+        :param using_db:
+        :return:
+        """
+        progress = await get_progress(
+            app, version, name, {"transaction": False, "statements": {}}, using_db
+        )
+        return cls(progress)
+
+    @staticmethod
+    def _digest(statement: str) -> str:
+        return hashlib.sha256(statement.strip().encode()).hexdigest()[:16]
+
+    @property
+    def transaction_done(self) -> bool:
+        """
+        whether statements run in transaction before the others are committed
+        """
+        return self.content["transaction"]
+
+    def is_applied(self, statement: str) -> bool:
+        """
+        whether statement is applied, must be called for statements in order
+        :param statement:
+        :return:
+        """
+        digest = self._digest(statement)
+        self._seen[digest] += 1
+        return self._seen[digest] <= self.content["statements"].get(digest, 0)
+
+    def record(self, statement: str) -> None:
+        """
+        record statement is applied, it's stored by the next save
+        :param statement:
+        :return:
+        """
+        statements = self.content["statements"]
+        digest = self._digest(statement)
+        statements[digest] = statements.get(digest, 0) + 1
+        self.unsaved += 1
+
+    async def save(self, using_db: Optional[BaseDBAsyncClient] = None) -> None:
+        self.progress.content = self.content
+        await self.progress.save(update_fields=["content"], using_db=using_db)
+        self.unsaved = 0
+
+    async def apply(self, statement: str) -> None:
+        """
+        record statement is applied and store it
+        :param statement:
+        :return:
+        """
+        self.record(statement)
+        await self.save()
+
+    async def apply_transaction(self, using_db: Optional[BaseDBAsyncClient] = None) -> None:
+        """
+        record statements run in transaction are applied
+        :param using_db: the transaction, to commit the record with them
+        :return:
+        """
+        self.content["transaction"] = True
+        await self.save(using_db)
@@ -1,14 +1,19 @@
+import hashlib
 import importlib.util
+import json
 import os
 import re
 import sys
+import types
 from pathlib import Path
 from types import ModuleType
-from typing import Dict, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Union
 
 from asyncclick import BadOptionUsage, ClickException, Context
 from tortoise import BaseDBAsyncClient, Tortoise
 
+from aerich.coder import JsonEncoder
+
 
 def add_src_path(path: str) -> str:
     """
@@ -87,17 +92,89 @@ def get_models_describe(app: str) -> Dict:
     ret = {}
     for model in Tortoise.apps[app].values():
         describe = model.describe()
+        describe["fingerprint"] = get_model_fingerprint(describe)
         ret[describe.get("name")] = describe
     return ret
 
 
+def get_model_fingerprint(describe: dict) -> str:
+    """
+    get stable hash of model describe, use the stored one if exists,
+    versions created before fingerprints were added get it calculated
+    :param describe:
+    :return:
+    """
+    fingerprint = describe.get("fingerprint")
+    if fingerprint is None:
+        content = {k: v for k, v in describe.items() if k != "fingerprint"}
+        fingerprint = hashlib.sha256(
+            json.dumps(content, cls=JsonEncoder, sort_keys=True).encode()
+        ).hexdigest()
+    return fingerprint
+
+
 def is_default_function(string: str) -> Optional[re.Match]:
     return re.match(r"^<function.+>$", str(string or ""))
 
 
+def split_sql(sql: str) -> List[str]:
+    """
+    split sql script into statements by semicolons outside of quotes and comments
+    :param sql:
+    :return: stripped statements without trailing semicolons
+    """
+    statements: List[str] = []
+    start = i = 0
+    length = len(sql)
+    while i < length:
+        char = sql[i]
+        if char in "'\"`":
+            i += 1
+            while i < length and sql[i] != char:
+                i += 2 if sql[i] == "\\" else 1
+        elif sql.startswith("--", i):
+            i = sql.find("\n", i)
+            if i == -1:
+                break
+        elif sql.startswith("/*", i):
+            i = sql.find("*/", i + 2)
+            if i == -1:
+                break
+            i += 1
+        elif char == "$":
+            # postgres dollar quoted string, e.g. $$...$$ or $tag$...$tag$
+            match = re.match(r"\$\w*\$", sql[i:])
+            if match:
+                end = sql.find(match.group(), i + len(match.group()))
+                if end == -1:
+                    break
+                i = end + len(match.group()) - 1
+        elif char == ";":
+            statements.append(sql[start:i])
+            start = i + 1
+        i += 1
+    statements.append(sql[start:])
+    return [statement.strip() for statement in statements if statement.strip()]
+
+
 def import_py_file(file: Union[str, Path]) -> ModuleType:
     module_name, file_ext = os.path.splitext(os.path.split(file)[-1])
     spec = importlib.util.spec_from_file_location(module_name, file)
     module = importlib.util.module_from_spec(spec)  # type:ignore[arg-type]
     spec.loader.exec_module(module)  # type:ignore[union-attr]
     return module
+
+
+class hybridmethod:
+    """
+    like classmethod, but bound to the instance when accessed through an instance,
+    so the class can be used both as a default shared state and per instance
+    """
+
+    def __init__(self, func: Callable) -> None:
+        self.__func__ = func
+        self.__doc__ = func.__doc__
+        self.__name__ = func.__name__
+
+    def __get__(self, obj: Any, objtype: Optional[type] = None) -> Callable:
+        return types.MethodType(self.__func__, objtype if obj is None else obj)
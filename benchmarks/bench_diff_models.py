@@ -0,0 +1,82 @@
+"""
+Benchmark Migrate.diff_models on synthetic wide models.
+
+Usage: python benchmarks/bench_diff_models.py
+"""
+
+import copy
+import os
+import sys
+import time
+from typing import Dict, List
+
+from tortoise import Model, Tortoise, fields, run_async
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aerich.ddl.sqlite import SqliteDDL  # noqa:E402
+from aerich.migrate import Migrate  # noqa:E402
+from aerich.utils import get_models_describe  # noqa:E402
+
+WIDTHS = (50, 150, 400, 1000)
+# number of columns added and removed
+CHANGES = (0, 20)
+ROUNDS = 5
+
+
+def wide_model(width: int) -> type:
+    attrs: Dict[str, object] = {"__module__": __name__}
+    for i in range(width):
+        attrs[f"col_{i}"] = fields.CharField(max_length=i + 1, null=True)
+    return type(f"Wide{width}", (Model,), attrs)
+
+
+for _width in WIDTHS:
+    globals()[f"Wide{_width}"] = wide_model(_width)
+
+
+def old_describe(new: dict, changed: int) -> dict:
+    """
+    drop the last `changed` columns and add `changed` others, so they are added and removed
+    """
+    old = copy.deepcopy(new)
+    # recalculated from content when diffing
+    old.pop("fingerprint")
+    data_fields: List[dict] = old["data_fields"][: len(old["data_fields"]) - changed]
+    for i in range(changed):
+        field = copy.deepcopy(data_fields[0])
+        field.update(
+            name=f"old_{i}",
+            db_column=f"old_{i}",
+            field_type="IntField",
+            db_field_types={"": "INT"},
+            constraints={},
+        )
+        data_fields.append(field)
+    old["data_fields"] = data_fields
+    return old
+
+
+async def main() -> None:
+    await Tortoise.init(db_url="sqlite://:memory:", modules={"models": [__name__]})
+    Migrate.app = "models"
+    Migrate.ddl = SqliteDDL(Tortoise.get_connection("default"))
+    Migrate.dialect = Migrate.ddl.DIALECT
+    describe = get_models_describe("models")
+    for changed in CHANGES:
+        for width in WIDTHS:
+            name = f"models.Wide{width}"
+            new_models = {name: describe[name]}
+            old_models = {name: old_describe(describe[name], changed)}
+            started = time.perf_counter()
+            for _ in range(ROUNDS):
+                Migrate.reset()
+                Migrate.diff_models(copy.copy(old_models), copy.copy(new_models))
+                Migrate.diff_models(copy.copy(new_models), copy.copy(old_models), False)
+            elapsed = (time.perf_counter() - started) / ROUNDS
+            print(f"{width:>4} columns, {changed:>2} added and removed: {elapsed * 1000:8.2f} ms")
+    await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    run_async(main())
@@ -0,0 +1,51 @@
+"""
+Benchmark inspectdb on a synthetic SQLite schema and the import time of the CLI.
+
+Usage: python benchmarks/bench_inspectdb.py
+"""
+
+import os
+import subprocess  # nosec:B404
+import sys
+import time
+
+from tortoise import Tortoise, run_async
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aerich.inspectdb.sqlite import InspectSQLite  # noqa:E402
+
+# tables x columns of schema, 50k columns in total
+TABLES = 500
+COLUMNS = 100
+ROUNDS = 3
+
+
+def import_time() -> float:
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import aerich.cli"], check=True)  # nosec:B603
+    return time.perf_counter() - started
+
+
+async def main() -> None:
+    await Tortoise.init(db_url="sqlite://:memory:", modules={"models": []})
+    conn = Tortoise.get_connection("default")
+    for i in range(TABLES):
+        columns = ", ".join(
+            f"\"col_{j}\" VARCHAR({j + 1}) NOT NULL DEFAULT ''" for j in range(COLUMNS - 1)
+        )
+        await conn.execute_script(
+            f'CREATE TABLE "table_{i}" ("id" INTEGER PRIMARY KEY AUTOINCREMENT, {columns});'
+            f'CREATE INDEX "idx_table_{i}" ON "table_{i}" ("col_0", "col_1");'
+        )
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        await InspectSQLite(conn).inspect()
+    elapsed = (time.perf_counter() - started) / ROUNDS
+    print(f"inspectdb {TABLES * COLUMNS} columns: {elapsed * 1000:8.2f} ms")
+    print(f"import aerich.cli: {import_time() * 1000:8.2f} ms")
+    await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    run_async(main())
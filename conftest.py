@@ -30,12 +30,7 @@ tortoise_orm = {
 
 @pytest.fixture(scope="function", autouse=True)
 def reset_migrate() -> None:
-    Migrate.upgrade_operators = []
-    Migrate.downgrade_operators = []
-    Migrate._upgrade_fk_m2m_index_operators = []
-    Migrate._downgrade_fk_m2m_index_operators = []
-    Migrate._upgrade_m2m = []
-    Migrate._downgrade_m2m = []
+    Migrate.reset()
 
 
 @pytest.fixture(scope="session")
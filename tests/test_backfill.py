@@ -0,0 +1,52 @@
+import pytest
+from pytest_mock import MockerFixture
+from tortoise import Tortoise
+
+from aerich.backfill import Backfill
+from aerich.models import Aerich
+from aerich.progress import PROGRESS_APP_SUFFIX, clear_progress
+
+VERSION = "0_20240101000000_backfill.py"
+
+
+@pytest.fixture
+async def table():
+    conn = Tortoise.get_connection("default")
+    await conn.execute_script('CREATE TABLE "backfill" ("id" INT PRIMARY KEY, "a" INT, "b" INT)')
+    await conn.execute_script(
+        'INSERT INTO "backfill" ("id", "a") VALUES '
+        + ", ".join(f"({i}, {i % 2})" for i in range(1, 26))
+    )
+    yield conn
+    await conn.execute_script('DROP TABLE "backfill"')
+    await clear_progress("models", VERSION)
+
+
+async def test_backfill(table) -> None:
+    backfill = Backfill("backfill", '"b" = "a" + 1', where='"a" = 1', batch_size=5)
+    assert await backfill.run(table, "models", VERSION) == 13
+    rows = await table.execute_query_dict('SELECT "a", "b" FROM "backfill"')
+    assert all(row["b"] == (2 if row["a"] else None) for row in rows)
+    progress = await Aerich.get(app=f"models{PROGRESS_APP_SUFFIX}")
+    assert progress.version == f"{VERSION}:backfill:backfill"
+    assert progress.content == {"last": 25, "rows": 13, "done": True}
+    # done already
+    assert await backfill.run(table, "models", VERSION) == 13
+
+
+async def test_backfill_resume(table, mocker: MockerFixture) -> None:
+    backfill = Backfill("backfill", '"b" = "id"', batch_size=10, throttle=0.1)
+    sleep = mocker.patch("asyncio.sleep")
+    update = mocker.patch.object(
+        Backfill, "_update", side_effect=[10, Exception("interrupted")], autospec=True
+    )
+    with pytest.raises(Exception, match="interrupted"):
+        await backfill.run(table, "models", VERSION)
+    sleep.assert_called_once_with(0.1)
+
+    mocker.stop(update)
+    update = mocker.spy(Backfill, "_update")
+    assert await backfill.run(table, "models", VERSION) == 25
+    assert [call.args[2:] for call in update.call_args_list] == [(10, 20), (20, 25)]
+    rows = await table.execute_query_dict('SELECT "b" FROM "backfill" WHERE "b" IS NOT NULL')
+    assert len(rows) == 15
@@ -0,0 +1,80 @@
+from pathlib import Path
+
+from pytest_mock import MockerFixture
+from tortoise import Tortoise
+
+from aerich.cache import MigrationCache, compile_migration
+from aerich.migrate import MIGRATE_TEMPLATE, WAVES_TEMPLATE
+from aerich.utils import import_py_file
+
+DYNAMIC_MIGRATION = """from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    table = "user"
+    return f"DROP TABLE {table}"
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    \"\"\"nothing to do\"\"\"
+    return ""
+"""
+
+
+def test_compile_migration() -> None:
+    content = MIGRATE_TEMPLATE.format(upgrade_sql="DROP TABLE user;", downgrade_sql="")
+    assert compile_migration(content) == {
+        "upgrade": "\n        DROP TABLE user;",
+        "downgrade": "\n        ",
+        "waves": None,
+        "upgrade_non_transactional": None,
+        "downgrade_non_transactional": None,
+        "expand_version": None,
+    }
+    assert compile_migration(DYNAMIC_MIGRATION) == {
+        "upgrade": None,
+        "downgrade": "",
+        "waves": None,
+        "upgrade_non_transactional": None,
+        "downgrade_non_transactional": None,
+        "expand_version": None,
+    }
+    content += WAVES_TEMPLATE.format(upgrade_waves=[1])
+    assert compile_migration(content)["waves"] == [1]
+
+
+async def test_migration_cache(tmp_path: Path, mocker: MockerFixture) -> None:
+    conn = Tortoise.get_connection("default")
+    content = MIGRATE_TEMPLATE.format(upgrade_sql="DROP TABLE user;", downgrade_sql="")
+    Path(tmp_path, "0_20240101000000_init.py").write_text(content)
+    Path(tmp_path, "1_20240102000000_update.py").write_text(DYNAMIC_MIGRATION)
+    mock_import = mocker.patch("aerich.cache.import_py_file", wraps=import_py_file)
+
+    cache = MigrationCache(tmp_path)
+    assert await cache.render(conn, "0_20240101000000_init.py", "upgrade") == (
+        "\n        DROP TABLE user;"
+    )
+    assert await cache.render(conn, "1_20240102000000_update.py", "upgrade") == "DROP TABLE user"
+    assert await cache.render(conn, "1_20240102000000_update.py", "downgrade") == ""
+    assert mock_import.call_count == 1
+    cache.save()
+    assert Path(tmp_path, MigrationCache.filename).exists()
+
+    mock_import.reset_mock()
+    cache = MigrationCache(tmp_path)
+    await cache.render(conn, "0_20240101000000_init.py", "upgrade")
+    await cache.render(conn, "0_20240101000000_init.py", "downgrade")
+    assert mock_import.call_count == 0
+
+
+async def test_migration_cache_changed_file(tmp_path: Path) -> None:
+    conn = Tortoise.get_connection("default")
+    version_file = Path(tmp_path, "0_20240101000000_init.py")
+    version_file.write_text(MIGRATE_TEMPLATE.format(upgrade_sql="SELECT 1;", downgrade_sql=""))
+    cache = MigrationCache(tmp_path)
+    assert await cache.render(conn, version_file.name, "upgrade") == "\n        SELECT 1;"
+    cache.save()
+
+    version_file.write_text(MIGRATE_TEMPLATE.format(upgrade_sql="SELECT 22;", downgrade_sql=""))
+    cache = MigrationCache(tmp_path)
+    assert await cache.render(conn, version_file.name, "upgrade") == "\n        SELECT 22;"
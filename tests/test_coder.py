@@ -0,0 +1,45 @@
+import base64
+import pickle  # nosec: B403
+
+from pypika.terms import Field
+from tortoise.contrib.mysql.indexes import FullTextIndex
+from tortoise.contrib.postgres.indexes import GinIndex
+from tortoise.indexes import Index
+
+from aerich.coder import decoder, encoder
+
+
+def test_index_coder() -> None:
+    indexes = [
+        Index(fields=("name", "type"), name="idx_name_type"),
+        GinIndex(fields=("title",), condition={"deleted": False}),
+        FullTextIndex(fields=("body",), parser_name="ngram"),
+    ]
+    content = encoder({"indexes": indexes})
+    assert "val" not in content
+    for old, new in zip(indexes, decoder(content)["indexes"]):
+        assert type(old) is type(new)
+        assert (old.fields, old.name, old.expressions, old.extra) == (
+            new.fields,
+            new.name,
+            new.expressions,
+            new.extra,
+        )
+
+
+def test_index_coder_expressions() -> None:
+    index = Index(Field("name"), name="idx_name")
+    new = decoder(encoder(index))
+    assert new.expressions[0].get_sql() == index.expressions[0].get_sql()
+
+
+def test_legacy_pickled_index() -> None:
+    index = Index(fields=("name",))
+    content = {"type": "index", "val": base64.b64encode(pickle.dumps(index)).decode()}
+    new = decoder(encoder(content))
+    assert isinstance(new, Index)
+    assert new.fields == ["name"]
+
+
+def test_not_index_type() -> None:
+    assert decoder(encoder({"type": "unknown"})) == {"type": "unknown"}
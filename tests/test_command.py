@@ -0,0 +1,500 @@
+import asyncio
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, List, Optional
+
+import pytest
+from pytest_mock import MockerFixture
+from tortoise import Tortoise
+from tortoise.exceptions import OperationalError
+
+from aerich import Command
+from aerich.ddl.postgres import PostgresDDL
+from aerich.ddl.sqlite import SqliteDDL
+from aerich.estimate import get_table
+from aerich.migrate import (
+    CONTRACT_TEMPLATE,
+    MIGRATE_TEMPLATE,
+    NON_TRANSACTIONAL_TEMPLATE,
+    STEPS_TEMPLATE,
+    Migrate,
+)
+from aerich.models import MAX_VERSION_LENGTH, Aerich
+from aerich.progress import PROGRESS_APP_SUFFIX, Checkpoint, clear_progress
+from aerich.utils import split_sql
+from conftest import tortoise_orm
+from tests.models import Category, Email, Product
+
+
+async def test_get_migration_files_to_upgrade(mocker: MockerFixture) -> None:
+    mocker.patch.object(
+        Migrate,
+        "get_all_version_files",
+        return_value=["0_20240101000000_init.py", "1_20240102000000_update.py"],
+    )
+    command = Command(tortoise_config=tortoise_orm, app="models")
+    await Aerich.create(version="0_20240101000000_init.py", app="models", content={})
+    await Aerich.create(version="1_20240102000000_update.py", app="other", content={})
+    try:
+        assert await command._get_migration_files_to_upgrade() == ["1_20240102000000_update.py"]
+        assert await command.heads() == ["1_20240102000000_update.py"]
+    finally:
+        await Aerich.filter(app__in=["models", "other"]).delete()
+
+
+async def test_upgrade_all(tmp_path: Path, mocker: MockerFixture) -> None:
+    for app in ("models", "models_second"):
+        Path(tmp_path, app).mkdir()
+        Path(tmp_path, app, "0_20240101000000_init.py").write_text(
+            MIGRATE_TEMPLATE.format(upgrade_sql="SELECT 1;", downgrade_sql=""),
+            encoding="utf-8",
+        )
+    # apps without migrate location are skipped
+    config = dict(tortoise_orm, apps=dict(tortoise_orm["apps"], missing={"models": []}))
+    try:
+        await Command.upgrade_all(config, str(tmp_path), init_tortoise=False)
+        versions = await Aerich.filter(version="0_20240101000000_init.py").values_list(
+            "app", flat=True
+        )
+        assert sorted(versions) == ["models", "models_second"]
+        upgrade = mocker.patch.object(Command, "upgrade", autospec=True)
+        await Command.upgrade_all(config, str(tmp_path), init_tortoise=False, online_ddl=True)
+        assert [x.args[0]._migrate.online_ddl for x in upgrade.call_args_list] == [True, True]
+    finally:
+        await Aerich.filter(version="0_20240101000000_init.py").delete()
+
+
+async def test_execute_waves() -> None:
+    class Client:
+        def __init__(self) -> None:
+            self.running = self.max_running = 0
+            self.executed: List[str] = []
+
+        async def execute_script(self, sql: str) -> None:
+            self.running += 1
+            self.max_running = max(self.running, self.max_running)
+            await asyncio.sleep(0.01)
+            self.executed.append(sql)
+            self.running -= 1
+
+    sql = ";\n".join(f'CREATE INDEX "idx_{i}" ON "table_{i}" ("a")' for i in range(5)) + ";"
+    command = Command(tortoise_config=tortoise_orm, app="models")
+    client = Client()
+    await command._execute_waves(client, sql, [4, 1], concurrency=3)
+    assert client.max_running == 3
+    assert len(client.executed) == 5
+    assert client.executed[-1] == 'CREATE INDEX "idx_4" ON "table_4" ("a")'
+
+    # waves don't match statements, run them one by one
+    client = Client()
+    await command._execute_waves(client, sql, [2, 1], concurrency=3)
+    assert client.max_running == 1
+    assert client.executed == split_sql(sql)
+
+
+async def test_execute_generated_waves() -> None:
+    class Client:
+        def __init__(self) -> None:
+            self.running: List[Optional[str]] = []
+            self.overlapped = False
+            self.executed: List[str] = []
+
+        async def execute_script(self, sql: str) -> None:
+            table = get_table(sql)
+            self.overlapped |= table in self.running
+            self.running.append(table)
+            await asyncio.sleep(0.01)
+            self.executed.append(sql)
+            self.running.remove(table)
+
+    migrate = Migrate("models")
+    migrate.ddl = PostgresDDL(Migrate.ddl.client)
+    # CREATE TABLE with CREATE INDEX, COMMENT ON and CREATE UNIQUE INDEX
+    for model in (Email, Category, Product):
+        migrate._add_operator(migrate.add_model(model))
+    migrate._merge_operators()
+    sql = ";\n".join(migrate.upgrade_operators)
+    command = Command(tortoise_config=tortoise_orm, app="models")
+    # waves of old files count statements of an operator in one wave
+    for waves in (migrate.upgrade_waves, [len(split_sql(sql))]):
+        client = Client()
+        await command._execute_waves(client, sql, waves, concurrency=3)
+        assert sorted(client.executed) == sorted(split_sql(sql))
+        assert not client.overlapped
+
+
+async def test_execute_waves_checkpoint(tmp_path: Path, mocker: MockerFixture) -> None:
+    conn = Tortoise.get_connection("default")
+    command = Command(tortoise_config=tortoise_orm, app="models", location=str(tmp_path))
+    sql = (
+        'CREATE TABLE "wave_a" ("id" INT);\n'
+        'CREATE TABLE "wave_b" ("id" INT);\n'
+        'CREATE INDEX "idx_wave_a_id" ON "wave_a" ("id")'
+    )
+    command.CHECKPOINT_BATCH = 2
+    save = mocker.spy(Checkpoint, "save")
+    try:
+        checkpoint = await command._load_checkpoint("0_20240101000000_init.py")
+        await command._execute_waves(conn, sql, [2, 1], concurrency=2, checkpoint=checkpoint)
+        # progress is saved once per batch, and for the rest at the end
+        assert save.call_count == 2
+        checkpoint = await command._load_checkpoint("0_20240101000000_init.py")
+        await command._execute_waves(conn, sql, [2, 1], concurrency=2, checkpoint=checkpoint)
+        assert save.call_count == 2
+    finally:
+        await conn.execute_script('DROP TABLE IF EXISTS "wave_a"; DROP TABLE IF EXISTS "wave_b"')
+        await clear_progress("models", "0_20240101000000_init.py")
+
+
+async def test_progress_long_key() -> None:
+    version = "0_20240101000000_" + "x" * 220 + ".py"
+    # names of backfills sharing the part kept in the key
+    names = ["backfill:" + "y" * 40 + x for x in "ab"]
+    try:
+        progresses = [(await Checkpoint.load("models", version, x)).progress for x in names]
+        keys = [x.version for x in progresses]
+        assert keys[0] != keys[1] and all(len(x) == MAX_VERSION_LENGTH for x in keys)
+        assert [(await Checkpoint.load("models", version, x)).progress.pk for x in names] == [
+            x.pk for x in progresses
+        ]
+        await clear_progress("models", version)
+        assert not await Aerich.exists(app=f"models{PROGRESS_APP_SUFFIX}")
+    finally:
+        await Aerich.filter(app=f"models{PROGRESS_APP_SUFFIX}").delete()
+
+
+async def test_upgrade_script(tmp_path: Path, mocker: MockerFixture) -> None:
+    Path(tmp_path, "models").mkdir()
+    version_file = Path(tmp_path, "models", "0_20240101000000_init.py")
+    version_file.write_text(
+        MIGRATE_TEMPLATE.format(
+            upgrade_sql='CREATE TABLE "script" ("id" INT);\n'
+            '        INSERT INTO "script_later" ("id") VALUES (1);\n'
+            '        DROP TABLE "script";',
+            downgrade_sql="",
+        ),
+        encoding="utf-8",
+    )
+    conn = Tortoise.get_connection("default")
+    command = Command(tortoise_config=tortoise_orm, app="models", location=str(tmp_path))
+    await command.init(init_tortoise=False)
+    save = mocker.spy(Checkpoint, "save")
+    try:
+        with pytest.raises(OperationalError):
+            await command.upgrade(False)
+        # the statement applied before the failure is saved
+        assert save.call_count == 1
+        await conn.execute_script('CREATE TABLE "script_later" ("id" INT)')
+        # CREATE TABLE "script" is skipped, the rest saved once
+        await command.upgrade(False)
+        assert save.call_count == 2
+        assert await Aerich.exists(version=version_file.name, app="models")
+    finally:
+        await conn.execute_script(
+            'DROP TABLE IF EXISTS "script"; DROP TABLE IF EXISTS "script_later"'
+        )
+        await Aerich.filter(app__in=["models", f"models{PROGRESS_APP_SUFFIX}"]).filter(
+            version__startswith=version_file.name
+        ).delete()
+
+
+async def test_lock_retries(mocker: MockerFixture) -> None:
+    class Client:
+        def __init__(self, error: str) -> None:
+            self.error = error
+            self.executed: List[str] = []
+            self.attempts = 0
+
+        async def execute_script(self, sql: str) -> None:
+            self.executed.append(sql)
+            self.attempts += 1
+            if self.attempts < 3:
+                raise OperationalError(self.error)
+
+        async def execute(self, sql: str) -> None:
+            if sql.startswith(("SET", "RESET")):
+                self.executed.append(sql)
+            else:
+                await self.execute_script(sql)
+
+        @asynccontextmanager
+        async def acquire_connection(self) -> AsyncIterator["Client"]:
+            yield self
+
+    sleep = mocker.patch("asyncio.sleep")
+    command = Command(tortoise_config=tortoise_orm, app="models")
+    command._migrate.ddl = PostgresDDL(Migrate.ddl.client)
+    command._timeouts = (1000, None)
+    command._lock_retries = 2
+    client = Client("canceling statement due to lock timeout")
+    await command._execute(client, 'ALTER TABLE "user" ADD "age" INT')
+    assert (
+        client.executed == ['SET LOCAL lock_timeout = 1000;\nALTER TABLE "user" ADD "age" INT'] * 3
+    )
+    assert [call.args for call in sleep.call_args_list] == [(1.0,), (2.0,)]
+
+    # statements which can't run with other statements run with timeouts of the session
+    client = Client("canceling statement due to lock timeout")
+    await command._execute(client, 'CREATE INDEX CONCURRENTLY "idx" ON "user" ("age")', False)
+    assert (
+        client.executed
+        == [
+            "SET lock_timeout = 1000",
+            'CREATE INDEX CONCURRENTLY "idx" ON "user" ("age")',
+            "RESET lock_timeout",
+        ]
+        * 3
+    )
+
+    command._lock_retries = 1
+    with pytest.raises(OperationalError):
+        await command._execute(Client("canceling statement due to lock timeout"), "SELECT 1")
+    # other errors are not retried
+    client = Client('relation "user" does not exist')
+    with pytest.raises(OperationalError):
+        await command._execute(client, "SELECT 1")
+    assert len(client.executed) == 1
+
+
+async def test_upgrade_steps_non_transactional(tmp_path: Path) -> None:
+    class Client:
+        def __init__(self) -> None:
+            self.executed: List[str] = []
+
+        async def execute_script(self, sql: str) -> None:
+            self.executed.append(sql)
+
+        async def execute(self, sql: str) -> None:
+            self.executed.append(sql)
+
+        @asynccontextmanager
+        async def acquire_connection(self) -> AsyncIterator["Client"]:
+            yield self
+
+    Path(tmp_path, "models").mkdir()
+    version_file = Path(tmp_path, "models", "0_20240101000000_init.py")
+    version_file.write_text(
+        STEPS_TEMPLATE.format(
+            upgrade_steps="""
+        'ALTER TABLE "user" ADD "age" INT',
+        'CREATE INDEX CONCURRENTLY "idx_user_age" ON "user" ("age")',""",
+            downgrade_steps="",
+        )
+        + NON_TRANSACTIONAL_TEMPLATE.format(upgrade=1, downgrade=0),
+        encoding="utf-8",
+    )
+    command = Command(tortoise_config=tortoise_orm, app="models", location=str(tmp_path))
+    await command.init(init_tortoise=False)
+    command._migrate.ddl = PostgresDDL(Migrate.ddl.client)
+    command._timeouts = (1000, None)
+    client = Client()
+    try:
+        await command._upgrade(client, version_file.name)
+        # the trailing step runs with timeouts of the session, not in a transaction block
+        assert client.executed == [
+            'SET LOCAL lock_timeout = 1000;\nALTER TABLE "user" ADD "age" INT',
+            "SET lock_timeout = 1000",
+            'CREATE INDEX CONCURRENTLY "idx_user_age" ON "user" ("age")',
+            "RESET lock_timeout",
+        ]
+    finally:
+        await Aerich.filter(version=version_file.name).delete()
+
+
+async def test_execute_with_timeouts() -> None:
+    if not isinstance(Migrate.ddl, SqliteDDL):
+        return
+    command = Command(tortoise_config=tortoise_orm, app="models")
+    command._timeouts = (1500, None)
+    conn = Tortoise.get_connection("default")
+    previous = (await conn.execute_query_dict("PRAGMA busy_timeout"))[0]["timeout"]
+    await command._execute(conn, "SELECT 1")
+    # the timeout set on the connection is restored, even if the statement failed
+    assert (await conn.execute_query_dict("PRAGMA busy_timeout"))[0]["timeout"] == previous
+    with pytest.raises(OperationalError):
+        await command._execute(conn, 'SELECT * FROM "missing"')
+    assert (await conn.execute_query_dict("PRAGMA busy_timeout"))[0]["timeout"] == previous
+
+
+async def test_upgrade_non_transactional(tmp_path: Path) -> None:
+    Path(tmp_path, "models").mkdir()
+    content = MIGRATE_TEMPLATE.format(
+        upgrade_sql='CREATE TABLE "online" ("id" INT);\n'
+        '        CREATE INDEX "idx_online_id" ON "online" ("id");',
+        downgrade_sql='DROP INDEX "idx_online_id";\n        DROP TABLE "online";',
+    )
+    content += NON_TRANSACTIONAL_TEMPLATE.format(upgrade=1, downgrade=0)
+    Path(tmp_path, "models", "0_20240101000000_init.py").write_text(content, encoding="utf-8")
+    command = Command(tortoise_config=tortoise_orm, app="models", location=str(tmp_path))
+    await command.init(init_tortoise=False)
+    assert await command._render(None, "0_20240101000000_init.py", "upgrade") == (
+        'CREATE TABLE "online" ("id" INT)',
+        ['CREATE INDEX "idx_online_id" ON "online" ("id")'],
+    )
+    try:
+        await command.upgrade()
+        assert await Aerich.exists(version="0_20240101000000_init.py", app="models")
+        assert await command.downgrade(0, False) == ["0_20240101000000_init.py"]
+    finally:
+        await Aerich.filter(version="0_20240101000000_init.py").delete()
+
+
+BACKFILL_MIGRATION = """from typing import List, Union
+
+from tortoise import BaseDBAsyncClient
+
+from aerich.backfill import Backfill
+
+
+async def upgrade(db: BaseDBAsyncClient) -> List[Union[str, Backfill]]:
+    return [
+        'CREATE TABLE "steps" ("id" INT PRIMARY KEY, "a" INT)',
+        'INSERT INTO "steps" ("id") VALUES (1), (2), (3)',
+        Backfill("steps", '"a" = "id" * 2', batch_size=2),
+        'CREATE INDEX "idx_steps_a" ON "steps" ("a")',
+    ]
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return 'DROP TABLE "steps"'
+"""
+
+
+async def test_upgrade_backfill(tmp_path: Path) -> None:
+    Path(tmp_path, "models").mkdir()
+    Path(tmp_path, "models", "0_20240101000000_init.py").write_text(
+        BACKFILL_MIGRATION, encoding="utf-8"
+    )
+    command = Command(tortoise_config=tortoise_orm, app="models", location=str(tmp_path))
+    await command.init(init_tortoise=False)
+    conn = Tortoise.get_connection("default")
+    try:
+        for run_in_transaction in (True, False):
+            await command.upgrade(run_in_transaction)
+            assert await Aerich.exists(version="0_20240101000000_init.py", app="models")
+            rows = await conn.execute_query_dict('SELECT "a" FROM "steps" ORDER BY "id"')
+            assert [row["a"] for row in rows] == [2, 4, 6]
+            # progress is cleared once the version is applied
+            assert not await Aerich.exists(app=f"models{PROGRESS_APP_SUFFIX}")
+            await command.downgrade(0, False)
+    finally:
+        await Aerich.filter(version="0_20240101000000_init.py").delete()
+
+
+async def test_upgrade_empty_steps(tmp_path: Path) -> None:
+    Path(tmp_path, "models").mkdir()
+    version_file = Path(tmp_path, "models", "0_20240101000000_drop_expand.py")
+    # expand migration with nothing to expand
+    version_file.write_text(
+        STEPS_TEMPLATE.format(upgrade_steps="", downgrade_steps=""), encoding="utf-8"
+    )
+    command = Command(tortoise_config=tortoise_orm, app="models", location=str(tmp_path))
+    await command.init(init_tortoise=False)
+    try:
+        for run_in_transaction in (True, False):
+            await command.upgrade(run_in_transaction)
+            assert await Aerich.exists(version=version_file.name, app="models")
+            assert await command.downgrade(0, False) == [version_file.name]
+    finally:
+        await Aerich.filter(version=version_file.name).delete()
+
+
+async def test_upgrade_resume(tmp_path: Path) -> None:
+    Path(tmp_path, "models").mkdir()
+    version_file = Path(tmp_path, "models", "0_20240101000000_init.py")
+    conn = Tortoise.get_connection("default")
+    # (run_in_transaction, number of statements which can't run in transaction)
+    for run_in_transaction, count in ((False, 0), (False, 2), (True, 2)):
+        content = MIGRATE_TEMPLATE.format(
+            upgrade_sql='CREATE TABLE "resume" ("id" INT);\n'
+            '        INSERT INTO "resume_later" ("id") VALUES (1);\n'
+            '        DROP TABLE "resume";',
+            downgrade_sql="",
+        )
+        version_file.write_text(
+            content + NON_TRANSACTIONAL_TEMPLATE.format(upgrade=count, downgrade=0),
+            encoding="utf-8",
+        )
+        command = Command(tortoise_config=tortoise_orm, app="models", location=str(tmp_path))
+        await command.init(init_tortoise=False)
+        try:
+            with pytest.raises(OperationalError):
+                await command.upgrade(run_in_transaction)
+            assert not await Aerich.exists(version=version_file.name, app="models")
+            await conn.execute_script('CREATE TABLE "resume_later" ("id" INT)')
+            # CREATE TABLE "resume" is skipped
+            await command.upgrade(run_in_transaction)
+            assert await Aerich.exists(version=version_file.name, app="models")
+            assert not await Aerich.exists(app=f"models{PROGRESS_APP_SUFFIX}")
+        finally:
+            await conn.execute_script('DROP TABLE IF EXISTS "resume_later"')
+            await Aerich.filter(app__in=["models", f"models{PROGRESS_APP_SUFFIX}"]).filter(
+                version__startswith=version_file.name
+            ).delete()
+
+
+async def test_downgrade_resume(tmp_path: Path) -> None:
+    Path(tmp_path, "models").mkdir()
+    version_file = Path(tmp_path, "models", "0_20240101000000_init.py")
+    content = MIGRATE_TEMPLATE.format(
+        upgrade_sql='CREATE TABLE "downgrade" ("id" INT);',
+        downgrade_sql='DROP TABLE "downgrade";\n'
+        '        INSERT INTO "downgrade_later" ("id") VALUES (1);',
+    )
+    version_file.write_text(
+        content + NON_TRANSACTIONAL_TEMPLATE.format(upgrade=0, downgrade=1), encoding="utf-8"
+    )
+    command = Command(tortoise_config=tortoise_orm, app="models", location=str(tmp_path))
+    await command.init(init_tortoise=False)
+    conn = Tortoise.get_connection("default")
+    try:
+        await command.upgrade()
+        with pytest.raises(OperationalError):
+            await command.downgrade(-1, False)
+        # the version is kept until the statements out of transaction run
+        assert await Aerich.exists(version=version_file.name, app="models")
+        await conn.execute_script('CREATE TABLE "downgrade_later" ("id" INT)')
+        # DROP TABLE "downgrade" is skipped
+        assert await command.downgrade(-1, False) == [version_file.name]
+        assert not await Aerich.exists(version=version_file.name, app="models")
+        assert not await Aerich.exists(app=f"models{PROGRESS_APP_SUFFIX}")
+    finally:
+        await conn.execute_script(
+            'DROP TABLE IF EXISTS "downgrade_later"; DROP TABLE IF EXISTS "downgrade"'
+        )
+        await Aerich.filter(app__in=["models", f"models{PROGRESS_APP_SUFFIX}"]).filter(
+            version__startswith=version_file.name
+        ).delete()
+
+
+async def test_upgrade_contract(tmp_path: Path) -> None:
+    Path(tmp_path, "models").mkdir()
+    expand = "0_20240101000000_init.py"
+    contract = "1_20240101000000_update_contract.py"
+    Path(tmp_path, "models", expand).write_text(
+        MIGRATE_TEMPLATE.format(
+            upgrade_sql='CREATE TABLE "expand" ("id" INT, "old" INT);',
+            downgrade_sql='DROP TABLE "expand";',
+        ),
+        encoding="utf-8",
+    )
+    Path(tmp_path, "models", contract).write_text(
+        STEPS_TEMPLATE.format(
+            upgrade_steps="""\n        'ALTER TABLE "expand" DROP COLUMN "old"',""",
+            downgrade_steps="""\n        'ALTER TABLE "expand" ADD "old" INT',""",
+        )
+        + CONTRACT_TEMPLATE.format(expand_version=expand),
+        encoding="utf-8",
+    )
+    command = Command(tortoise_config=tortoise_orm, app="models", location=str(tmp_path))
+    await command.init(init_tortoise=False)
+    try:
+        # contract migration waits for the deploy of the expand migration
+        await command.upgrade()
+        assert await command.heads() == [contract]
+        await command.upgrade(contract=True)
+        assert await command.heads() == []
+        assert await command.downgrade(-1, False) == [contract]
+        assert await command.downgrade(-1, False) == [expand]
+    finally:
+        await Aerich.filter(app="models", version__in=[expand, contract]).delete()
@@ -1,8 +1,12 @@
+import pytest
+from tortoise.exceptions import OperationalError
+
 from aerich.ddl.mysql import MysqlDDL
 from aerich.ddl.postgres import PostgresDDL
 from aerich.ddl.sqlite import SqliteDDL
 from aerich.migrate import Migrate
-from tests.models import Category, Product, User
+from aerich.utils import get_models_describe
+from tests.models import Category, Email, Product, User
 
 
 def test_create_table():
@@ -205,3 +209,105 @@ def test_drop_fk():
         assert ret == 'ALTER TABLE "category" DROP CONSTRAINT "fk_category_user_e2e3874c"'
     else:
         assert ret == 'ALTER TABLE "category" DROP FOREIGN KEY "fk_category_user_e2e3874c"'
+
+
+def test_online_index():
+    client = Migrate.ddl.client
+    postgres = PostgresDDL(client, online=True)
+    ret = postgres.add_index(Category, ["name"])
+    assert ret == 'CREATE INDEX CONCURRENTLY "idx_category_name_8b0cb9" ON "category" ("name")'
+    assert ret.transactional is False
+    ret = postgres.drop_index(Category, ["name"], True)
+    assert ret == 'DROP INDEX CONCURRENTLY IF EXISTS "uid_category_name_8b0cb9"'
+    assert ret.transactional is False
+
+    mysql = MysqlDDL(client, online=True)
+    ret = mysql.add_index(Category, ["name"])
+    assert (
+        ret
+        == "ALTER TABLE `category` ADD INDEX `idx_category_name_8b0cb9` (`name`), ALGORITHM=INPLACE, LOCK=NONE"
+    )
+    assert ret.transactional is True
+    ret = mysql.drop_index(Category, ["name"])
+    assert (
+        ret
+        == "ALTER TABLE `category` DROP INDEX `idx_category_name_8b0cb9`, ALGORITHM=INPLACE, LOCK=NONE"
+    )
+
+    # not supported
+    assert SqliteDDL(client, online=True).add_index(Category, ["name"]).transactional is True
+
+
+def test_set_timeouts():
+    client = Migrate.ddl.client
+    postgres = PostgresDDL(client)
+    assert postgres.set_timeouts(1500, 60000) == [
+        "SET LOCAL lock_timeout = 1500",
+        "SET LOCAL statement_timeout = 60000",
+    ]
+    assert postgres.set_timeouts() == []
+    # statements out of transaction set them for the session
+    assert postgres.set_timeouts(1500, 60000, session=True) == [
+        "SET lock_timeout = 1500",
+        "SET statement_timeout = 60000",
+    ]
+    assert postgres.is_lock_timeout(Exception("canceling statement due to lock timeout"))
+    assert not postgres.is_lock_timeout(Exception("canceling statement due to user request"))
+
+    mysql = MysqlDDL(client)
+    # only for the session, statement timeout is not supported
+    assert mysql.set_timeouts(1500, 60000) == []
+    assert mysql.set_timeouts(1500, 60000, session=True) == ["SET SESSION lock_wait_timeout = 2"]
+    assert mysql.is_lock_timeout(Exception("(1205, 'Lock wait timeout exceeded')"))
+
+    assert SqliteDDL(client).set_timeouts(1500, session=True) == ["PRAGMA busy_timeout = 1500"]
+
+
+async def test_rebuild_table():
+    if not isinstance(Migrate.ddl, SqliteDDL):
+        return
+    conn = Migrate.ddl.client
+    await conn.execute_script(
+        'INSERT INTO "user" ("id", "username", "password", "last_login", "intro", "longitude")'
+        " VALUES (100, 'rebuild', '', '2024-01-01', '', '');"
+        """INSERT INTO "email" ("email_id", "email", "address") VALUES (100, 'a@b.c', 'x');"""
+        'INSERT INTO "email_user" ("email_id", "user_id") VALUES (100, 100)'
+    )
+    models = get_models_describe("models")
+    describe = models["models.Email"]
+    address = describe["data_fields"][-1]
+    assert address["name"] == "address"
+    describe["data_fields"][-1] = dict(address, nullable=True)
+    try:
+        await Migrate.ddl.execute_with_timeouts(
+            conn, Migrate.ddl.rebuild_table(Email, describe, models)
+        )
+        await conn.execute_script(
+            """INSERT INTO "email" ("email_id", "email") VALUES (101, 'd@e.f')"""
+        )
+        rows = await conn.execute_query_dict('SELECT "email_id", "address" FROM "email"')
+        assert rows == [{"email_id": 100, "address": "x"}, {"email_id": 101, "address": None}]
+        # rows referencing the table are kept, indexes are recreated
+        rows = await conn.execute_query_dict('SELECT "email_id" FROM "email_user"')
+        assert rows == [{"email_id": 100}]
+        rows = await conn.execute_query_dict(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'email'"
+        )
+        assert rows == [{"name": "idx_email_email_4a1a33"}]
+
+        # a failed rebuild, address of 101 is null, is rolled back and foreign keys are enabled
+        describe["data_fields"][-1] = address
+        with pytest.raises(OperationalError):
+            await Migrate.ddl.execute_with_timeouts(
+                conn, Migrate.ddl.rebuild_table(Email, describe, models)
+            )
+        assert await conn.execute_query_dict("PRAGMA foreign_keys") == [{"foreign_keys": 1}]
+        rows = await conn.execute_query_dict(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = '_aerich_email'"
+        )
+        assert rows == []
+        await conn.execute_script("BEGIN; ROLLBACK")
+    finally:
+        await conn.execute_script(
+            'DELETE FROM "email_user";DELETE FROM "email";DELETE FROM "user" WHERE "id" = 100'
+        )
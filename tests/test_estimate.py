@@ -0,0 +1,99 @@
+from pathlib import Path
+from typing import List
+
+from tortoise import Tortoise
+
+from aerich import Command
+from aerich.backfill import Backfill, Step
+from aerich.ddl import BaseDDL
+from aerich.ddl.mysql import MysqlDDL
+from aerich.ddl.postgres import PostgresDDL
+from aerich.estimate import (
+    METADATA,
+    ONLINE,
+    REWRITE,
+    SCAN,
+    Estimate,
+    TableStats,
+    estimate_steps,
+    get_table,
+)
+from aerich.migrate import MIGRATE_TEMPLATE, Migrate
+from conftest import tortoise_orm
+
+
+def test_get_impact() -> None:
+    ddl: BaseDDL = PostgresDDL(Migrate.ddl.client)
+    assert ddl.get_impact('ALTER TABLE "user" ADD "age" INT') == METADATA
+    assert ddl.get_impact('ALTER TABLE "user" ADD "age" INT, ALTER COLUMN "a" SET NOT NULL') == SCAN
+    assert (
+        ddl.get_impact('ALTER TABLE "user" ALTER COLUMN "a" TYPE TEXT USING "a"::TEXT') == REWRITE
+    )
+    assert ddl.get_impact('CREATE INDEX "idx_user_a" ON "user" ("a")') == SCAN
+    assert ddl.get_impact('CREATE INDEX CONCURRENTLY "idx_user_a" ON "user" ("a")') == ONLINE
+    ddl = MysqlDDL(Migrate.ddl.client)
+    assert ddl.get_impact("ALTER TABLE `user` MODIFY COLUMN `a` TEXT NOT NULL") == REWRITE
+    assert ddl.get_impact("ALTER TABLE `user` ADD INDEX `idx_user_a` (`a`)") == SCAN
+    sql = "ALTER TABLE `user` ADD INDEX `idx_user_a` (`a`), ALGORITHM=INPLACE, LOCK=NONE"
+    assert ddl.get_impact(sql) == ONLINE
+    assert ddl.get_impact("ALTER TABLE `user` ALTER COLUMN `a` SET DEFAULT 0") == METADATA
+
+
+def test_estimate_steps() -> None:
+    assert get_table('CREATE UNIQUE INDEX "uid_user_a" ON "user" ("a")') == "user"
+    assert get_table('DROP INDEX "uid_user_a"') is None
+    steps: List[Step] = [
+        'ALTER TABLE "user" ALTER COLUMN "a" TYPE TEXT USING "a"::TEXT',
+        'CREATE TABLE "new" ("id" INT)',
+        Backfill("user", '"b" = "a"'),
+        'ALTER TABLE "new" ADD CONSTRAINT "fk" FOREIGN KEY ("id") REFERENCES "user" ("id")',
+    ]
+    stats: TableStats = {"user": (1_000_000, 200 << 20)}
+    rewrite, create, backfill, fk = estimate_steps(
+        PostgresDDL(Migrate.ddl.client), "1_update.py", steps, stats
+    )
+    assert (rewrite.impact, rewrite.duration, rewrite.heavy) == (REWRITE, "seconds", True)
+    assert (create.table, create.duration, create.heavy) == ("new", "instant", False)
+    assert (backfill.impact, backfill.rows, backfill.duration) == (ONLINE, 1_000_000, "seconds")
+    # new table is empty
+    assert (fk.impact, fk.rows, fk.duration) == (SCAN, 0, "instant")
+    assert Estimate("1_update.py", "", "user", SCAN, 10**9).duration == "minutes"
+    assert Estimate("1_update.py", "", "user", REWRITE, 10**9).duration == "hours"
+    assert Estimate("1_update.py", "", "user", REWRITE).duration == "unknown"
+
+
+async def test_command_estimate(tmp_path: Path) -> None:
+    Path(tmp_path, "models").mkdir()
+    Path(tmp_path, "models", "0_20240101000000_init.py").write_text(
+        MIGRATE_TEMPLATE.format(
+            upgrade_sql='CREATE INDEX "idx_category_slug" ON "category" ("slug");\n'
+            '        DROP INDEX "idx_category_slug";',
+            downgrade_sql="",
+        ),
+        encoding="utf-8",
+    )
+    command = Command(tortoise_config=tortoise_orm, app="models", location=str(tmp_path))
+    await command.init(init_tortoise=False)
+    if not isinstance(command._migrate.ddl, (MysqlDDL, PostgresDDL)):
+        # SQLite doesn't count the rows, they are unknown until analyzed
+        create, drop = await command.estimate()
+        assert (create.table, create.impact, create.rows) == ("category", SCAN, None)
+        assert (drop.table, drop.impact, drop.duration) == (None, METADATA, "instant")
+        conn = Tortoise.get_connection("default")
+        await conn.execute_script(
+            'INSERT INTO "user" ("id", "username", "password", "last_login", "intro", "longitude")'
+            " VALUES (100, 'estimate', '', '2024-01-01', '', '');"
+            'INSERT INTO "category" ("slug", "name", "title", "user_id")'
+            " VALUES ('a', 'a', 'a', 100), ('b', 'b', 'b', 100);"
+            "ANALYZE"
+        )
+        try:
+            rows = await conn.execute_query_dict('SELECT COUNT(*) AS "count" FROM "category"')
+            create, _ = await command.estimate()
+            assert create.rows == rows[0]["count"]
+        finally:
+            await conn.execute_script(
+                'DELETE FROM "category" WHERE "user_id" = 100;'
+                'DELETE FROM "user" WHERE "id" = 100;'
+                "DROP TABLE sqlite_stat1"
+            )
@@ -0,0 +1,222 @@
+import asyncio
+from pathlib import Path
+from typing import List, Optional
+
+import pytest
+from pytest_mock import MockerFixture
+from tortoise import Tortoise
+from tortoise.exceptions import OperationalError
+
+from aerich import Command
+from aerich.ddl.sqlite import SqliteDDL
+from aerich.inspectdb import Column, Constraints, ForeignKey
+from aerich.inspectdb.mysql import InspectMySQL
+from aerich.inspectdb.postgres import InspectPostgres
+from aerich.inspectdb.sqlite import InspectSQLite
+from aerich.migrate import Migrate
+from conftest import tortoise_orm
+
+
+async def test_inspect_sqlite(mocker: MockerFixture) -> None:
+    if not isinstance(Migrate.ddl, SqliteDDL):
+        return
+    conn = Tortoise.get_connection("default")
+    inspect = InspectSQLite(conn, ["user", "email", "category", "product", "missing"])
+    query = mocker.spy(conn, "execute_query_dict")
+    ret = await inspect.inspect()
+    assert "class User(Model):\n    id = fields.IntField(pk=True, )\n" in ret
+    assert "    username = fields.CharField(unique=True, max_length=20, )\n" in ret
+    assert "    email = fields.CharField(index=True, max_length=200, )\n" in ret
+    assert '    user = fields.ForeignKeyField("models.User", )' in ret
+    assert (
+        "    class Meta:\n"
+        '        unique_together = (("name", "type_db_alias"),)\n'
+        '        indexes = (("name", "type_db_alias"),)'
+    ) in ret
+    # columns, indexes and foreign keys of all tables are fetched at once
+    assert query.call_count == 3
+    # columns got by get_columns are cached
+    assert [x.name for x in await inspect.get_columns("email")] == [
+        "email_id",
+        "email",
+        "is_primary",
+        "address",
+    ]
+    assert await inspect.get_columns("missing") == []
+    assert query.call_count == 6
+
+
+async def test_inspect_sqlite_concurrently(mocker: MockerFixture) -> None:
+    if not isinstance(Migrate.ddl, SqliteDDL):
+        return
+    conn = Tortoise.get_connection("default")
+    tables = ["user", "email", "category", "product", "config", "missing"]
+    expected = await InspectSQLite(conn, tables).inspect()
+    assert "class Product(Model):" in expected and "class Config(Model):" in expected
+    inspect = InspectSQLite(conn, tables, concurrency=2)
+    for method in ("get_tables_columns", "get_tables_constraints"):
+        mocker.patch.object(inspect, method, side_effect=OperationalError("no such table"))
+    running = max_running = 0
+    get_table_columns = inspect.get_table_columns
+
+    async def count_running(table: str) -> List[Column]:
+        nonlocal running, max_running
+        running += 1
+        max_running = max(running, max_running)
+        await asyncio.sleep(0)
+        try:
+            return await get_table_columns(table)
+        finally:
+            running -= 1
+
+    mocker.patch.object(inspect, "get_table_columns", side_effect=count_running)
+    # tables are introspected one by one, in order of tables
+    assert await inspect.inspect() == expected
+    assert max_running == 2
+    assert await inspect.get_columns("missing") == []
+
+
+class Client:
+    """
+    client of a user without privileges on information_schema
+    """
+
+    database = "test"
+    server_settings: dict = {}
+
+    def __init__(self, rows: dict) -> None:
+        self.rows = rows
+
+    async def execute_query_dict(self, sql: str, values: Optional[list] = None) -> List[dict]:
+        if "information_schema" in sql:
+            raise OperationalError("SELECT command denied")
+        return self.rows[sql]
+
+
+async def test_inspect_mysql_per_table() -> None:
+    def column(field: str, type_: str, **kwargs) -> dict:
+        row = dict(Field=field, Type=type_, Null="NO", Key="", Default=None, Extra="", Comment="")
+        return dict(row, **kwargs)
+
+    client = Client(
+        {
+            "SHOW FULL COLUMNS FROM `product`": [
+                column("id", "int", Key="PRI", Extra="auto_increment"),
+                column("name", "varchar(50)", Key="UNI"),
+                column("price", "decimal(10,2)"),
+                column("category_id", "int unsigned", Key="MUL"),
+            ],
+            "SHOW INDEX FROM `product`": [
+                dict(Key_name="PRIMARY", Non_unique=0, Column_name="id"),
+                dict(Key_name="uid_product_name", Non_unique=0, Column_name="name"),
+                dict(Key_name="fk_product_category", Non_unique=1, Column_name="category_id"),
+            ],
+            "SHOW CREATE TABLE `product`": [
+                {
+                    "Table": "product",
+                    "Create Table": "CREATE TABLE `product` (\n"
+                    "  CONSTRAINT `fk_product_category` FOREIGN KEY (`category_id`) "
+                    "REFERENCES `category` (`id`) ON DELETE SET NULL\n"
+                    ") ENGINE=InnoDB",
+                }
+            ],
+        }
+    )
+    inspect = InspectMySQL(client, ["product"])  # type: ignore[arg-type]
+    assert await inspect.inspect() == (
+        "from tortoise import Model, fields\n\n\n"
+        "class Product(Model):\n"
+        "    id = fields.IntField(pk=True, )\n"
+        "    name = fields.CharField(unique=True, max_length=50, )\n"
+        "    price = fields.DecimalField(max_digits=10, decimal_places=2)\n"
+        '    category = fields.ForeignKeyField("models.Category", '
+        "on_delete=fields.SET_NULL, )"
+    )
+
+
+async def test_inspect_postgres_no_fallback() -> None:
+    # catalog of Postgres can't be queried per table other than the bulk queries
+    inspect = InspectPostgres(Client({}), ["product"])  # type: ignore[arg-type]
+    with pytest.raises(OperationalError):
+        await inspect.inspect()
+
+
+async def test_inspectdb_stream(tmp_path: Path) -> None:
+    if not isinstance(Migrate.ddl, SqliteDDL):
+        return
+    command = Command(tortoise_config=tortoise_orm, app="models", location=str(tmp_path))
+    tables = ["user", "email", "category"]
+    models = [x async for x in command.inspectdb_models(tables)]
+    assert [table for table, _ in models] == tables
+    source = await command.inspectdb(tables)
+    assert source == "from tortoise import Model, fields\n\n\n" + "\n\n\n".join(
+        model for _, model in models
+    )
+    paths = [x async for x in command.inspectdb_to_dir(str(tmp_path / "inspected"), tables)]
+    assert [x.name for x in paths] == ["user.py", "email.py", "category.py", "__init__.py"]
+    assert (
+        paths[0].read_text("utf-8")
+        == "from tortoise import Model, fields\n\n\n" + models[0][1] + "\n"
+    )
+    assert "from .email import Email  # noqa:F401\n" in paths[-1].read_text("utf-8")
+
+
+def test_model_source() -> None:
+    inspect = InspectSQLite(Tortoise.get_connection("default"))
+    columns = [
+        Column(
+            name="id",
+            data_type="INTEGER",
+            null=False,
+            default=None,
+            pk=True,
+            unique=False,
+            index=False,
+        ),
+        Column(
+            name="from_id",
+            data_type="INTEGER",
+            null=True,
+            default=None,
+            pk=False,
+            unique=False,
+            index=False,
+        ),
+        Column(
+            name="to",
+            data_type="INTEGER",
+            null=False,
+            default=None,
+            pk=False,
+            unique=False,
+            index=False,
+        ),
+        Column(
+            name="slug",
+            data_type="VARCHAR",
+            null=False,
+            default=None,
+            pk=False,
+            unique=False,
+            index=False,
+            length=20,
+        ),
+    ]
+    constraints = Constraints()
+    constraints.add_foreign_key(ForeignKey("from_id", "user", "id", "set null"))
+    constraints.add_foreign_key(ForeignKey("to", "user", None))
+    constraints.add_index(["to"], True)
+    constraints.add_index(["to", "slug"], False)
+    constraints.apply(columns)
+    assert inspect.model_source("transfer", columns, constraints) == (
+        "class Transfer(Model):\n"
+        "    id = fields.IntField(pk=True, )\n"
+        '    from_ = fields.ForeignKeyField("models.User", related_name="transfer_from_", '
+        'source_field="from_id", null=True, on_delete=fields.SET_NULL, )\n'
+        '    to = fields.OneToOneField("models.User", related_name="transfer_to", '
+        'source_field="to", )\n'
+        "    slug = fields.CharField(max_length=20, )\n"
+        "\n"
+        "    class Meta:\n"
+        '        indexes = (("to_id", "slug"),)'
+    )
@@ -1,16 +1,36 @@
 from pathlib import Path
 from typing import List, cast
 
+import asyncclick as click
 import pytest
 import tortoise
 from pytest_mock import MockerFixture
 
+from aerich.backfill import Backfill
+from aerich.coder import decoder, encoder
 from aerich.ddl.mysql import MysqlDDL
 from aerich.ddl.postgres import PostgresDDL
 from aerich.ddl.sqlite import SqliteDDL
-from aerich.exceptions import NotSupportError
-from aerich.migrate import MIGRATE_TEMPLATE, Migrate
-from aerich.utils import get_models_describe
+from aerich.exceptions import SnapshotError
+from aerich.migrate import CONTRACT_TEMPLATE, MIGRATE_TEMPLATE, Migrate
+from aerich.models import Aerich
+from aerich.operations import (
+    AddFK,
+    AddIndex,
+    AlterTable,
+    CreateTable,
+    DropFK,
+    DropIndex,
+    Operation,
+    RebuildTable,
+)
+from aerich.utils import (
+    get_model_fingerprint,
+    get_models_describe,
+    import_py_file,
+    split_sql,
+)
+from tests.models import Category, Email
 
 old_models_describe = {
     "models.Category": {
@@ -819,175 +839,124 @@ def test_migrate(mocker: MockerFixture):
     - alter default: Config.status
     - rename column: Product.image -> Product.pic
     """
-    mocker.patch("click.prompt", side_effect=(True,))
+    mocker.patch("asyncclick.prompt", side_effect=(True,))
 
     models_describe = get_models_describe("models")
     Migrate.app = "models"
-    if isinstance(Migrate.ddl, SqliteDDL):
-        with pytest.raises(NotSupportError):
-            Migrate.diff_models(old_models_describe, models_describe)
-        with pytest.raises(NotSupportError):
-            Migrate.diff_models(models_describe, old_models_describe, False)
-    else:
-        Migrate.diff_models(old_models_describe, models_describe)
-        Migrate.diff_models(models_describe, old_models_describe, False)
+    Migrate.diff_models(old_models_describe, models_describe)
+    Migrate.diff_models(models_describe, old_models_describe, False)
     Migrate._merge_operators()
     if isinstance(Migrate.ddl, MysqlDDL):
+        # column changes of a table are merged into a single ALTER TABLE
+        category_user_id = (
+            ", MODIFY COLUMN `user_id` INT NOT NULL  COMMENT 'User'"
+            if should_add_user_id_column_type_alter_sql()
+            else ""
+        )
         expected_upgrade_operators = {
-            "ALTER TABLE `category` MODIFY COLUMN `name` VARCHAR(200)",
-            "ALTER TABLE `category` MODIFY COLUMN `slug` VARCHAR(100) NOT NULL",
             "ALTER TABLE `category` DROP INDEX `title`",
-            "ALTER TABLE `config` ADD `user_id` INT NOT NULL  COMMENT 'User'",
+            "ALTER TABLE `category` MODIFY COLUMN `slug` VARCHAR(100) NOT NULL, MODIFY COLUMN `name` VARCHAR(200), MODIFY COLUMN `created_at` DATETIME(6) NOT NULL  DEFAULT CURRENT_TIMESTAMP(6)"
+            + category_user_id,
             "ALTER TABLE `config` ADD CONSTRAINT `fk_config_user_17daa970` FOREIGN KEY (`user_id`) REFERENCES `user` (`id`) ON DELETE CASCADE",
-            "ALTER TABLE `config` ALTER COLUMN `status` DROP DEFAULT",
-            "ALTER TABLE `config` MODIFY COLUMN `value` JSON NOT NULL",
-            "ALTER TABLE `email` ADD `address` VARCHAR(200) NOT NULL",
-            "ALTER TABLE `email` DROP COLUMN `user_id`",
+            "ALTER TABLE `config` ADD `user_id` INT NOT NULL  COMMENT 'User', MODIFY COLUMN `value` JSON NOT NULL, ALTER COLUMN `status` DROP DEFAULT",
             "ALTER TABLE `configs` RENAME TO `config`",
-            "ALTER TABLE `product` RENAME COLUMN `image` TO `pic`",
+            "ALTER TABLE `email` ADD INDEX `idx_email_email_4a1a33` (`email`)",
+            "ALTER TABLE `email` ADD `address` VARCHAR(200) NOT NULL, DROP COLUMN `user_id`, MODIFY COLUMN `is_primary` BOOL NOT NULL  DEFAULT 0",
             "ALTER TABLE `email` RENAME COLUMN `id` TO `email_id`",
             "ALTER TABLE `product` ADD INDEX `idx_product_name_869427` (`name`, `type_db_alias`)",
-            "ALTER TABLE `email` ADD INDEX `idx_email_email_4a1a33` (`email`)",
             "ALTER TABLE `product` ADD UNIQUE INDEX `uid_product_name_869427` (`name`, `type_db_alias`)",
-            "ALTER TABLE `product` ALTER COLUMN `view_num` SET DEFAULT 0",
-            "ALTER TABLE `product` MODIFY COLUMN `created_at` DATETIME(6) NOT NULL  DEFAULT CURRENT_TIMESTAMP(6)",
-            "ALTER TABLE `product` MODIFY COLUMN `is_reviewed` BOOL NOT NULL  COMMENT 'Is Reviewed'",
-            "ALTER TABLE `user` DROP COLUMN `avatar`",
-            "ALTER TABLE `user` MODIFY COLUMN `password` VARCHAR(100) NOT NULL",
-            "ALTER TABLE `user` MODIFY COLUMN `intro` LONGTEXT NOT NULL",
-            "ALTER TABLE `user` MODIFY COLUMN `last_login` DATETIME(6) NOT NULL  COMMENT 'Last Login'",
-            "ALTER TABLE `user` MODIFY COLUMN `is_active` BOOL NOT NULL  COMMENT 'Is Active' DEFAULT 1",
-            "ALTER TABLE `user` MODIFY COLUMN `is_superuser` BOOL NOT NULL  COMMENT 'Is SuperUser' DEFAULT 0",
-            "ALTER TABLE `user` MODIFY COLUMN `longitude` DECIMAL(10,8) NOT NULL",
+            "ALTER TABLE `product` ALTER COLUMN `view_num` SET DEFAULT 0, MODIFY COLUMN `is_reviewed` BOOL NOT NULL  COMMENT 'Is Reviewed', MODIFY COLUMN `body` LONGTEXT NOT NULL, MODIFY COLUMN `created_at` DATETIME(6) NOT NULL  DEFAULT CURRENT_TIMESTAMP(6)",
+            "ALTER TABLE `product` RENAME COLUMN `image` TO `pic`",
             "ALTER TABLE `user` ADD UNIQUE INDEX `username` (`username`)",
-            "CREATE TABLE `email_user` (\n    `email_id` INT NOT NULL REFERENCES `email` (`email_id`) ON DELETE CASCADE,\n    `user_id` INT NOT NULL REFERENCES `user` (`id`) ON DELETE CASCADE\n) CHARACTER SET utf8mb4",
+            "ALTER TABLE `user` DROP COLUMN `avatar`, MODIFY COLUMN `password` VARCHAR(100) NOT NULL, MODIFY COLUMN `last_login` DATETIME(6) NOT NULL  COMMENT 'Last Login', MODIFY COLUMN `is_active` BOOL NOT NULL  COMMENT 'Is Active' DEFAULT 1, MODIFY COLUMN `is_superuser` BOOL NOT NULL  COMMENT 'Is SuperUser' DEFAULT 0, MODIFY COLUMN `intro` LONGTEXT NOT NULL, MODIFY COLUMN `longitude` DECIMAL(10,8) NOT NULL",
             "CREATE TABLE IF NOT EXISTS `newmodel` (\n    `id` INT NOT NULL PRIMARY KEY AUTO_INCREMENT,\n    `name` VARCHAR(50) NOT NULL\n) CHARACTER SET utf8mb4",
-            "ALTER TABLE `category` MODIFY COLUMN `created_at` DATETIME(6) NOT NULL  DEFAULT CURRENT_TIMESTAMP(6)",
-            "ALTER TABLE `product` MODIFY COLUMN `body` LONGTEXT NOT NULL",
-            "ALTER TABLE `email` MODIFY COLUMN `is_primary` BOOL NOT NULL  DEFAULT 0",
+            "CREATE TABLE `email_user` (\n    `email_id` INT NOT NULL REFERENCES `email` (`email_id`) ON DELETE CASCADE,\n    `user_id` INT NOT NULL REFERENCES `user` (`id`) ON DELETE CASCADE\n) CHARACTER SET utf8mb4",
         }
         expected_downgrade_operators = {
-            "ALTER TABLE `category` MODIFY COLUMN `name` VARCHAR(200) NOT NULL",
-            "ALTER TABLE `category` MODIFY COLUMN `slug` VARCHAR(200) NOT NULL",
             "ALTER TABLE `category` ADD UNIQUE INDEX `title` (`title`)",
-            "ALTER TABLE `config` DROP COLUMN `user_id`",
+            "ALTER TABLE `category` MODIFY COLUMN `slug` VARCHAR(200) NOT NULL, MODIFY COLUMN `name` VARCHAR(200) NOT NULL, MODIFY COLUMN `created_at` DATETIME(6) NOT NULL  DEFAULT CURRENT_TIMESTAMP(6)"
+            + category_user_id,
+            "ALTER TABLE `config` DROP COLUMN `user_id`, MODIFY COLUMN `value` TEXT NOT NULL, ALTER COLUMN `status` SET DEFAULT 1",
             "ALTER TABLE `config` DROP FOREIGN KEY `fk_config_user_17daa970`",
-            "ALTER TABLE `config` ALTER COLUMN `status` SET DEFAULT 1",
-            "ALTER TABLE `email` ADD `user_id` INT NOT NULL",
-            "ALTER TABLE `email` DROP COLUMN `address`",
             "ALTER TABLE `config` RENAME TO `configs`",
-            "ALTER TABLE `product` RENAME COLUMN `pic` TO `image`",
+            "ALTER TABLE `email` ADD `user_id` INT NOT NULL, DROP COLUMN `address`, MODIFY COLUMN `is_primary` BOOL NOT NULL  DEFAULT 0",
+            "ALTER TABLE `email` DROP INDEX `idx_email_email_4a1a33`",
             "ALTER TABLE `email` RENAME COLUMN `email_id` TO `id`",
+            "ALTER TABLE `product` ALTER COLUMN `view_num` DROP DEFAULT, MODIFY COLUMN `is_reviewed` BOOL NOT NULL  COMMENT 'Is Reviewed', MODIFY COLUMN `body` LONGTEXT NOT NULL, MODIFY COLUMN `created_at` DATETIME(6) NOT NULL  DEFAULT CURRENT_TIMESTAMP(6)",
             "ALTER TABLE `product` DROP INDEX `idx_product_name_869427`",
-            "ALTER TABLE `email` DROP INDEX `idx_email_email_4a1a33`",
             "ALTER TABLE `product` DROP INDEX `uid_product_name_869427`",
-            "ALTER TABLE `product` ALTER COLUMN `view_num` DROP DEFAULT",
-            "ALTER TABLE `user` ADD `avatar` VARCHAR(200) NOT NULL  DEFAULT ''",
+            "ALTER TABLE `product` RENAME COLUMN `pic` TO `image`",
+            "ALTER TABLE `user` ADD `avatar` VARCHAR(200) NOT NULL  DEFAULT '', MODIFY COLUMN `password` VARCHAR(200) NOT NULL, MODIFY COLUMN `last_login` DATETIME(6) NOT NULL  COMMENT 'Last Login', MODIFY COLUMN `is_active` BOOL NOT NULL  COMMENT 'Is Active' DEFAULT 1, MODIFY COLUMN `is_superuser` BOOL NOT NULL  COMMENT 'Is SuperUser' DEFAULT 0, MODIFY COLUMN `intro` LONGTEXT NOT NULL, MODIFY COLUMN `longitude` DECIMAL(12,9) NOT NULL",
             "ALTER TABLE `user` DROP INDEX `username`",
-            "ALTER TABLE `user` MODIFY COLUMN `password` VARCHAR(200) NOT NULL",
             "DROP TABLE IF EXISTS `email_user`",
             "DROP TABLE IF EXISTS `newmodel`",
-            "ALTER TABLE `user` MODIFY COLUMN `intro` LONGTEXT NOT NULL",
-            "ALTER TABLE `config` MODIFY COLUMN `value` TEXT NOT NULL",
-            "ALTER TABLE `category` MODIFY COLUMN `created_at` DATETIME(6) NOT NULL  DEFAULT CURRENT_TIMESTAMP(6)",
-            "ALTER TABLE `product` MODIFY COLUMN `created_at` DATETIME(6) NOT NULL  DEFAULT CURRENT_TIMESTAMP(6)",
-            "ALTER TABLE `product` MODIFY COLUMN `is_reviewed` BOOL NOT NULL  COMMENT 'Is Reviewed'",
-            "ALTER TABLE `user` MODIFY COLUMN `last_login` DATETIME(6) NOT NULL  COMMENT 'Last Login'",
-            "ALTER TABLE `user` MODIFY COLUMN `is_active` BOOL NOT NULL  COMMENT 'Is Active' DEFAULT 1",
-            "ALTER TABLE `user` MODIFY COLUMN `is_superuser` BOOL NOT NULL  COMMENT 'Is SuperUser' DEFAULT 0",
-            "ALTER TABLE `user` MODIFY COLUMN `longitude` DECIMAL(12,9) NOT NULL",
-            "ALTER TABLE `product` MODIFY COLUMN `body` LONGTEXT NOT NULL",
-            "ALTER TABLE `email` MODIFY COLUMN `is_primary` BOOL NOT NULL  DEFAULT 0",
         }
-        if should_add_user_id_column_type_alter_sql():
-            sql = "ALTER TABLE `category` MODIFY COLUMN `user_id` INT NOT NULL  COMMENT 'User'"
-            expected_upgrade_operators.add(sql)
-            expected_downgrade_operators.add(sql)
         assert not set(Migrate.upgrade_operators).symmetric_difference(expected_upgrade_operators)
-
         assert not set(Migrate.downgrade_operators).symmetric_difference(
             expected_downgrade_operators
         )
 
     elif isinstance(Migrate.ddl, PostgresDDL):
+        # column changes of a table are merged into a single ALTER TABLE
+        category_user_id = (
+            ', ALTER COLUMN "user_id" TYPE INT USING "user_id"::INT'
+            if should_add_user_id_column_type_alter_sql()
+            else ""
+        )
         expected_upgrade_operators = {
-            'DROP INDEX "uid_category_title_f7fc03"',
-            'ALTER TABLE "category" ALTER COLUMN "name" DROP NOT NULL',
-            'ALTER TABLE "category" ALTER COLUMN "slug" TYPE VARCHAR(100) USING "slug"::VARCHAR(100)',
-            'ALTER TABLE "category" ALTER COLUMN "created_at" TYPE TIMESTAMPTZ USING "created_at"::TIMESTAMPTZ',
-            'ALTER TABLE "config" ADD "user_id" INT NOT NULL',
+            'ALTER TABLE "category" ALTER COLUMN "slug" TYPE VARCHAR(100) USING "slug"::VARCHAR(100), ALTER COLUMN "name" DROP NOT NULL, ALTER COLUMN "created_at" TYPE TIMESTAMPTZ USING "created_at"::TIMESTAMPTZ'
+            + category_user_id,
+            'ALTER TABLE "config" ADD "user_id" INT NOT NULL, ALTER COLUMN "value" TYPE JSONB USING "value"::JSONB, ALTER COLUMN "status" DROP DEFAULT',
             'ALTER TABLE "config" ADD CONSTRAINT "fk_config_user_17daa970" FOREIGN KEY ("user_id") REFERENCES "user" ("id") ON DELETE CASCADE',
-            'ALTER TABLE "config" ALTER COLUMN "status" DROP DEFAULT',
-            'ALTER TABLE "config" ALTER COLUMN "value" TYPE JSONB USING "value"::JSONB',
             'ALTER TABLE "configs" RENAME TO "config"',
-            'ALTER TABLE "email" ADD "address" VARCHAR(200) NOT NULL',
-            'ALTER TABLE "email" DROP COLUMN "user_id"',
+            'ALTER TABLE "email" ADD "address" VARCHAR(200) NOT NULL, DROP COLUMN "user_id", ALTER COLUMN "is_primary" TYPE BOOL USING "is_primary"::BOOL',
             'ALTER TABLE "email" RENAME COLUMN "id" TO "email_id"',
-            'ALTER TABLE "email" ALTER COLUMN "is_primary" TYPE BOOL USING "is_primary"::BOOL',
-            'ALTER TABLE "product" ALTER COLUMN "view_num" SET DEFAULT 0',
+            'ALTER TABLE "product" ALTER COLUMN "view_num" SET DEFAULT 0, ALTER COLUMN "is_reviewed" TYPE BOOL USING "is_reviewed"::BOOL, ALTER COLUMN "body" TYPE TEXT USING "body"::TEXT, ALTER COLUMN "created_at" TYPE TIMESTAMPTZ USING "created_at"::TIMESTAMPTZ',
             'ALTER TABLE "product" RENAME COLUMN "image" TO "pic"',
-            'ALTER TABLE "product" ALTER COLUMN "is_reviewed" TYPE BOOL USING "is_reviewed"::BOOL',
-            'ALTER TABLE "product" ALTER COLUMN "body" TYPE TEXT USING "body"::TEXT',
-            'ALTER TABLE "product" ALTER COLUMN "created_at" TYPE TIMESTAMPTZ USING "created_at"::TIMESTAMPTZ',
-            'ALTER TABLE "user" ALTER COLUMN "password" TYPE VARCHAR(100) USING "password"::VARCHAR(100)',
-            'ALTER TABLE "user" DROP COLUMN "avatar"',
-            'ALTER TABLE "user" ALTER COLUMN "is_superuser" TYPE BOOL USING "is_superuser"::BOOL',
-            'ALTER TABLE "user" ALTER COLUMN "last_login" TYPE TIMESTAMPTZ USING "last_login"::TIMESTAMPTZ',
-            'ALTER TABLE "user" ALTER COLUMN "intro" TYPE TEXT USING "intro"::TEXT',
-            'ALTER TABLE "user" ALTER COLUMN "is_active" TYPE BOOL USING "is_active"::BOOL',
-            'ALTER TABLE "user" ALTER COLUMN "longitude" TYPE DECIMAL(10,8) USING "longitude"::DECIMAL(10,8)',
-            'CREATE INDEX "idx_product_name_869427" ON "product" ("name", "type_db_alias")',
+            'ALTER TABLE "user" DROP COLUMN "avatar", ALTER COLUMN "password" TYPE VARCHAR(100) USING "password"::VARCHAR(100), ALTER COLUMN "last_login" TYPE TIMESTAMPTZ USING "last_login"::TIMESTAMPTZ, ALTER COLUMN "is_active" TYPE BOOL USING "is_active"::BOOL, ALTER COLUMN "is_superuser" TYPE BOOL USING "is_superuser"::BOOL, ALTER COLUMN "intro" TYPE TEXT USING "intro"::TEXT, ALTER COLUMN "longitude" TYPE DECIMAL(10,8) USING "longitude"::DECIMAL(10,8)',
             'CREATE INDEX "idx_email_email_4a1a33" ON "email" ("email")',
+            'CREATE INDEX "idx_product_name_869427" ON "product" ("name", "type_db_alias")',
             'CREATE TABLE "email_user" (\n    "email_id" INT NOT NULL REFERENCES "email" ("email_id") ON DELETE CASCADE,\n    "user_id" INT NOT NULL REFERENCES "user" ("id") ON DELETE CASCADE\n)',
             'CREATE TABLE IF NOT EXISTS "newmodel" (\n    "id" SERIAL NOT NULL PRIMARY KEY,\n    "name" VARCHAR(50) NOT NULL\n);\nCOMMENT ON COLUMN "config"."user_id" IS \'User\'',
             'CREATE UNIQUE INDEX "uid_product_name_869427" ON "product" ("name", "type_db_alias")',
             'CREATE UNIQUE INDEX "uid_user_usernam_9987ab" ON "user" ("username")',
+            'DROP INDEX "uid_category_title_f7fc03"',
         }
         expected_downgrade_operators = {
-            'CREATE UNIQUE INDEX "uid_category_title_f7fc03" ON "category" ("title")',
-            'ALTER TABLE "category" ALTER COLUMN "name" SET NOT NULL',
-            'ALTER TABLE "category" ALTER COLUMN "slug" TYPE VARCHAR(200) USING "slug"::VARCHAR(200)',
-            'ALTER TABLE "category" ALTER COLUMN "created_at" TYPE TIMESTAMPTZ USING "created_at"::TIMESTAMPTZ',
-            'ALTER TABLE "config" ALTER COLUMN "status" SET DEFAULT 1',
-            'ALTER TABLE "config" DROP COLUMN "user_id"',
+            'ALTER TABLE "category" ALTER COLUMN "slug" TYPE VARCHAR(200) USING "slug"::VARCHAR(200), ALTER COLUMN "name" SET NOT NULL, ALTER COLUMN "created_at" TYPE TIMESTAMPTZ USING "created_at"::TIMESTAMPTZ'
+            + category_user_id,
+            'ALTER TABLE "config" DROP COLUMN "user_id", ALTER COLUMN "value" TYPE JSONB USING "value"::JSONB, ALTER COLUMN "status" SET DEFAULT 1',
             'ALTER TABLE "config" DROP CONSTRAINT "fk_config_user_17daa970"',
             'ALTER TABLE "config" RENAME TO "configs"',
-            'ALTER TABLE "config" ALTER COLUMN "value" TYPE JSONB USING "value"::JSONB',
-            'ALTER TABLE "email" ADD "user_id" INT NOT NULL',
-            'ALTER TABLE "email" DROP COLUMN "address"',
+            'ALTER TABLE "email" ADD "user_id" INT NOT NULL, DROP COLUMN "address", ALTER COLUMN "is_primary" TYPE BOOL USING "is_primary"::BOOL',
             'ALTER TABLE "email" RENAME COLUMN "email_id" TO "id"',
-            'ALTER TABLE "email" ALTER COLUMN "is_primary" TYPE BOOL USING "is_primary"::BOOL',
-            'ALTER TABLE "product" ALTER COLUMN "view_num" DROP DEFAULT',
+            'ALTER TABLE "product" ALTER COLUMN "view_num" DROP DEFAULT, ALTER COLUMN "is_reviewed" TYPE BOOL USING "is_reviewed"::BOOL, ALTER COLUMN "body" TYPE TEXT USING "body"::TEXT, ALTER COLUMN "created_at" TYPE TIMESTAMPTZ USING "created_at"::TIMESTAMPTZ',
             'ALTER TABLE "product" RENAME COLUMN "pic" TO "image"',
-            'ALTER TABLE "user" ADD "avatar" VARCHAR(200) NOT NULL  DEFAULT \'\'',
-            'ALTER TABLE "user" ALTER COLUMN "password" TYPE VARCHAR(200) USING "password"::VARCHAR(200)',
-            'ALTER TABLE "user" ALTER COLUMN "last_login" TYPE TIMESTAMPTZ USING "last_login"::TIMESTAMPTZ',
-            'ALTER TABLE "user" ALTER COLUMN "is_superuser" TYPE BOOL USING "is_superuser"::BOOL',
-            'ALTER TABLE "user" ALTER COLUMN "is_active" TYPE BOOL USING "is_active"::BOOL',
-            'ALTER TABLE "user" ALTER COLUMN "intro" TYPE TEXT USING "intro"::TEXT',
-            'ALTER TABLE "user" ALTER COLUMN "longitude" TYPE DECIMAL(12,9) USING "longitude"::DECIMAL(12,9)',
-            'ALTER TABLE "product" ALTER COLUMN "created_at" TYPE TIMESTAMPTZ USING "created_at"::TIMESTAMPTZ',
-            'ALTER TABLE "product" ALTER COLUMN "is_reviewed" TYPE BOOL USING "is_reviewed"::BOOL',
-            'ALTER TABLE "product" ALTER COLUMN "body" TYPE TEXT USING "body"::TEXT',
-            'DROP INDEX "idx_product_name_869427"',
+            'ALTER TABLE "user" ADD "avatar" VARCHAR(200) NOT NULL  DEFAULT \'\', ALTER COLUMN "password" TYPE VARCHAR(200) USING "password"::VARCHAR(200), ALTER COLUMN "last_login" TYPE TIMESTAMPTZ USING "last_login"::TIMESTAMPTZ, ALTER COLUMN "is_active" TYPE BOOL USING "is_active"::BOOL, ALTER COLUMN "is_superuser" TYPE BOOL USING "is_superuser"::BOOL, ALTER COLUMN "intro" TYPE TEXT USING "intro"::TEXT, ALTER COLUMN "longitude" TYPE DECIMAL(12,9) USING "longitude"::DECIMAL(12,9)',
+            'CREATE UNIQUE INDEX "uid_category_title_f7fc03" ON "category" ("title")',
             'DROP INDEX "idx_email_email_4a1a33"',
-            'DROP INDEX "uid_user_usernam_9987ab"',
+            'DROP INDEX "idx_product_name_869427"',
             'DROP INDEX "uid_product_name_869427"',
+            'DROP INDEX "uid_user_usernam_9987ab"',
             'DROP TABLE IF EXISTS "email_user"',
             'DROP TABLE IF EXISTS "newmodel"',
         }
-        if should_add_user_id_column_type_alter_sql():
-            sql = 'ALTER TABLE "category" ALTER COLUMN "user_id" TYPE INT USING "user_id"::INT'
-            expected_upgrade_operators.add(sql)
-            expected_downgrade_operators.add(sql)
         assert not set(Migrate.upgrade_operators).symmetric_difference(expected_upgrade_operators)
         assert not set(Migrate.downgrade_operators).symmetric_difference(
             expected_downgrade_operators
         )
 
     elif isinstance(Migrate.ddl, SqliteDDL):
-        assert Migrate.upgrade_operators == []
-        assert Migrate.downgrade_operators == []
+        # columns are altered by a single rebuild of each table, after other operators
+        rebuilds = [
+            cast(str, x.table) for x in Migrate.upgrade_operators if isinstance(x, RebuildTable)
+        ]
+        assert sorted(rebuilds) == ["category", "config", "email", "product", "user"]
+        assert all(isinstance(x, RebuildTable) for x in Migrate.upgrade_operators[-5:])
+        rebuilds = [
+            cast(str, x.table) for x in Migrate.downgrade_operators if isinstance(x, RebuildTable)
+        ]
+        assert sorted(rebuilds) == ["category", "configs", "email", "product", "user"]
 
 
 def test_sort_all_version_files(mocker):
@@ -1021,3 +990,323 @@ async def test_empty_migration(mocker, tmp_path: Path) -> None:
 
     f = tmp_path / migration_file
     assert f.read_text() == expected_content
+
+
+async def test_snapshot_deltas() -> None:
+    Migrate.app = "snapshot"
+    Migrate.snapshot_interval = 3
+    try:
+        for i in range(5):
+            content = get_models_describe("models")
+            content["models.Category"]["description"] = f"version {i}"
+            content.pop(f"models.{Migrate._aerich}")
+            await Aerich.create(
+                version=f"{i}_20240101000000_update.py",
+                app=Migrate.app,
+                content=await Migrate.build_snapshot(content),
+            )
+            last_version = await Migrate.get_last_version()
+            assert last_version and last_version.content == decoder(encoder(content))
+
+        rows = await Aerich.filter(app=Migrate.app)
+        assert [cast(dict, row.content)["snapshot"] for row in rows] == [
+            "delta",
+            "full",
+            "delta",
+            "delta",
+            "full",
+        ]
+        # base of the last delta is deleted
+        await rows[1].delete()
+        with pytest.raises(SnapshotError):
+            await Migrate.get_last_version()
+        snapshot = await Migrate.build_snapshot(content)
+        assert snapshot["snapshot"] == "full"
+    finally:
+        Migrate.snapshot_interval = 0
+        await Aerich.filter(app="snapshot").delete()
+
+
+def test_rename_candidates() -> None:
+    data_fields = cast(List[dict], old_models_describe["models.Category"]["data_fields"])
+    candidates = Migrate.get_rename_candidates(data_fields)
+    # slug and name are both VARCHAR(200) NOT NULL
+    slug = dict(data_fields[0], name="new_slug", db_column="new_slug")
+    assert candidates[Migrate.get_rename_signature(slug)] == data_fields[:2]
+    title = dict(data_fields[-1], name="new_title", db_column="new_title")
+    assert candidates[Migrate.get_rename_signature(title)] == data_fields[-1:]
+    title["description"] = "Title"
+    assert Migrate.get_rename_signature(title) not in candidates
+
+
+def test_unchanged_models_skipped(mocker: MockerFixture) -> None:
+    Migrate.app = "models"
+    models_describe = get_models_describe("models")
+    last_version = decoder(encoder(models_describe))
+    for describe in last_version.values():
+        # versions stored before fingerprints were added
+        fingerprint = describe.pop("fingerprint")
+        assert get_model_fingerprint(describe) == fingerprint
+    get_model = mocker.spy(Migrate, "_get_model")
+    Migrate.diff_models(last_version, models_describe)
+    Migrate.diff_models(models_describe, last_version, False)
+    assert get_model.call_count == 0
+    assert not Migrate.upgrade_operators and not Migrate.downgrade_operators
+
+
+def test_migrate_instance_state() -> None:
+    migrate = Migrate("models")
+    migrate.ddl = Migrate.ddl
+    models_describe = get_models_describe("models")
+    last_version = decoder(encoder(models_describe))
+    last_version.pop("models.Config")
+    migrate.diff_models(last_version, models_describe)
+    assert len(migrate.upgrade_operators) == 1
+    assert migrate.upgrade_operators[0].startswith("CREATE TABLE")
+    assert Migrate.upgrade_operators == []
+    assert Migrate("models").upgrade_operators == []
+
+
+def test_merge_operators() -> None:
+    add_index = AddIndex('CREATE INDEX "idx_address_code" ON "address" ("code")', "address")
+    drop_fk = DropFK('ALTER TABLE "address" DROP CONSTRAINT "fk_address_add_on"', "address")
+    drop_index = DropIndex('DROP INDEX "idx_address_created"', "address")
+    add_fk = AddFK('ALTER TABLE "address" ADD CONSTRAINT "fk_address_add_on"', "address")
+    add_column = 'ALTER TABLE "address" ADD "code" INT NOT NULL'
+    for operator in (add_index, add_column, drop_fk, drop_index):
+        Migrate._add_operator(operator)
+    Migrate._add_operator(add_fk.replace_sql(add_fk + ";"))
+    Migrate._merge_operators()
+    assert Migrate.upgrade_operators == [drop_fk, drop_index, add_column, add_index, add_fk]
+    assert isinstance(Migrate.upgrade_operators[-1], AddFK)
+    assert Migrate.upgrade_operators[-1].table == "address"
+
+
+def test_dependency_waves() -> None:
+    create_category = CreateTable('CREATE TABLE "category" ()', "category", ("user",))
+    create_user = CreateTable('CREATE TABLE "user" ()', "user")
+    add_column = Operation('ALTER TABLE "product" ADD "code" INT', "product")
+    add_index = AddIndex('CREATE INDEX "idx_product_code" ON "product" ("code")', "product")
+    add_fk = AddFK('ALTER TABLE "config" ADD CONSTRAINT "fk"', "config", ("user",))
+    for operator in (add_fk, create_category, add_index, add_column, create_user):
+        Migrate._add_operator(operator)
+    Migrate._merge_operators()
+    assert Migrate.upgrade_operators == [
+        add_column,
+        create_user,
+        create_category,
+        add_fk,
+        add_index,
+    ]
+    assert Migrate.upgrade_waves == [2, 3]
+    assert Migrate._get_diff_file_content().endswith("\nUPGRADE_WAVES = [2, 3]\n")
+
+
+def test_dependency_waves_of_statements() -> None:
+    migrate = Migrate("models")
+    migrate.ddl = PostgresDDL(Migrate.ddl.client)
+    # CREATE TABLE with CREATE INDEX, and with COMMENT ON
+    create_email = migrate.add_model(Email)
+    create_category = migrate.add_model(Category)
+    add_index = AddIndex('CREATE INDEX "idx_product_code" ON "product" ("code")', "product")
+    for operator in (create_email, create_category, add_index):
+        migrate._add_operator(operator)
+    migrate._merge_operators()
+    assert migrate.upgrade_operators == [create_email, create_category, add_index]
+    statements = split_sql(";\n".join(migrate.upgrade_operators))
+    assert migrate.upgrade_waves == [1, 2, 2]
+    assert sum(migrate.upgrade_waves) == len(statements) == 5
+    assert statements[0].startswith('CREATE TABLE IF NOT EXISTS "email"')
+    assert statements[1].startswith('CREATE INDEX IF NOT EXISTS "idx_email_email')
+    assert statements[2].startswith('CREATE TABLE IF NOT EXISTS "category"')
+    assert statements[3].startswith('COMMENT ON COLUMN "category"."user_id"')
+    assert statements[4] == add_index
+
+
+def test_coalesce_operators() -> None:
+    migrate = Migrate("models")
+    migrate.ddl = PostgresDDL(Migrate.ddl.client)
+    add_code = AlterTable('ALTER TABLE "product" ADD "code" INT', "product")
+    add_user = AlterTable('ALTER TABLE "user" ADD "age" INT', "user")
+    set_default = AlterTable('ALTER TABLE "product" ALTER COLUMN "code" SET DEFAULT 0', "product")
+    add_index = AddIndex('CREATE INDEX "idx_product_code" ON "product" ("code")', "product")
+    rename = Operation('ALTER TABLE "product" RENAME COLUMN "name" TO "title"', "product")
+    drop_column = AlterTable('ALTER TABLE "product" DROP COLUMN "body"', "product")
+    for operator in (add_code, add_index, add_user, set_default, rename, drop_column):
+        migrate._add_operator(operator)
+    migrate._merge_operators()
+    # changes are merged across other tables and indexes, but not across the rename
+    assert migrate.upgrade_operators == [
+        'ALTER TABLE "product" ADD "code" INT, ALTER COLUMN "code" SET DEFAULT 0',
+        add_user,
+        rename,
+        drop_column,
+        add_index,
+    ]
+    assert isinstance(migrate.upgrade_operators[0], AlterTable)
+    assert migrate.upgrade_operators[0].table == "product"
+
+
+def test_non_transactional_operators() -> None:
+    add_column = Operation('ALTER TABLE "product" ADD "code" INT', "product")
+    add_index = AddIndex(
+        'CREATE INDEX CONCURRENTLY "idx_product_code" ON "product" ("code")',
+        "product",
+        transactional=False,
+    )
+    drop_index = DropIndex(
+        'DROP INDEX CONCURRENTLY IF EXISTS "idx_user_name"', "user", transactional=False
+    )
+    for operator in (add_index, drop_index, add_column):
+        Migrate._add_operator(operator)
+    Migrate._merge_operators()
+    assert Migrate.upgrade_operators == [add_column, drop_index, add_index]
+    assert Migrate.upgrade_non_transactional == 2
+    assert Migrate._get_diff_file_content().endswith(
+        "\nUPGRADE_NON_TRANSACTIONAL = 2\nDOWNGRADE_NON_TRANSACTIONAL = 0\n"
+    )
+
+
+async def test_expand_contract(mocker: MockerFixture, tmp_path: Path) -> None:
+    mocker.patch("asyncclick.prompt", return_value=True)
+    models_describe = get_models_describe("models")
+    last_version = decoder(encoder(models_describe))
+    config = last_version["models.Config"]
+    config.pop("fingerprint")
+    label = config["data_fields"][0]
+    # label was name, note is dropped
+    config["data_fields"][0] = dict(label, name="name", db_column="name")
+    config["data_fields"].append(
+        dict(
+            label,
+            name="note",
+            db_column="note",
+            constraints={"max_length": 50},
+            db_field_types={"": "VARCHAR(50)"},
+        )
+    )
+    migrate = Migrate("models")
+    migrate.ddl = PostgresDDL(Migrate.ddl.client)
+    migrate.migrate_location = tmp_path
+    migrate._last_version_content = last_version
+    mocker.patch.object(migrate, "_get_last_version_num", return_value=1)
+
+    ret = await migrate.migrate("rename", False, expand_contract=True)
+    expand, contract = ret.split(" and ")
+    assert expand.startswith("2_") and expand.endswith("_rename_expand.py")
+    assert contract.startswith("3_") and contract.endswith("_rename_contract.py")
+    assert migrate.get_cache().get_expand_version(contract) == expand
+
+    model = migrate._get_model("Config")
+    trigger = migrate.ddl.add_dual_write(model, "name", "label")
+    drop_trigger = migrate.ddl.drop_dual_write(model, "name", "label")
+    module = import_py_file(tmp_path / expand)
+    assert repr(await module.upgrade(None)) == repr(
+        [
+            'ALTER TABLE "config" ADD "label" VARCHAR(200)',
+            *trigger,
+            Backfill("config", '"label" = "name"', where='"label" IS NULL', name="config.label"),
+        ]
+    )
+    assert await module.downgrade(None) == [
+        *drop_trigger,
+        'ALTER TABLE "config" DROP COLUMN "label", ALTER COLUMN "name" SET NOT NULL',
+    ]
+    module = import_py_file(tmp_path / contract)
+    assert await module.upgrade(None) == [
+        *drop_trigger,
+        'ALTER TABLE "config" DROP COLUMN "name", ALTER COLUMN "label" SET NOT NULL,'
+        ' DROP COLUMN "note"',
+    ]
+    assert repr(await module.downgrade(None)) == repr(
+        [
+            'ALTER TABLE "config" ADD "name" VARCHAR(200)',
+            *trigger,
+            'ALTER TABLE "config" ADD "note" VARCHAR(50) NOT NULL',
+            Backfill("config", '"name" = "label"', where='"name" IS NULL', name="config.name"),
+        ]
+    )
+
+
+async def test_expand_contract_drop_only(mocker: MockerFixture, tmp_path: Path) -> None:
+    models_describe = get_models_describe("models")
+    last_version = decoder(encoder(models_describe))
+    config = last_version["models.Config"]
+    config.pop("fingerprint")
+    label = config["data_fields"][0]
+    # note is dropped, there is nothing to expand
+    config["data_fields"].append(
+        dict(
+            label,
+            name="note",
+            db_column="note",
+            constraints={"max_length": 50},
+            db_field_types={"": "VARCHAR(50)"},
+        )
+    )
+    migrate = Migrate("models")
+    migrate.ddl = PostgresDDL(Migrate.ddl.client)
+    migrate.migrate_location = tmp_path
+    migrate._last_version_content = last_version
+    init = "1_20240101000000_init.py"
+    Path(tmp_path, init).write_text(
+        MIGRATE_TEMPLATE.format(upgrade_sql="", downgrade_sql=""), encoding="utf-8"
+    )
+    mocker.patch.object(
+        migrate, "get_last_version", return_value=Aerich(version=init, content=last_version)
+    )
+
+    ret = await migrate.migrate("drop", False, expand_contract=True)
+    expand, contract = ret.split(" and ")
+    assert expand.startswith("2_") and contract.startswith("3_")
+    assert await import_py_file(tmp_path / expand).upgrade(None) == []
+    assert migrate.get_cache().get_expand_version(contract) == expand
+    # migrating again before the expand migration is applied replaces both
+    migrate.reset()
+    expand, contract = (await migrate.migrate("drop", False, expand_contract=True)).split(" and ")
+    assert expand.startswith("2_") and contract.startswith("3_")
+    assert sorted(x.name for x in tmp_path.glob("*.py")) == [init, expand, contract]
+
+
+async def test_expand_contract_unsupported(tmp_path: Path) -> None:
+    migrate = Migrate("models")
+    migrate.ddl = SqliteDDL(Migrate.ddl.client)
+    migrate.migrate_location = tmp_path
+    with pytest.raises(click.UsageError):
+        await migrate.migrate("rename", False, expand_contract=True)
+    assert not list(tmp_path.glob("*.py"))
+
+
+async def test_get_last_version_num(tmp_path: Path, mocker: MockerFixture) -> None:
+    migrate = Migrate("models")
+    migrate.migrate_location = tmp_path
+    init, expand, contract = (
+        "0_20240101000000_init.py",
+        "1_20240102000000_update_expand.py",
+        "2_20240102000000_update_contract.py",
+    )
+    content = MIGRATE_TEMPLATE.format(upgrade_sql="", downgrade_sql="")
+    Path(tmp_path, init).write_text(content, encoding="utf-8")
+    Path(tmp_path, expand).write_text(content, encoding="utf-8")
+    Path(tmp_path, contract).write_text(
+        content + CONTRACT_TEMPLATE.format(expand_version=expand), encoding="utf-8"
+    )
+    query = mocker.spy(Aerich, "filter")
+    try:
+        await Aerich.create(version=init, app="models", content={})
+        assert await migrate._get_last_version_num() == 0
+        # the contract migration of the applied expand migration is kept
+        await Aerich.create(version=expand, app="models", content={})
+        assert await migrate._get_last_version_num() == 2
+        assert query.call_count == 2
+
+        # replacing the expand migration replaces its contract migration, files before it
+        # are not read
+        get_expand_version = mocker.spy(migrate.get_cache(), "get_expand_version")
+        await Aerich.filter(version=expand).delete()
+        version = await migrate._generate_diff_py("update_expand", content)
+        assert version.startswith("1_")
+        assert sorted(x.name for x in tmp_path.glob("*.py")) == [init, version]
+        assert init not in [x.args[0] for x in get_expand_version.call_args_list]
+    finally:
+        await Aerich.filter(app="models", version__in=[init, expand]).delete()
@@ -1,6 +1,19 @@
-from aerich.utils import import_py_file
+from aerich.utils import import_py_file, split_sql
 
 
 def test_import_py_file() -> None:
     m = import_py_file("aerich/utils.py")
     assert getattr(m, "import_py_file")
+
+
+def test_split_sql() -> None:
+    sql = """
+        CREATE TABLE "a" ("b" VARCHAR(10) DEFAULT 'c;''d') /* e; */;
+        -- f;
+        ALTER TABLE `g` ADD `h;` INT;
+        CREATE FUNCTION i() RETURNS trigger AS $$ BEGIN RETURN NEW; END; $$ LANGUAGE plpgsql;"""
+    assert split_sql(sql) == [
+        """CREATE TABLE "a" ("b" VARCHAR(10) DEFAULT 'c;''d') /* e; */""",
+        "-- f;\n        ALTER TABLE `g` ADD `h;` INT",
+        "CREATE FUNCTION i() RETURNS trigger AS $$ BEGIN RETURN NEW; END; $$ LANGUAGE plpgsql",
+    ]